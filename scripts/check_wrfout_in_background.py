@@ -8,17 +8,29 @@ If the file is successfully processed, the original file is removed.
 """
 
 import datetime
+import fnmatch
+import functools
 from pathlib import Path
 
 import click
 import netCDF4
 import os
+import signal
 import time
 import logging
 
+from setup_runs.inotify import Inotify, inotify_available
 from setup_runs.wrf.average_fields import average_fields
+from setup_runs.wrf.fair_pool import FairPool
+from setup_runs.wrf.publish import publish_file
+from setup_runs.wrf.variable_selection import selected_variables, unselectedActions
 
 
+POOL_POLL_INTERVAL = 0.1
+"""
+Number of seconds between checks for finished files while the worker pool is busy
+"""
+
 EXPECTED_TIMESTEPS = 12
 """
 Number of timesteps in a completed file
@@ -28,6 +40,11 @@ Derived from the `frames_per_outfile` variable in the WRF namelist
 
 logger = logging.getLogger("check_wrfout_in_background")
 
+schema_cache = {}
+"""
+Layout of the averaged files for each domain, shared by the files processed in this process
+"""
+
 
 def generate_out_filename(in_file: str):
     """
@@ -48,7 +65,17 @@ def generate_out_filename(in_file: str):
     return out_file, time_str
 
 
-def process_file(in_file: Path, expected_steps: int | None):
+def process_file(
+    in_file: Path,
+    expected_steps: int | None,
+    variables: set[str] | None = None,
+    unselected: str = "drop",
+    schemas: dict | None = None,
+    publish_dir: str | None = None,
+    publish_start: datetime.datetime | None = None,
+    publish_end: datetime.datetime | None = None,
+    simulation_start_date: datetime.datetime | None = None,
+):
     """
     Process a WRF output file into a single time step
 
@@ -59,7 +86,25 @@ def process_file(in_file: Path, expected_steps: int | None):
     expected_steps
         The number of time steps expected in the input file
         Ignored if None.
+    variables
+        The variables to average (all variables if None)
+    unselected
+        What to do with the other variables ('drop' or 'first')
+    schemas
+        Cache of the output layout for each domain, shared between files
+        (defaults to the cache for this process)
+    publish_dir
+        Staging directory to publish the averaged file to, so that CMAQ's
+        preprocessing can start before WRF finishes (not published if None)
+    publish_start, publish_end
+        The first and last times of the files to publish (e.g. to skip the spin-up)
+    simulation_start_date
+        Value to set the SIMULATION_START_DATE attribute of the averaged file to
+        (e.g. the end of the spin-up, which MCIP expects), so that the file does
+        not need fixing before MCIP reads it (left as is if None)
     """
+    if schemas is None:
+        schemas = schema_cache
     if expected_steps is not None:
         with netCDF4.Dataset(in_file) as nc:
             ntimes = len(nc.dimensions["Time"])
@@ -71,10 +116,23 @@ def process_file(in_file: Path, expected_steps: int | None):
             return
 
     out_file, time_str = generate_out_filename(in_file.name)
+    global_attributes = None
+    if simulation_start_date is not None:
+        global_attributes = {
+            "SIMULATION_START_DATE": simulation_start_date.strftime("%Y-%m-%d_%H:%M:%S")
+        }
 
     logger.info(f"Averaging {in_file} to {out_file}")
     try:
-        average_fields(in_file, out_file, time_str)
+        average_fields(
+            in_file,
+            out_file,
+            time_str,
+            variables=variables,
+            unselected=unselected,
+            schemas=schemas,
+            globalAttributes=global_attributes,
+        )
     except Exception:
         logger.exception(f"Error processing {in_file}")
         return
@@ -84,28 +142,210 @@ def process_file(in_file: Path, expected_steps: int | None):
     else:
         logger.info("successfully processed. Removing old file")
         os.remove(in_file)
+        if publish_dir is not None and should_publish(
+            time_str, publish_start, publish_end
+        ):
+            try:
+                published = publish_file(out_file, publish_dir)
+            except OSError:
+                logger.exception(f"Error publishing {out_file} to {publish_dir}")
+                return
+            logger.info(f"Published {out_file} to {published}")
+
+
+def should_publish(
+    time_str: str,
+    publish_start: datetime.datetime | None = None,
+    publish_end: datetime.datetime | None = None,
+) -> bool:
+    """
+    Check whether the averaged file for a WRF time is within the times to publish
+
+    Parameters
+    ----------
+    time_str
+        The WRF time of the file (format %Y-%m-%d_%H:%M:%S)
+    publish_start, publish_end
+        The first and last times to publish (unbounded if None)
+    """
+    date = datetime.datetime.strptime(time_str, "%Y-%m-%d_%H:%M:%S")
+    if publish_start is not None and date < publish_start:
+        return False
+    if publish_end is not None and date > publish_end:
+        return False
+    return True
+
+
+def file_domain(in_file: Path) -> str:
+    """
+    The domain (e.g. d01) of a WRF output file
+    """
+    filename_chunks = in_file.name.split("_")
+    return filename_chunks[1] if len(filename_chunks) > 1 else ""
+
+
+def dispatch_file(in_file: Path, pool: FairPool | None = None, **options):
+    """
+    Process a file now, or queue it in the worker pool (if there is one)
+
+    Parameters
+    ----------
+    in_file
+        File to process
+    pool
+        FairPool to queue the file in (set up with the options for process_file)
+    options
+        Passed to process_file if there is no pool
+    """
+    if pool is None:
+        process_file(in_file, **options)
+    elif not pool.submit(in_file, key=file_domain(in_file)):
+        logger.debug("%s is already being processed", in_file)
 
 
-def process_files(file_pattern, expected_steps: int | None, timeout=10.0):
+def process_files(
+    file_patterns: str | list[str],
+    expected_steps: int | None,
+    timeout=10.0,
+    variables: set[str] | None = None,
+    unselected: str = "drop",
+    schemas: dict | None = None,
+    pool: FairPool | None = None,
+    publish_dir: str | None = None,
+    publish_start: datetime.datetime | None = None,
+    publish_end: datetime.datetime | None = None,
+    simulation_start_date: datetime.datetime | None = None,
+):
     """
     Check the WRF output directory for new files and process them
 
+    The layout of the output (dimensions, attributes, variable types and
+    compression) is only worked out once per domain in each process.
+
     Parameters
     ----------
-    file_pattern
-        Glob pattern used to find the files to process
+    file_patterns
+        Glob pattern(s) used to find the files to process
     expected_steps
         The number of time steps expected in the input file
         Ignored if None.
     timeout
         Number of seconds since a file was last modified before it will be processed.
         Writing larger domains to disk may not be instantaneous.
+    variables
+        The variables to average (all variables if None)
+    unselected
+        What to do with the other variables ('drop' or 'first')
+    schemas
+        Cache of the output layout for each domain, shared between calls
+    pool
+        FairPool to queue the files in, rather than processing them here
+        (in which case the other options are those the pool was set up with)
+    publish_dir, publish_start, publish_end
+        Where (and which of) the averaged files are published, see process_file
+    simulation_start_date
+        SIMULATION_START_DATE to write to the averaged files, see process_file
     """
-    for in_file in Path(".").glob(file_pattern):
-        mtime_ago = time.time() - os.path.getmtime(in_file)
+    if isinstance(file_patterns, str):
+        file_patterns = [file_patterns]
+    in_files = sorted(
+        {in_file for pattern in file_patterns for in_file in Path(".").glob(pattern)}
+    )
+    for in_file in in_files:
+        if pool is not None and in_file in pool:
+            logger.debug("%s is already being processed", in_file)
+            continue
+        try:
+            mtime_ago = time.time() - os.path.getmtime(in_file)
+        except FileNotFoundError:
+            # a worker has finished the file (and removed it) since the scan
+            logger.debug("%s has already been processed", in_file)
+            continue
         logger.debug("found file %s mtimeago %d s", in_file, mtime_ago)
         if mtime_ago > timeout:
-            process_file(in_file, expected_steps=expected_steps)
+            dispatch_file(
+                in_file,
+                pool=pool,
+                expected_steps=expected_steps,
+                variables=variables,
+                unselected=unselected,
+                schemas=schemas,
+                publish_dir=publish_dir,
+                publish_start=publish_start,
+                publish_end=publish_end,
+                simulation_start_date=simulation_start_date,
+            )
+
+
+def watch_files_inotify(
+    file_patterns: list[str],
+    timeout: float,
+    rescan_interval: float,
+    pool: FairPool | None = None,
+    **options,
+):
+    """
+    Process files as soon as WRF closes them, using inotify
+
+    Files are processed when they are closed after being written
+    (IN_CLOSE_WRITE) or moved into place (IN_MOVED_TO). Any file that was
+    completed before the watch started, or whose event was missed (e.g.
+    written from another node of a shared filesystem), is picked up by a
+    polling scan every rescan_interval seconds.
+
+    Parameters
+    ----------
+    file_patterns
+        Glob pattern(s) used to find the files to process
+    timeout
+        Number of seconds since a file was last modified before the polling scan processes it.
+    rescan_interval
+        Number of seconds between the polling scans (0 to only scan once, at the start)
+    pool
+        FairPool to queue the files in, rather than processing them here
+    options
+        Passed to process_file (expected_steps, variables, unselected, schemas,
+        the publish options and simulation_start_date)
+    """
+    directories = sorted({os.path.dirname(pattern) or "." for pattern in file_patterns})
+    with Inotify(directories) as watcher:
+        logger.info("Watching %s with inotify", ", ".join(directories))
+        process_files(file_patterns, timeout=timeout, pool=pool, **options)
+        last_scan = time.monotonic()
+        while True:
+            if rescan_interval > 0:
+                wait = max(0.0, last_scan + rescan_interval - time.monotonic())
+            else:
+                wait = None
+            if pool is not None and pool.busy:
+                ## wake up regularly to hand more files to the workers
+                wait = (
+                    POOL_POLL_INTERVAL
+                    if wait is None
+                    else min(wait, POOL_POLL_INTERVAL)
+                )
+            events = watcher.read_events(timeout=wait)
+            in_files = set()
+            overflowed = False
+            for path, _ in events:
+                if path is None:
+                    overflowed = True
+                    continue
+                path = os.path.normpath(path)
+                if any(fnmatch.fnmatch(path, pattern) for pattern in file_patterns):
+                    in_files.add(path)
+            for in_file in sorted(in_files):
+                if os.path.exists(in_file):
+                    dispatch_file(Path(in_file), pool=pool, **options)
+            if overflowed:
+                logger.warning("inotify events were lost, scanning for files")
+            if overflowed or (
+                rescan_interval > 0 and time.monotonic() - last_scan >= rescan_interval
+            ):
+                process_files(file_patterns, timeout=timeout, pool=pool, **options)
+                last_scan = time.monotonic()
+            if pool is not None:
+                pool.collect()
 
 
 @click.command()
@@ -121,16 +361,110 @@ def process_files(file_pattern, expected_steps: int | None, timeout=10.0):
     help="Watch for any files matching the file pattern",
     is_flag=True,
 )
+@click.option(
+    "--backend",
+    help="How to watch for new files: with inotify (processing each file as soon as "
+    "WRF closes it), by polling every second, or inotify if it is available",
+    type=click.Choice(["auto", "inotify", "poll"]),
+    default="auto",
+)
+@click.option(
+    "--rescan-interval",
+    help="With the inotify backend, the number of seconds between scans for files "
+    "whose events were missed (0 to disable)",
+    default=60.0,
+    type=float,
+)
 @click.option(
     "--verify-steps/--no-verify-steps",
     help="Verify the that there are the expected number of steps in an output file."
     "This assumes that there are 12 x 5 minute steps.",
     default=False,
 )
-@click.argument("file_pattern", default="wrfout_*")
-def main(file_pattern: str, watch: bool, timeout: float, verify_steps: bool):
+@click.option(
+    "--variables",
+    help="Comma-separated list of variables to average (can be repeated)",
+    multiple=True,
+)
+@click.option(
+    "--mcip-variables",
+    help="Average the variables that MCIP reads",
+    is_flag=True,
+)
+@click.option(
+    "--iofields-file",
+    help="Average the variables added to the history stream by this WRF iofields file "
+    "(e.g. add_remove_var.txt)",
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--unselected",
+    help="What to do with the variables that are not selected for averaging: "
+    "drop them, or keep their first time step",
+    type=click.Choice(unselectedActions),
+    default="drop",
+)
+@click.option(
+    "--workers",
+    help="Number of worker processes to average the files with (taking turns between "
+    "the domains). 1 averages the files in this process.",
+    default=1,
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--publish-dir",
+    help="Staging directory to publish each averaged file to (with an atomic rename), "
+    "so that CMAQ's preprocessing can pick it up while WRF is still running",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "--publish-start",
+    help="Only publish the files from this time onwards (e.g. after the spin-up)",
+    type=click.DateTime(formats=["%Y-%m-%dT%H%M"]),
+)
+@click.option(
+    "--publish-end",
+    help="Only publish the files up to this time",
+    type=click.DateTime(formats=["%Y-%m-%dT%H%M"]),
+)
+@click.option(
+    "--simulation-start-date",
+    help="Set the SIMULATION_START_DATE attribute of the averaged files to this time "
+    "(e.g. the end of the spin-up), as MCIP expects",
+    type=click.DateTime(formats=["%Y-%m-%dT%H%M"]),
+)
+@click.argument("file_patterns", nargs=-1)
+def main(
+    file_patterns: tuple[str, ...],
+    watch: bool,
+    timeout: float,
+    backend: str,
+    rescan_interval: float,
+    verify_steps: bool,
+    variables: tuple[str, ...],
+    mcip_variables: bool,
+    iofields_file: str | None,
+    unselected: str,
+    workers: int,
+    publish_dir: str | None,
+    publish_start: datetime.datetime | None,
+    publish_end: datetime.datetime | None,
+    simulation_start_date: datetime.datetime | None,
+):
     """
     Average raw WRF out files into hourly timesteps
+
+    Every file matching the FILE_PATTERNS (default wrfout_*) is processed,
+    either in this process or (with --workers) in a pool of worker
+    processes. When the process is terminated, the files that the workers
+    are averaging are finished first.
+
+    By default every variable is averaged. If any of --variables,
+    --mcip-variables or --iofields-file are given, only the union of the
+    selected variables is averaged.
+
+    With --publish-dir, each averaged file is also published to a staging
+    directory as soon as it is complete.
     """
     if verify_steps:
         expected_steps = EXPECTED_TIMESTEPS
@@ -138,13 +472,67 @@ def main(file_pattern: str, watch: bool, timeout: float, verify_steps: bool):
         logger.info("Not verifying the number of time steps in the wrf output")
         expected_steps = None
 
-    if watch:
-        # Keep checking until the process is killed
-        while True:
-            time.sleep(1)
-            process_files(file_pattern, expected_steps=expected_steps, timeout=timeout)
-    else:
-        process_files(file_pattern, expected_steps=expected_steps, timeout=timeout)
+    variables = selected_variables(
+        variables=[name for arg in variables for name in arg.split(",") if name],
+        mcip=mcip_variables,
+        iofieldsFile=iofields_file,
+    )
+    if variables is not None:
+        logger.info("Averaging %d selected variables", len(variables))
+    options = dict(
+        expected_steps=expected_steps,
+        variables=variables,
+        unselected=unselected,
+        publish_dir=publish_dir,
+        publish_start=publish_start,
+        publish_end=publish_end,
+        simulation_start_date=simulation_start_date,
+    )
+    file_patterns = list(file_patterns) or ["wrfout_*"]
+
+    pool = None
+    if workers > 1:
+        pool = FairPool(
+            functools.partial(process_file, **options),
+            max_workers=workers,
+            initializer=signal.signal,
+            initargs=(signal.SIGTERM, signal.SIG_DFL),
+        )
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        if watch and backend == "auto":
+            backend = "inotify" if inotify_available() else "poll"
+        if watch and backend == "inotify":
+            # Process files as they are closed until the process is killed
+            watch_files_inotify(
+                file_patterns,
+                timeout=timeout,
+                rescan_interval=rescan_interval,
+                pool=pool,
+                **options,
+            )
+        elif watch:
+            # Keep checking until the process is killed
+            while True:
+                time.sleep(1)
+                process_files(file_patterns, timeout=timeout, pool=pool, **options)
+                if pool is not None:
+                    pool.collect()
+        else:
+            process_files(file_patterns, timeout=timeout, pool=pool, **options)
+            if pool is not None:
+                pool.drain()
+    finally:
+        if pool is not None:
+            # Wait for the files being averaged (but not those still queued)
+            pool.shutdown()
+
+
+def terminate(signum, frame):
+    """
+    Exit cleanly (so that the worker pool is shut down) when the process is terminated
+    """
+    raise SystemExit(128 + signum)
 
 
 if __name__ == "__main__":
@@ -18,15 +18,17 @@ from setup_runs.cmaq.run_scripts import (
     prepareMainRunScript,
     prepareBconRunScripts,
     prepareCctmRunScripts,
-    prepareTemplateBconFiles,
-    prepareTemplateIconFiles,
 )
-from setup_runs.cmaq.mcip import runMCIP
 from setup_runs.cmaq.mcip_preparation import (
     checkInputMetAndOutputFolders,
     getMcipGridNames,
 )
-from setup_runs.cmaq.cams import interpolateFromCAMSToCmaqGrid
+from setup_runs.cmaq.pipeline import (
+    coordinate_cmaq_preprocessing,
+    make_ic_bc,
+    prepare_ic_bc_templates,
+    run_mcip,
+)
 from setup_runs.cmaq.read_config_cmaq import load_cmaq_config, CMAQConfig
 
 
@@ -42,85 +44,36 @@ def main(setup_cmaq: CMAQConfig):
     print(
         "Check that input meteorology files are provided and create output destinations (if need be)"
     )
-    mcipOuputFound = checkInputMetAndOutputFolders(
+    checkInputMetAndOutputFolders(
         setup_cmaq.ctmDir, setup_cmaq.metDir, dates, setup_cmaq.domains
     )
     print("\t... done")
 
-    if (not mcipOuputFound) or setup_cmaq.forceUpdateMcip:
-        runMCIP(
-            dates=dates,
-            domains=setup_cmaq.domains,
-            metDir=setup_cmaq.metDir,
-            wrfDir=setup_cmaq.wrfDir,
-            geoDir=setup_cmaq.geoDir,
-            ProgDir=setup_cmaq.MCIPdir,
-            APPL=setup_cmaq.scenarioTag,
-            CoordName=setup_cmaq.mapProjName,
-            GridName=setup_cmaq.gridName,
-            scripts=scripts,
-            compressWithNco=True,
-            fix_simulation_start_date=True,
-            fix_truelat2=False,
-            truelat2=None,
-            wrfRunName=None,
-            doArchiveWrf=False,
-            add_qsnow=setup_cmaq.add_qsnow,
-        )
+    if setup_cmaq.streamFromWrf:
+        # run MCIP and then the initial and boundary conditions for each
+        # date as soon as its WRF output is published to wrfDir, while
+        # WRF is still running for the later dates
+        coordinate_cmaq_preprocessing(setup_cmaq, dates, scripts)
+    else:
+        # MCIP is only run for the dates and domains whose output is missing
+        # or out of date (unless forceUpdateMcip is set)
+        run_mcip(setup_cmaq, scripts, dates, max_workers=setup_cmaq.MCIPMaxWorkers)
+
+        if setup_cmaq.prepareICandBC:
+            # prepare the template initial and boundary condition
+            # concentration files from profiles using ICON and BCON
+            templates = prepare_ic_bc_templates(setup_cmaq, scripts, dates[0])
+            # use the template initial and boundary condition concentration
+            # files and populate them with values from CAMS output
+            make_ic_bc(
+                setup_cmaq, dates, templates, max_workers=setup_cmaq.CAMSMaxWorkers
+            )
 
     # extract some parameters about the MCIP setup
     CoordNames, GridNames, APPL = getMcipGridNames(
         setup_cmaq.metDir, dates, setup_cmaq.domains
     )
 
-    if setup_cmaq.prepareICandBC:
-        # prepare the template boundary condition concentration files
-        # from profiles using BCON
-        templateBconFiles = prepareTemplateBconFiles(
-            date=dates[0],
-            domains=setup_cmaq.domains,
-            ctmDir=setup_cmaq.ctmDir,
-            metDir=setup_cmaq.metDir,
-            CMAQdir=setup_cmaq.CMAQdir,
-            CFG=setup_cmaq.run,
-            mech=setup_cmaq.mechCMAQ,
-            GridNames=GridNames,
-            mcipsuffix=APPL,
-            scripts=scripts,
-            forceUpdate=setup_cmaq.forceUpdateICandBC,
-        )
-        # prepare the template initial condition concentration files
-        # from profiles using ICON
-        templateIconFiles = prepareTemplateIconFiles(
-            date=dates[0],
-            domains=setup_cmaq.domains,
-            ctmDir=setup_cmaq.ctmDir,
-            metDir=setup_cmaq.metDir,
-            CMAQdir=setup_cmaq.CMAQdir,
-            CFG=setup_cmaq.run,
-            mech=setup_cmaq.mechCMAQ,
-            GridNames=GridNames,
-            mcipsuffix=APPL,
-            scripts=scripts,
-            forceUpdate=setup_cmaq.forceUpdateICandBC,
-        )
-        # use the template initial and boundary condition concentration
-        # files and populate them with values from MOZART output
-        interpolateFromCAMSToCmaqGrid(
-            dates,
-            setup_cmaq.domains,
-            setup_cmaq.mech,
-            setup_cmaq.inputCAMSFile,
-            templateIconFiles,
-            templateBconFiles,
-            setup_cmaq.metDir,
-            setup_cmaq.ctmDir,
-            GridNames,
-            mcipsuffix=APPL,
-            forceUpdate=setup_cmaq.forceUpdateICandBC,
-            bias_correct=setup_cmaq.CAMSToCmaqBiasCorrect,
-        )
-
     if setup_cmaq.prepareRunScripts:
         print("Prepare ICON, BCON and CCTM run scripts")
         # prepare the scripts for CCTM
@@ -11,6 +11,7 @@ import pdb
 import copy
 import stat
 import netCDF4
+from setup_runs.compression import compress_nc_files
 from setup_runs.wrf.fetch_fnl import download_gdas_fnl_data
 from setup_runs.wrf.read_config_wrf import load_wrf_config
 
@@ -100,48 +101,6 @@ def symlink_file(input_directory, output_directory, filename):
         os.symlink(src, dst)
 
 
-def compressNCfile(filename, ppc=None):
-    """Compress a netCDF3 file to netCDF4 using ncks
-
-    Args:
-        filename: Path to the netCDF3 file to commpress
-        ppc: number of significant digits to retain (default is to retain all)
-
-    Returns:
-        Nothing
-    """
-
-    if os.path.exists(filename):
-        print("Compress file {} with ncks".format(filename))
-        command = "ncks -4 -L4 -O {} {}".format(filename, filename)
-        print("\t" + command)
-        commandList = command.split(" ")
-        if ppc is None:
-            ppcText = ""
-        else:
-            if not isinstance(ppc, int):
-                raise RuntimeError("Argument ppc should be an integer...")
-            elif ppc < 1 or ppc > 6:
-                raise RuntimeError("Argument ppc should be between 1 and 6...")
-            else:
-                ppcText = "--ppc default={}".format(ppc)
-                commandList = [commandList[0]] + ppcText.split(" ") + commandList[1:]
-        ##
-        ##
-        p = subprocess.Popen(
-            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        stdout, stderr = p.communicate()
-        stdout = decode_bytes(stdout)
-        stderr = decode_bytes(stderr)
-        if len(stderr) > 0 or len(stdout) > 0:
-            print("stdout = " + stdout)
-            print("stderr = " + stderr)
-            raise RuntimeError("Error from ncks...")
-    else:
-        print("File {} not found...".format(filename))
-
-
 ## calculate the number of jobs
 run_length_hours = (
     wrf_config.end_date - wrf_config.start_date
@@ -436,10 +395,11 @@ for ind_job in range(number_of_jobs):
                 os.rename(src, dst)
                 ## compress the output
                 print("\tCompress the geo_em files")
+                geoFiles = ["geo_em.d0{}.nc".format(iDom + 1) for iDom in range(nDom)]
+                compress_nc_files(geoFiles, max_workers=nDom)
                 for iDom in range(nDom):
                     dom = "d0{}".format(iDom + 1)
                     geoFile = "geo_em.{}.nc".format(dom)
-                    compressNCfile(geoFile)
                     ## move the file to the namelist directory
                     src = os.path.join(run_dir_with_date, geoFile)
                     dst = os.path.join(wrf_config.nml_dir, geoFile)
@@ -1089,12 +1049,28 @@ for ind_job in range(number_of_jobs):
     ## generate the run and cleanup scripts
     print("\t\tGenerate the run and cleanup script")
 
+    ## optionally publish the averaged output (after the spin-up) to a
+    ## staging area as it is made, so that CMAQ's preprocessing can start
+    ## while WRF is still running
+    if wrf_config.wrfout_staging_dir:
+        publishOptions = "--publish-dir {} --publish-start {} --publish-end {}".format(
+            os.path.join(wrf_config.wrfout_staging_dir, yyyymmddhh_start),
+            job_start_usable.strftime("%Y-%m-%dT%H%M"),
+            job_end.strftime("%Y-%m-%dT%H%M"),
+        )
+    else:
+        publishOptions = ""
+
+    ## firstTimeToKeep is also written to the averaged output as its
+    ## SIMULATION_START_DATE, as MCIP expects, so the files can be staged
+    ## for MCIP with hardlinks rather than being copied and fixed
     ########## EDIT: the following are the substitutions used for the per-run cleanup and run scripts
     substitutions = {
         "RUN_DIR": run_dir_with_date,
         "RUNSHORT": wrf_config.run_name[:8],
         "STARTDATE": job_start_usable.strftime("%Y%m%d"),
         "firstTimeToKeep": job_start_usable.strftime("%Y-%m-%dT%H%M"),
+        "PUBLISH_OPTIONS": publishOptions,
     }
     ########## end edit section #####################################################
 
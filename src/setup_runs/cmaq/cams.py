@@ -1,15 +1,35 @@
 """Interpolate the from the global CAMS CTM output to ICs and BCs for CMAQ"""
 
+import concurrent.futures
+import contextlib
+import io
 import numpy
-import datetime
 import netCDF4
 import os
-import shutil
 import warnings
 
-from setup_runs.utils import getDistanceFromLatLonInKm
+from setup_runs.cmaq.cams_reader import CAMSReader
+from setup_runs.cmaq.cams_regrid import (
+    arrays_to_sparse,
+    bilinear_weights,
+    boundary_to_interior_indices,
+    cell_half_widths,
+    conservative_weights,
+    grid_fingerprint,
+    interpolate_vertically,
+    load_or_compute_weights,
+    map_columns,
+    nearest_cams_indices,
+    sparse_to_arrays,
+    vertical_interpolation_weights,
+)
+from setup_runs.time_axis import decode_tflag, linear_interpolation_weights, match_times
 
-moleMass = {"air": 28.96, "ch4_c": 16}
+moleMass = {"air": 28.96, "ch4_c": 16, "co": 28.01, "go3": 48.0}
+
+defaultSpeciesMap = [{"MZspec": "ch4_c", "CMspec": "CH4", "coef": 1.0}]
+
+interpolationMethods = ["nearest", "bilinear", "conservative"]
 
 
 def match_two_sorted_arrays(arr1, arr2):
@@ -22,29 +42,79 @@ def match_two_sorted_arrays(arr1, arr2):
     Returns:
         result: numpy integer array with the same dimensions as array arr2, with each element containing the index of arr1 that provides the *closest* match to the given entry in arr2
     """
-    result = numpy.zeros(arr2.shape, dtype=int)
-    for i, v in enumerate(arr2):
-        result[i] = numpy.argmin(numpy.abs(arr1 - v))
-    return result
+    arr1 = numpy.asarray(arr1)
+    arr2 = numpy.asarray(arr2)
+    ## compare each entry of arr2 with the entries of arr1 either side
+    ## of it, preferring the lower index for ties (as numpy.argmin does)
+    upper = numpy.clip(numpy.searchsorted(arr1, arr2), 1, max(len(arr1) - 1, 1))
+    lower = upper - 1
+    if len(arr1) == 1:
+        return numpy.zeros(arr2.shape, dtype=int)
+    useUpper = numpy.abs(arr1[upper] - arr2) < numpy.abs(arr1[lower] - arr2)
+    return numpy.where(useUpper, upper, lower)
+
+
+def map_to_cmaq(varin, mapping, Iz, wz, shape, timeWeights=None):
+    """Map a CAMS field to the CMAQ grid-points and layers
+
+    Args:
+        varin: CAMS field, with the last three axes being (level, latitude, longitude), optionally with a leading time axis
+        mapping: horizontal mapping from CAMS grid-points to CMAQ grid-points (indices or a sparse weight matrix, see map_columns)
+        Iz: either a 1D array of indices of the CAMS levels that correspond to the CMAQ levels, or (if wz is given) an array of CAMS level indices for each CMAQ layer and grid-point (see vertical_interpolation_weights), with a leading time axis if timeWeights is given
+        wz: array of vertical interpolation weights (the same shape as Iz), or None
+        shape: shape of the CMAQ grid, e.g. (ROW, COL) or (PERIM,)
+        timeWeights: tuple of arrays (i0, i1, wt) giving, for each output time, the indices along the time axis of varin of the bracketing CAMS times and the weight for the later of the two (optional, see setup_runs.time_axis.linear_interpolation_weights)
+
+    Returns:
+        out: array of values with shape (LAY,) + shape, preceded by the time axis if varin has one
+    """
+    leading = varin.shape[:-3]
+    if wz is None:
+        levels = numpy.asarray(Iz)
+    else:
+        ## only map the range of CAMS levels that is needed
+        kmin = int(Iz.min())
+        kmax = min(int(Iz.max()) + 1, varin.shape[-3] - 1)
+        levels = numpy.arange(kmin, kmax + 1)
+    columns = map_columns(varin, levels, mapping)
+    columns = columns.reshape(leading + (len(levels),) + tuple(shape))
+    if timeWeights is not None:
+        columns = interpolate_in_time(columns, *timeWeights)
+    if wz is None:
+        return columns
+    return interpolate_vertically(columns, Iz - kmin, wz, axis=-1 - len(shape))
+
+
+def interpolate_in_time(columns, i0, i1, wt):
+    """Interpolate linearly in time between records (along the first axis)
+
+    Args:
+        columns: array with time as the first axis
+        i0: array of indices (along the first axis of columns) of the earlier record for each output time
+        i1: array of indices of the later record for each output time
+        wt: array of weights to give to record i1
+
+    Returns:
+        out: array with the same shape as columns, except that the first axis has one entry per output time
+    """
+    wt = numpy.asarray(wt).reshape((-1,) + (1,) * (columns.ndim - 1))
+    return columns[i0] * (1.0 - wt) + columns[i1] * wt
 
 
 def extract_and_interpolate_interior(
-    mzspec, ncin, lens, LON, Iz, iMZtime, P, near_interior
+    mzspec, camsReader, lens, LON, Iz, iMZtime, near_interior, wz=None
 ):
     """Interpolate from the CAMS grid to the CMAQ interior points (i.e. the full 3D array)
 
     Args:
         mzspec: the CAMS species name
-        ncin: the connection to the netCDF input file (i.e. the CAMS file)
+        camsReader: CAMSReader for the CAMS file
         lens: dictionary of dimension lengths
         LON: array of longitudes with the same size as the output array
-        Iz: array of indices of CAMS levels that correspond to the CMAQ levels
+        Iz: array of indices of CAMS levels that correspond to the CMAQ levels, either 1D (one per CMAQ level) or with shape (LAY, ROW, COL) if wz is given
         iMZtime: index of the CAMS time to use
-        isAerosol: Boolean (True/False) whether this is an aerosol species or not
-        mz_mw_aerosol: molecular weight of the CAMS species
-        T: array of temperatures (units = K) from the CAMS output
-        P: array of pressures (units = Pa) from the CAMS output
-        near_interior: array of indices matching up the CAMS grid-points with CMAQ grid-points
+        near_interior: array of indices matching up the CAMS grid-points with CMAQ grid-points, or a sparse matrix of interpolation weights
+        wz: array of weights for log-pressure interpolation between CAMS levels Iz and Iz+1, with shape (LAY, ROW, COL) (optional)
 
     Returns:
         out_interior: Gridded CAMS concentrations interpolated to the CMAQ grid
@@ -54,18 +124,15 @@ def extract_and_interpolate_interior(
         (lens["LAY"], LON.shape[0], LON.shape[1]), dtype=numpy.float32
     )
     #
-    if mzspec in list(ncin.variables.keys()):
-        varin = ncin.variables[mzspec][iMZtime, :, :, :]
+    if mzspec in camsReader:
+        varin = camsReader.read(mzspec, iMZtime)
         #
         convFac = (
             moleMass["air"] / moleMass[mzspec] * 1e6
         )  # converting from kg/kg to VMR in ppmv
         varin = varin * convFac  ## convert from VMR to PPMV
         #
-        for irow in range(LON.shape[0]):
-            for icol in range(LON.shape[1]):
-                ix, iy = near_interior[irow, icol, :]
-                out_interior[:, irow, icol] = varin[Iz, ix, iy]
+        out_interior[:] = map_to_cmaq(varin, near_interior, Iz, wz, LON.shape)
     else:
         warnings.warn(
             "Species {} was not found in input CAMS file -- contributions from this variable will be zero...".format(
@@ -77,19 +144,28 @@ def extract_and_interpolate_interior(
 
 
 def extract_and_interpolate_boundary(
-    mzspec, ncin, lens, LONP, Iz, iMZtime_for_each_CMtime, P, near_boundary
+    mzspec,
+    camsReader,
+    lens,
+    LONP,
+    Iz,
+    iMZtime_for_each_CMtime,
+    near_boundary,
+    wz=None,
+    timeWeights=None,
 ):
     """Interpolate from the CAMS grid to the CMAQ boundary points
 
     Args:
         mzspec: the CAMS species name
-        ncin: the connection to the netCDF input file (i.e. the CAMS file)
+        camsReader: CAMSReader for the CAMS file
         lens: dictionary of dimension lengths
         LONP: array of longitudes of CMAQ boundary points with the same size as the output array
-        Iz: array of indices of CAMS levels that correspond to the CMAQ levels
+        Iz: array of indices of CAMS levels that correspond to the CMAQ levels, either 1D (one per CMAQ level) or with shape (LAY, PERIM) if wz is given
         iMZtime_for_each_CMtime: index of the CAMS time to use, one entry for each CMAQ time
-        P: array of pressures (units = Pa) from the CAMS output
-        near_boundary: array of indices matching up the CAMS grid-points with CMAQ boundary grid-points
+        near_boundary: array of indices matching up the CAMS grid-points with CMAQ boundary grid-points, or a sparse matrix of interpolation weights
+        wz: array of weights for log-pressure interpolation between CAMS levels Iz and Iz+1, with shape (LAY, PERIM), or (TSTEP, LAY, PERIM) if timeWeights is given (optional)
+        timeWeights: tuple of arrays (i0, i1, wt) of CAMS time indices and weights (from setup_runs.time_axis.linear_interpolation_weights) for each CMAQ time. If given, boundary conditions are calculated for every CMAQ time, rather than just the first (optional)
 
     Returns:
         out_boundary: Gridded CAMS concentrations interpolated to the CMAQ boundary grid points
@@ -98,21 +174,34 @@ def extract_and_interpolate_boundary(
     iCMtime = 0
     iMZtime = iMZtime_for_each_CMtime[iCMtime]
     #
-    ntime = 1
+    ntime = 1 if timeWeights is None else len(timeWeights[0])
     out_boundary = numpy.zeros((ntime, lens["LAY"], LONP.shape[0]), dtype=numpy.float32)
     #
-    if mzspec in list(ncin.variables.keys()):
-        varin = ncin.variables[mzspec][iMZtime, :, :, :]
-        #
+    if mzspec in camsReader:
         convFac = (
             moleMass["air"] / moleMass[mzspec] * 1e6
         )  # converting from kg/kg to VMR in ppmv
-        varin = varin * convFac  ## convert from VMR to PPMV
-        #
-        for iperim in range(LONP.shape[0]):
-            ix, iy = near_boundary[iperim, :]
-            ## for iCMtime, iMZtime in enumerate(iMZtime_for_each_CMtime):
-            out_boundary[iCMtime, :, iperim] = varin[Iz, ix, iy]
+        if timeWeights is None:
+            varin = camsReader.read(mzspec, iMZtime)
+            varin = varin * convFac  ## convert from VMR to PPMV
+            out_boundary[iCMtime] = map_to_cmaq(
+                varin, near_boundary, Iz, wz, LONP.shape
+            )
+        else:
+            ## read all the CAMS records needed in one go
+            i0, i1, wt = timeWeights
+            ifirst = min(i0.min(), i1.min())
+            ilast = max(i0.max(), i1.max())
+            varin = camsReader.read(mzspec, numpy.arange(ifirst, ilast + 1))
+            varin = varin * convFac  ## convert from VMR to PPMV
+            out_boundary[:] = map_to_cmaq(
+                varin,
+                near_boundary,
+                Iz,
+                wz,
+                LONP.shape,
+                timeWeights=(i0 - ifirst, i1 - ifirst, wt),
+            )
     else:
         warnings.warn(
             "Species {} was not found in input CAMS file -- contributions from this variable will be zero...".format(
@@ -123,38 +212,154 @@ def extract_and_interpolate_boundary(
     return out_boundary
 
 
-def populate_interior_variable(ncouti, cmspec, out_interior, coef):
-    """Populate an interior variable (i.e. for the IC file)
+def accumulate_species(buffer, values, coef, scratch):
+    """Add the contribution of a CAMS species to a CMAQ species, in place
 
     Args:
-        ncouti: connection to the output file for the initial conditions
-        cmspec: the name of the CMAQ species
-        out_interior: numpy array of concentrations at interior points
+        buffer: float32 array of concentrations of the CMAQ species, which is updated in place
+        values: array of concentrations of the CAMS species (broadcastable to buffer)
         coef: Coefficient to multiply the values by
+        scratch: float32 array with the same shape as values, used to avoid temporary arrays
 
     Returns:
         Nothing
     """
-    ncouti.variables[cmspec][:] = ncouti.variables[cmspec][:] + numpy.fmax(
-        out_interior[:] * coef, 1.0e-30
-    )
+    numpy.multiply(values, coef, out=scratch)
+    numpy.fmax(scratch, 1.0e-30, out=scratch)
+    numpy.add(buffer, scratch, out=buffer)
 
 
-def populate_boundary_variable(ncoutb, cmspec, out_boundary, coef):
-    """Populate an boundary variable (i.e. for the BC file)
+def template_storage(var):
+    """Storage settings (chunking and compression) of a variable in a netCDF4 template file
 
     Args:
-        ncoutb: connection to the output file for the boundary conditions
-        cmspec: the name of the CMAQ species
-        out_boundary: numpy array of concentrations at boundary points
-        coef: Coefficient to multiply the values by
+        var: netCDF4.Variable of the template file
+
+    Returns:
+        storage: dictionary of keyword arguments to netCDF4.Dataset.createVariable
+    """
+    chunking = var.chunking()
+    if chunking == "contiguous":
+        storage = dict(contiguous=True)
+    else:
+        storage = dict(chunksizes=chunking)
+    filters = var.filters() or {}
+    if filters.get("zlib"):
+        storage.update(zlib=True, complevel=filters["complevel"])
+    storage.update(shuffle=filters.get("shuffle", False))
+    storage.update(fletcher32=filters.get("fletcher32", False))
+    return storage
+
+
+def write_ic_bc_file(
+    templateFile, outFile, fields, defaultSpec, TFLAG=None, tstep=None, complevel=4
+):
+    """Write a CMAQ IC or BC file, based on a template file
+
+    Each variable is written exactly once. The values of species that
+    are not in fields are taken from the template, and species in fields
+    that are not in the template are added to the file.
+
+    Without TFLAG, the file keeps the time steps, format and storage
+    (chunking and compression) of the template, and fields with a single
+    time step are repeated for each of its time steps. With TFLAG (i.e.
+    time-resolved BCs), the file has a time step for each entry of TFLAG
+    and is written in the netCDF4 format, with each layer of each time
+    step of a species stored (and compressed) as a separate chunk, since
+    CCTM reads the files one layer at a time.
+
+    Args:
+        templateFile: filename of the template ICON or BCON file
+        outFile: filename of the output file
+        fields: dictionary of float32 arrays of concentrations, keyed by CMAQ species, each with shape (TSTEP, LAY, ROW, COL) for ICs or (TSTEP, LAY, PERIM) for BCs, where TSTEP is either 1 or the number of time steps in the output
+        defaultSpec: A species that is known to exist in the template file, whose dimensions and attributes are used for new species
+        TFLAG: array of (YYYYDDD, HHMMSS) pairs for each time step, with shape (TSTEP, 2) (optional, defaults to the times in the template)
+        tstep: time step between records (in HHMMSS format), required if TFLAG is given
+        complevel: compression level of the species variables, if TFLAG is given
 
     Returns:
         Nothing
     """
-    ncoutb.variables[cmspec][:] = ncoutb.variables[cmspec][:] + numpy.fmax(
-        out_boundary[:] * coef, 1.0e-30
-    )
+    if os.path.exists(outFile):
+        os.remove(outFile)
+    with netCDF4.Dataset(templateFile, "r") as nctmp:
+        nctmp.set_auto_mask(False)
+        if TFLAG is None:
+            ntime = len(nctmp.dimensions["TSTEP"])
+            fileFormat = nctmp.data_model
+        else:
+            ntime = TFLAG.shape[0]
+            fileFormat = "NETCDF4"
+        newSpecies = [spec for spec in fields if spec not in nctmp.variables]
+        for spec in newSpecies:
+            warnings.warn(
+                "Species {} was not found in template CMAQ file {} -- creating blank variable...".format(
+                    spec, templateFile
+                )
+            )
+        with netCDF4.Dataset(outFile, "w", format=fileFormat) as ncout:
+            ## global attributes, updated for the times and any new species
+            attrs = {k: nctmp.getncattr(k) for k in nctmp.ncattrs()}
+            if TFLAG is not None:
+                attrs["SDATE"] = numpy.int32(TFLAG[0, 0])
+                attrs["STIME"] = numpy.int32(TFLAG[0, 1])
+                attrs["TSTEP"] = numpy.int32(tstep)
+            if newSpecies and "NVARS" in attrs:
+                attrs["NVARS"] = numpy.int32(attrs["NVARS"] + len(newSpecies))
+            if newSpecies and "VAR-LIST" in attrs:
+                attrs["VAR-LIST"] += "".join(
+                    "{:16}".format(spec) for spec in newSpecies
+                )
+            ncout.setncatts(attrs)
+            ##
+            for name, dim in nctmp.dimensions.items():
+                size = len(dim) + len(newSpecies) if name == "VAR" else len(dim)
+                ncout.createDimension(name, None if dim.isunlimited() else size)
+            ##
+            for name, var in list(nctmp.variables.items()) + [
+                (spec, nctmp.variables[defaultSpec]) for spec in newSpecies
+            ]:
+                shape = [len(ncout.dimensions[d]) for d in var.dimensions]
+                if TFLAG is None:
+                    ## keep the storage of the template (netCDF3 has none to keep)
+                    if fileFormat == "NETCDF4":
+                        storage = template_storage(var)
+                    else:
+                        storage = {}
+                elif var.dimensions[:2] == ("TSTEP", "LAY"):
+                    storage = dict(
+                        chunksizes=[1, 1] + shape[2:], zlib=True, shuffle=True
+                    )
+                    storage["complevel"] = complevel
+                elif var.dimensions[:1] == ("TSTEP",):
+                    storage = dict(chunksizes=[1] + shape[1:])
+                else:
+                    storage = {}
+                varAttrs = {k: var.getncattr(k) for k in var.ncattrs()}
+                fill_value = varAttrs.pop("_FillValue", None)
+                if name in newSpecies:
+                    varAttrs["long_name"] = "{:16}".format(name)
+                    varAttrs["units"] = "{:16}".format("ppmV")
+                    varAttrs["var_desc"] = "{:80}".format("Variable " + name)
+                out = ncout.createVariable(
+                    name, var.dtype, var.dimensions, fill_value=fill_value, **storage
+                )
+                out.setncatts(varAttrs)
+                ##
+                if name == "TFLAG":
+                    if TFLAG is None:
+                        values = var[:, 0:1, :]
+                    else:
+                        values = TFLAG[:, numpy.newaxis, :]
+                    values = numpy.broadcast_to(values, (ntime,) + tuple(shape[1:]))
+                else:
+                    values = fields[name] if name in fields else var[:]
+                    ## repeat a single time step (e.g. a snapshot) for each time step
+                    if var.dimensions[:1] == ("TSTEP",) and values.shape[0] != ntime:
+                        values = numpy.broadcast_to(
+                            values[0:1], (ntime,) + values.shape[1:]
+                        )
+                out[:] = values
 
 
 def print_interior_variable(cmspec, out_interior, factor):
@@ -187,6 +392,400 @@ def print_boundary_variable(cmspec, out_boundary, factor):
     print("{:20} {:.3e}".format(cmspec, out_boundary[:, 0, :].mean() * factor))
 
 
+def getMcipLatLon(mcipdir, mcipsuffix):
+    """Get the latitudes and longitudes of the CMAQ interior and boundary points
+
+    Args:
+        mcipdir: directory containing the MCIP output for one date and domain
+        mcipsuffix: Suffix for the MCIP output files for this domain
+
+    Returns:
+        lat: 1D array of latitudes of the interior and boundary points
+        lon: 1D array of longitudes of the interior and boundary points
+    """
+    lat = []
+    lon = []
+    for prefix in ["GRIDCRO2D", "GRIDBDY2D"]:
+        filename = "{}/{}_{}".format(mcipdir, prefix, mcipsuffix)
+        with netCDF4.Dataset(filename, "r") as nc:
+            lat.append(numpy.asarray(nc.variables["LAT"][:]).ravel())
+            lon.append(numpy.asarray(nc.variables["LON"][:]).ravel())
+    return numpy.concatenate(lat), numpy.concatenate(lon)
+
+
+def getCAMSRegriddingWeights(
+    camsReader, mcipdir, mcipsuffix, cacheDir, interpolation="nearest"
+):
+    """Get the indices or weights that map the CAMS grid-points to the CMAQ grid
+
+    The indices only depend on the CAMS and MCIP grids, so they are
+    stored in the directory cacheDir, keyed by a fingerprint of the CAMS
+    latitudes and longitudes, the GRIDDESC file and the MCIP latitudes
+    and longitudes. Subsequent calls (or runs) with the same grids will
+    re-use the cached values.
+
+    Args:
+        camsReader: CAMSReader for the CAMS file
+        mcipdir: directory containing the MCIP output for one date and domain
+        mcipsuffix: Suffix for the MCIP output files for this domain
+        cacheDir: directory in which to cache the indices
+        interpolation: horizontal interpolation method, one of 'nearest' (nearest neighbour), 'bilinear' or 'conservative' (area-weighted)
+
+    Returns:
+        weights: dictionary with the keys 'interior' and 'boundary', giving the mapping from the CAMS grid-points to the CMAQ interior and boundary points (either indices of the nearest CAMS grid-points or sparse matrices of interpolation weights)
+    """
+    if interpolation not in interpolationMethods:
+        raise ValueError(
+            "Interpolation method should be one of {}".format(interpolationMethods)
+        )
+    croFile = "{}/GRIDCRO2D_{}".format(mcipdir, mcipsuffix)
+    bdyFile = "{}/GRIDBDY2D_{}".format(mcipdir, mcipsuffix)
+    with open("{}/GRIDDESC".format(mcipdir)) as f:
+        griddesc = f.read()
+    with netCDF4.Dataset(croFile, "r") as nccro, netCDF4.Dataset(bdyFile, "r") as ncbdy:
+        LAT = nccro.variables["LAT"][:].squeeze()
+        LON = nccro.variables["LON"][:].squeeze()
+        LATP = ncbdy.variables["LAT"][:].squeeze()
+        LONP = ncbdy.variables["LON"][:].squeeze()
+        latmz = camsReader.latitude
+        lonmz = camsReader.longitude
+        fingerprint = grid_fingerprint(
+            interpolation,
+            griddesc,
+            str(camsReader.window),
+            LAT,
+            LON,
+            LATP,
+            LONP,
+            latmz,
+            lonmz,
+        )
+
+        def compute():
+            print("calculate CAMS to CMAQ regridding weights for", mcipdir)
+            weights = {}
+            if interpolation == "nearest":
+                weights["interior"] = nearest_cams_indices(LAT, LON, latmz, lonmz)
+                weights["boundary"] = nearest_cams_indices(LATP, LONP, latmz, lonmz)
+            elif interpolation == "bilinear":
+                interior = bilinear_weights(LAT, LON, latmz, lonmz)
+                boundary = bilinear_weights(LATP, LONP, latmz, lonmz)
+                weights.update(sparse_to_arrays("interior", interior))
+                weights.update(sparse_to_arrays("boundary", boundary))
+            else:
+                ## the boundary cells are assumed to be the same size as
+                ## a typical interior cell
+                halfLat, halfLon = cell_half_widths(LAT, LON)
+                interior = conservative_weights(
+                    LAT, LON, halfLat, halfLon, latmz, lonmz
+                )
+                boundary = conservative_weights(
+                    LATP,
+                    LONP,
+                    numpy.median(halfLat),
+                    numpy.median(halfLon),
+                    latmz,
+                    lonmz,
+                )
+                weights.update(sparse_to_arrays("interior", interior))
+                weights.update(sparse_to_arrays("boundary", boundary))
+            return weights
+
+        weights = load_or_compute_weights(cacheDir, fingerprint, compute)
+
+    for name in ["interior", "boundary"]:
+        if name not in weights:
+            weights[name] = arrays_to_sparse(name, weights)
+    return weights
+
+
+def getCAMSVerticalWeights(
+    PSURF, sigma, mtop, levels, nthik, interior=True, boundary=True, allSteps=False
+):
+    """Get the weights to interpolate from the CAMS pressure levels to the CMAQ layers
+
+    The weights depend on the surface pressure, so they change with
+    every date and are cheaper to recalculate than to store; they are
+    only held in memory (unlike the horizontal regridding weights). The
+    ICs are only written for the first time step, so the interior
+    weights are only calculated for that time step, as are the boundary
+    weights unless allSteps is set (for time-resolved BCs).
+
+    Args:
+        PSURF: array of surface pressures (units = Pa) with shape (TSTEP, ROW, COL), i.e. the PRSFC variable from the METCRO2D file
+        sigma: 1D array of the CMAQ sigma levels (the VGLVLS attribute)
+        mtop: pressure at the top of the CMAQ model (the VGTOP attribute, units = Pa)
+        levels: 1D array of the CAMS pressure levels (units = Pa), in ascending order
+        nthik: thickness of the boundary (the NTHIK attribute of the GRIDBDY2D file)
+        interior: Boolean (True/False) for whether to calculate the weights for the interior (i.e. for the ICs)
+        boundary: Boolean (True/False) for whether to calculate the weights for the boundary (i.e. for the BCs)
+        allSteps: Boolean (True/False) for whether to calculate the boundary weights for every time step, rather than only the first
+
+    Returns:
+        weights: dictionary with the keys 'Iz_interior' and 'wz_interior' (with shape (LAY, ROW, COL)) if interior is set, and 'Iz_boundary' and 'wz_boundary' (with shape (TSTEP, LAY, PERIM) if allSteps is set, otherwise (LAY, PERIM)) if boundary is set
+    """
+    PSURF = numpy.asarray(PSURF)
+    weights = {}
+    if interior:
+        Iz_interior, wz_interior = vertical_interpolation_weights(
+            PSURF[:1], sigma, mtop, levels
+        )
+        weights["Iz_interior"] = Iz_interior[0]
+        weights["wz_interior"] = wz_interior[0]
+    if boundary:
+        ## the surface pressure at the boundary points is taken from
+        ## the nearest interior cell
+        irow, icol = boundary_to_interior_indices(PSURF.shape[1], PSURF.shape[2], nthik)
+        steps = slice(None) if allSteps else slice(0, 1)
+        Iz_boundary, wz_boundary = vertical_interpolation_weights(
+            PSURF[steps, irow, icol], sigma, mtop, levels
+        )
+        if not allSteps:
+            Iz_boundary, wz_boundary = Iz_boundary[0], wz_boundary[0]
+        weights["Iz_boundary"] = Iz_boundary
+        weights["wz_boundary"] = wz_boundary
+    return weights
+
+
+def interpolateFromCAMSToCmaqGridForDomain(
+    camsReader,
+    date,
+    dom,
+    do_ICs,
+    do_BCs,
+    weights,
+    mech,
+    templateIconFile,
+    templateBconFile,
+    metDir,
+    ctmDir,
+    grid,
+    mcipsuffix,
+    bias_correct,
+    defaultSpec,
+    timeResolvedBCs,
+    species_map,
+):
+    """Interpolate from the global CAMS CTM output to the ICs and/or BCs for one date and domain
+
+    Args:
+        camsReader: CAMSReader for the CAMS file
+        date: datetime object of the date to process
+        dom: domain name (e.g. 'd01')
+        do_ICs: Boolean (True/False) for whether to write the initial conditions
+        do_BCs: Boolean (True/False) for whether to write the boundary conditions
+        weights: the horizontal mapping for this domain (from getCAMSRegriddingWeights)
+        mech: name of chemical mechanism to appear in filenames
+        templateIconFile: filename of the template ICON file for this domain
+        templateBconFile: filename of the template BCON file for this domain
+        metDir: base directory for the MCIP output
+        ctmDir: base directory for the CCTM inputs and outputs
+        grid: MCIP map projection name for this domain
+        mcipsuffix: Suffix for the MCIP output files for this domain
+        bias_correct: correction added to the CH4 concentrations (in ppm)
+        defaultSpec: A species that is known to exist in the template files, used for checking dimension information
+        timeResolvedBCs: Boolean (True/False) for whether to write boundary conditions for every CMAQ time step
+        species_map: list of dictionaries mapping CAMS species to CMAQ species (see interpolateFromCAMSToCmaqGrid)
+
+    Returns:
+        Nothing
+    """
+    yyyymmdd_dashed = date.strftime("%Y-%m-%d")
+    mcipdir = "{}/{}/{}".format(metDir, yyyymmdd_dashed, dom)
+    chemdir = "{}/{}/{}".format(ctmDir, yyyymmdd_dashed, dom)
+
+    ## check that the output directory exists - if not, create it
+    os.makedirs(chemdir, exist_ok=True)
+
+    croFile = "{}/GRIDCRO2D_{}".format(mcipdir, mcipsuffix)
+    dotFile = "{}/GRIDDOT2D_{}".format(mcipdir, mcipsuffix)
+    bdyFile = "{}/GRIDBDY2D_{}".format(mcipdir, mcipsuffix)
+    metFile = "{}/METCRO3D_{}".format(mcipdir, mcipsuffix)
+    srfFile = "{}/METCRO2D_{}".format(mcipdir, mcipsuffix)
+    outBCON = "{}/BCON.{}.{}.{}.nc".format(chemdir, dom, grid, mech)
+    outICON = "{}/ICON.{}.{}.{}.nc".format(chemdir, dom, grid, mech)
+
+    print(dotFile)
+    with netCDF4.Dataset(croFile, "r", format="NETCDF4") as nccro, netCDF4.Dataset(
+        bdyFile, "r", format="NETCDF4"
+    ) as ncbdy, netCDF4.Dataset(
+        metFile, "r", format="NETCDF4"
+    ) as ncmet, netCDF4.Dataset(srfFile, "r", format="NETCDF4") as ncsrf:
+        lens = dict()
+        for k in list(nccro.dimensions.keys()):
+            lens[k] = len(nccro.dimensions[k])
+
+        lens["PERIM"] = len(ncbdy.dimensions["PERIM"])
+        lens["LAY"] = len(ncmet.dimensions["LAY"])
+        lens["TSTEP"] = 1
+
+        LON = nccro.variables["LON"][:].squeeze()
+        LONP = ncbdy.variables["LON"][:].squeeze()
+        MZdates = camsReader.times
+        #
+        TFLAG = ncsrf.variables["TFLAG"][:, 0, :].squeeze()
+        timesmod = decode_tflag(TFLAG)
+        itimes = numpy.where(
+            timesmod.astype("datetime64[D]") == numpy.datetime64(date.date())
+        )[0]
+        itime0 = itimes[0]
+        itime1 = itimes[-1] + 2
+        timesmod = timesmod[itime0:itime1]
+        TFLAG = TFLAG[itime0:itime1]
+
+        near_interior = weights["interior"]
+        near_boundary = weights["boundary"]
+
+        ## interpolation from CAMS to CMAQ levels, for each column and time
+        mb2pa = 100.0  # converting from  millibar to pascal
+        vertical = getCAMSVerticalWeights(
+            ncsrf.variables["PRSFC"][itime0:itime1, 0, :, :],
+            ncmet.getncattr("VGLVLS"),
+            ncmet.getncattr("VGTOP"),
+            camsReader.level.astype("float") * mb2pa,
+            ncbdy.getncattr("NTHIK") if "NTHIK" in ncbdy.ncattrs() else 1,
+            interior=do_ICs,
+            boundary=do_BCs,
+            allSteps=timeResolvedBCs,
+        )
+
+        iMZtime_for_each_CMtime = match_times(timesmod, MZdates)
+        iMZtime = iMZtime_for_each_CMtime[0]
+
+        timeWeights = None
+        if do_BCs and timeResolvedBCs:
+            timeWeights = linear_interpolation_weights(timesmod, MZdates)
+
+        ## each CAMS species is read and interpolated once, on a
+        ## thread pool (the reads and the numpy/scipy operations
+        ## release the GIL), sharing the horizontal and vertical
+        ## interpolation weights
+        def extract_species(MZspec):
+            out_interior = None
+            out_boundary = None
+            if do_ICs:
+                out_interior = extract_and_interpolate_interior(
+                    MZspec,
+                    camsReader,
+                    lens,
+                    LON,
+                    vertical["Iz_interior"],
+                    iMZtime,
+                    near_interior,
+                    wz=vertical["wz_interior"],
+                )
+            if do_BCs:
+                out_boundary = extract_and_interpolate_boundary(
+                    MZspec,
+                    camsReader,
+                    lens,
+                    LONP,
+                    vertical["Iz_boundary"],
+                    iMZtime_for_each_CMtime,
+                    near_boundary,
+                    wz=vertical["wz_boundary"],
+                    timeWeights=timeWeights,
+                )
+            ## the bias correction is for CH4 only
+            if MZspec == "ch4_c":
+                for out in [out_interior, out_boundary]:
+                    if out is not None:
+                        out += bias_correct
+            return out_interior, out_boundary
+
+        ALL_MZ_SPEC = list(dict.fromkeys(m["MZspec"] for m in species_map))
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(ALL_MZ_SPEC)
+        ) as executor:
+            extracted = dict(
+                zip(ALL_MZ_SPEC, executor.map(extract_species, ALL_MZ_SPEC))
+            )
+
+        ## write the output from the main thread
+        Factor = 1.0e3  ## convert from ppm to ppb
+        for MZspec in ALL_MZ_SPEC:
+            out_interior, out_boundary = extracted[MZspec]
+            if do_ICs:
+                print_interior_variable(MZspec, out_interior, Factor)
+            if do_BCs:
+                print_boundary_variable(MZspec, out_boundary, Factor)
+
+        ## sum the contributions to each CMAQ species in place, then
+        ## write each file (and each variable) once
+        ALL_CM_SPEC = list(dict.fromkeys(m["CMspec"] for m in species_map))
+        if do_ICs:
+            shape = (1, lens["LAY"]) + LON.shape
+            icFields = {
+                spec: numpy.zeros(shape, dtype=numpy.float32) for spec in ALL_CM_SPEC
+            }
+            scratch = numpy.empty(shape[1:], dtype=numpy.float32)
+            for m in species_map:
+                accumulate_species(
+                    icFields[m["CMspec"]],
+                    extracted[m["MZspec"]][0],
+                    m.get("coef", 1.0),
+                    scratch,
+                )
+            print("write ICs to file: ", outICON)
+            write_ic_bc_file(templateIconFile, outICON, icFields, defaultSpec)
+        if do_BCs:
+            shape = extracted[ALL_MZ_SPEC[0]][1].shape
+            bcFields = {
+                spec: numpy.zeros(shape, dtype=numpy.float32) for spec in ALL_CM_SPEC
+            }
+            scratch = numpy.empty(shape, dtype=numpy.float32)
+            for m in species_map:
+                accumulate_species(
+                    bcFields[m["CMspec"]],
+                    extracted[m["MZspec"]][1],
+                    m.get("coef", 1.0),
+                    scratch,
+                )
+            print("write BCs to file: ", outBCON)
+            if timeResolvedBCs:
+                write_ic_bc_file(
+                    templateBconFile,
+                    outBCON,
+                    bcFields,
+                    defaultSpec,
+                    TFLAG=TFLAG,
+                    tstep=ncsrf.getncattr("TSTEP"),
+                )
+            else:
+                write_ic_bc_file(templateBconFile, outBCON, bcFields, defaultSpec)
+
+
+## the CAMS reader of each worker process, opened once per process
+_workerCAMSReader = None
+
+
+def _initCAMSWorker(inputCAMSFile, window):
+    """Open the CAMS file in a worker process (see interpolateFromCAMSToCmaqGrid)"""
+    global _workerCAMSReader
+    _workerCAMSReader = CAMSReader(inputCAMSFile, window=window)
+
+
+def _runCAMSWorker(task):
+    """Run interpolateFromCAMSToCmaqGridForDomain in a worker process
+
+    Args:
+        task: dictionary of keyword arguments for interpolateFromCAMSToCmaqGridForDomain (apart from camsReader)
+
+    Returns:
+        output: the text printed by the task
+        caught: list of (message, category, filename, lineno) tuples of the warnings raised by the task
+    """
+    output = io.StringIO()
+    with warnings.catch_warnings(record=True) as caught, contextlib.redirect_stdout(
+        output
+    ):
+        warnings.simplefilter("always")
+        interpolateFromCAMSToCmaqGridForDomain(_workerCAMSReader, **task)
+    return output.getvalue(), [
+        (str(w.message), w.category, w.filename, w.lineno) for w in caught
+    ]
+
+
 def interpolateFromCAMSToCmaqGrid(
     dates,
     doms,
@@ -201,6 +800,11 @@ def interpolateFromCAMSToCmaqGrid(
     forceUpdate,
     bias_correct=0.0,
     defaultSpec="O3",
+    interpolation="nearest",
+    timeResolvedBCs=False,
+    species_map=None,
+    max_workers=1,
+    initialDate=None,
 ):
     """Function to interpolate the from the global CAMS CTM output to ICs and BCs for CMAQ
 
@@ -217,19 +821,35 @@ def interpolateFromCAMSToCmaqGrid(
         mcipsuffix: Suffix for the MCIP output files
         forceUpdate: Boolean (True/False) for whether we should update the output if it already exists
         defaultSpec: A species that is known to exist in the CAMS files (defaults to 'O3'), used for checking dimension information
+        interpolation: horizontal interpolation method, one of 'nearest' (nearest neighbour, the default), 'bilinear' or 'conservative' (area-weighted)
+        timeResolvedBCs: Boolean (True/False) for whether to write boundary conditions for every CMAQ time step (interpolated linearly in time between the CAMS records), rather than a single time-invariant record
+        species_map: list of dictionaries with the keys 'MZspec' (CAMS species), 'CMspec' (CMAQ species) and optionally 'coef' (coefficient to multiply the CAMS values by, defaults to 1). Defaults to mapping ch4_c to CH4
+        max_workers: number of worker processes to spread the dates and domains over (defaults to 1, i.e. everything is done in this process)
+        initialDate: the first date of the whole simulation, the only date for which ICs are made (defaults to dates[0], but can be set when the dates are processed a few at a time)
 
     Returns:
         Nothing
 
     """
+    if species_map is None:
+        species_map = defaultSpeciesMap
+    unknownSpecies = [m["MZspec"] for m in species_map if m["MZspec"] not in moleMass]
+    if unknownSpecies:
+        raise ValueError(
+            "Unknown molecular mass for CAMS species {}, expected one of {}".format(
+                unknownSpecies, list(moleMass.keys())
+            )
+        )
+    if initialDate is None:
+        initialDate = dates[0]
     ##
     ## if we aren't forcing an update, check whether files exist and
     ## return early if possible
     if not forceUpdate:
         allFilesExist = True
-        for idate, date in enumerate(dates):
+        for date in dates:
             yyyymmdd_dashed = date.strftime("%Y-%m-%d")
-            do_ICs = idate == 0
+            do_ICs = date == initialDate
             for idom, dom in enumerate(doms):
                 grid = GridNames[idom]
                 chemdir = "{}/{}/{}".format(ctmDir, yyyymmdd_dashed, dom)
@@ -248,268 +868,78 @@ def interpolateFromCAMSToCmaqGrid(
         if allFilesExist:
             return
 
-    ##
-    for idate, date in enumerate(dates):
-        yyyymmdd_dashed = date.strftime("%Y-%m-%d")
-        do_ICs = idate == 0
-        for idom, dom in enumerate(doms):
-            grid = GridNames[idom]
-            mcipdir = "{}/{}/{}".format(metDir, yyyymmdd_dashed, dom)
-            chemdir = "{}/{}/{}".format(ctmDir, yyyymmdd_dashed, dom)
-
-            ## check that the output directory exists - if not, create it
-            os.makedirs(chemdir, exist_ok=True)
-
-            do_BCs = dom == doms[0]
-
-            if not (do_ICs or do_BCs):
-                continue
-
-            croFile = "{}/GRIDCRO2D_{}".format(mcipdir, mcipsuffix[idom])
-            dotFile = "{}/GRIDDOT2D_{}".format(mcipdir, mcipsuffix[idom])
-            bdyFile = "{}/GRIDBDY2D_{}".format(mcipdir, mcipsuffix[idom])
-            metFile = "{}/METCRO3D_{}".format(mcipdir, mcipsuffix[idom])
-            srfFile = "{}/METCRO2D_{}".format(mcipdir, mcipsuffix[idom])
-            outBCON = "{}/BCON.{}.{}.{}.nc".format(chemdir, dom, grid, mech)
-            outICON = "{}/ICON.{}.{}.{}.nc".format(chemdir, dom, grid, mech)
-            templateIconFile = templateIconFiles[idom]
-            templateBconFile = templateBconFiles[idom]
-
-            if do_BCs:
-                if os.path.exists(outBCON):
-                    os.remove(outBCON)
-                shutil.copyfile(templateBconFile, outBCON)
-                print("copy {} to {}".format(templateBconFile, outBCON))
-
-            if do_ICs:
-                if os.path.exists(outICON):
-                    os.remove(outICON)
-                shutil.copyfile(templateIconFile, outICON)
-                print("copy {} to {}".format(templateIconFile, outICON))
-
-            print(dotFile)
-            with netCDF4.Dataset(
-                croFile, "r", format="NETCDF4"
-            ) as nccro, netCDF4.Dataset(
-                bdyFile, "r", format="NETCDF4"
-            ) as ncbdy, netCDF4.Dataset(
-                metFile, "r", format="NETCDF4"
-            ) as ncmet, netCDF4.Dataset(
-                srfFile, "r", format="NETCDF4"
-            ) as ncsrf, netCDF4.Dataset(inputCAMSFile, "r", format="NETCDF4") as ncin:
-                if do_BCs:
-                    print("write BCs to file: ", outBCON)
-                    ncoutb = netCDF4.Dataset(outBCON, "r+", format="NETCDF4")
-                    all_vars = list(ncoutb.variables.keys())[1:]
-                    nvars = len(all_vars)
-
-                if do_ICs:
-                    print("write ICs to file: ", outICON)
-                    ncouti = netCDF4.Dataset(outICON, "r+", format="NETCDF4")
-                    all_vars = list(ncoutb.variables.keys())[1:]
-                    nvars = len(all_vars)
-
-                lens = dict()
-                for k in list(nccro.dimensions.keys()):
-                    lens[k] = len(nccro.dimensions[k])
-
-                lens["PERIM"] = len(ncbdy.dimensions["PERIM"])
-                lens["LAY"] = len(ncmet.dimensions["LAY"])
-                lens["VAR"] = nvars
-                lens["TSTEP"] = 1
-
-                LAT = nccro.variables["LAT"][:].squeeze()
-                LON = nccro.variables["LON"][:].squeeze()
-                LATP = ncbdy.variables["LAT"][:].squeeze()
-                LONP = ncbdy.variables["LON"][:].squeeze()
-                sigma = ncmet.getncattr("VGLVLS")
-                mtop = ncmet.getncattr("VGTOP")
-                #
-                base_MZ_time = datetime.datetime(1900, 1, 1, 0, 0, 0)  # epoch
-                MZdates = [
-                    base_MZ_time + datetime.timedelta(hours=int(t))
-                    for t in ncin["time"][:]
-                ]
-                #
-                latmz = ncin.variables["latitude"][:].squeeze()
-                lonmz = ncin.variables["longitude"][:].squeeze()
-                PSURF = ncsrf.variables["PRSFC"][:].squeeze()
-                TFLAG = ncsrf.variables["TFLAG"][:, 0, :].squeeze()
-                yyyy = TFLAG[:, 0] // 1000
-                jjj = TFLAG[:, 0] % 1000
-                hh = TFLAG[:, 1] // 10000
-                mm = (TFLAG[:, 1] - hh * 10000) / 100
-                ss = TFLAG[:, 1] % 100
-                ntimemod = len(yyyy)
-                timesmod = [
-                    datetime.datetime(int(yyyy[i]), 1, 1, 0, 0, 0)
-                    + datetime.timedelta(
-                        days=float(jjj[i] - 1)
-                        + float(hh[i]) / 24.0
-                        + float(mm[i]) / (24.0 * 60.0)
-                        + float(ss[i]) / (24.0 * 60.0 * 60.0)
-                    )
-                    for i in range(ntimemod)
-                ]
-                itimes = numpy.where([t.date() == date.date() for t in timesmod])[0]
-                itime0 = itimes[0]
-                itime1 = itimes[-1] + 2
-                timesmod = timesmod[itime0:itime1]
-                TFLAG = TFLAG[itime0:itime1]
-
-                ## populate the pressure array
-                P = numpy.zeros(ncin["ch4_c"].shape)
-                P += ncin["level"][...][
-                    :, numpy.newaxis, numpy.newaxis
-                ]  # broadcasting but into axis 0 not axis -1
-                LATMZ = numpy.zeros((len(latmz), len(lonmz)))
-                LONMZ = numpy.zeros((len(latmz), len(lonmz)))
-                for irow in range(len(latmz)):
-                    LONMZ[irow, :] = lonmz
-
-                for icol in range(len(lonmz)):
-                    LATMZ[:, icol] = latmz
-
-                near_interior = numpy.zeros((LON.shape[0], LON.shape[1], 2), dtype=int)
-                near_boundary = numpy.zeros((LONP.shape[0], 2), dtype=int)
-
-                for irow in range(LON.shape[0]):
-                    for icol in range(LON.shape[1]):
-                        dists = getDistanceFromLatLonInKm(
-                            LAT[irow, icol], LON[irow, icol], LATMZ, LONMZ
-                        )
-                        minidx = numpy.argmin(dists)
-                        ix, iy = numpy.unravel_index(minidx, LONMZ.shape)
-                        near_interior[irow, icol, 0] = ix
-                        near_interior[irow, icol, 1] = iy
-
-                for iperim in range(LONP.shape[0]):
-                    dists = getDistanceFromLatLonInKm(
-                        LATP[iperim], LONP[iperim], LATMZ, LONMZ
-                    )
-                    minidx = numpy.argmin(dists)
-                    ix, iy = numpy.unravel_index(minidx, LONMZ.shape)
-                    near_boundary[iperim, 0] = ix
-                    near_boundary[iperim, 1] = iy
-
-                iMZtime_for_each_CMtime = numpy.zeros((len(timesmod)), dtype=int)
-                for itime, time in enumerate(timesmod):
-                    dtime = numpy.array(
-                        [
-                            ((time - t).total_seconds()) / (24.0 * 60.0 * 60.0)
-                            for t in MZdates
-                        ]
+    ## open the CAMS file once, and share it across dates and domains
+    with CAMSReader(inputCAMSFile) as camsReader:
+        ## only read the part of the CAMS grid that covers the domains
+        mcipdirs = [
+            "{}/{}/{}".format(metDir, dates[0].strftime("%Y-%m-%d"), dom)
+            for dom in doms
+        ]
+        points = [
+            getMcipLatLon(mcipdir, mcipsuffix[idom])
+            for idom, mcipdir in enumerate(mcipdirs)
+        ]
+        camsReader.restrict_to(
+            numpy.concatenate([lat for lat, lon in points]),
+            numpy.concatenate([lon for lat, lon in points]),
+        )
+        ## the mapping between the grids does not change from day to day,
+        ## so calculate (or load) it once per domain
+        cacheDir = os.path.join(ctmDir, "regrid_weights")
+        weights = [
+            getCAMSRegriddingWeights(
+                camsReader, mcipdir, mcipsuffix[idom], cacheDir, interpolation
+            )
+            for idom, mcipdir in enumerate(mcipdirs)
+        ]
+        window = camsReader.window
+
+        ## each (date, domain) is independent, since the ICs (for the
+        ## first date) and the BCs (for the outer domain) go to separate files
+        tasks = []
+        for date in dates:
+            for idom, dom in enumerate(doms):
+                do_ICs = date == initialDate
+                do_BCs = dom == doms[0]
+                if not (do_ICs or do_BCs):
+                    continue
+                tasks.append(
+                    dict(
+                        date=date,
+                        dom=dom,
+                        do_ICs=do_ICs,
+                        do_BCs=do_BCs,
+                        weights=weights[idom],
+                        mech=mech,
+                        templateIconFile=templateIconFiles[idom],
+                        templateBconFile=templateBconFiles[idom],
+                        metDir=metDir,
+                        ctmDir=ctmDir,
+                        grid=GridNames[idom],
+                        mcipsuffix=mcipsuffix[idom],
+                        bias_correct=bias_correct,
+                        defaultSpec=defaultSpec,
+                        timeResolvedBCs=timeResolvedBCs,
+                        species_map=species_map,
                     )
-                    if all(dtime < 0.0):
-                        imin = numpy.argmin(numpy.abs(dtime))
-                        iMZtime_for_each_CMtime[itime] = imin
-                        warnings.warn(
-                            "All dates were negative for date {}, using nearest match: {}".format(
-                                date.strftime("%Y-%m-%d %H:%M:%S"),
-                                MZdates[imin].strftime("%Y-%m-%d %H:%M:%S"),
-                            )
-                        )
-                    else:
-                        iMZtime_for_each_CMtime[itime] = numpy.where(dtime >= 0)[0][-1]
-
-                iMZtime = iMZtime_for_each_CMtime[0]
-
-                ## interpolation from CAMS to CMAQ levels
-                if not ("Iz" in vars() or "Iz" in globals()):
-                    irow = LON.shape[0] - 1
-                    icol = LON.shape[1] - 1
-                    itime = 0
-                    PRES_CM = (PSURF[itime, irow, icol] - mtop) * sigma + mtop
-                    PRES_CM[0] = PSURF[itime, irow, icol]
-                    PRES_CM = (PRES_CM[1:] + PRES_CM[:-1]) / 2.0
-                    # PRES_MZ = Ap +  Bp * PSURF[itime,irow,icol]
-                    PRES_MZm = ncin["level"][:].astype("float")
-                    mb2pa = 100.0  # converting from  millibar to pascal
-                    Iz = match_two_sorted_arrays(PRES_MZm * mb2pa, PRES_CM)
-                ## set the values to zero for species that we *WILL* interpolate to
-                ALL_CM_SPEC = ["CH4"]
-                species_map = []
-                species_map.append(
-                    {
-                        "MZspec": "ch4_c",
-                        "CMspec": "CH4",
-                        "coef": 1.0,
-                        "isAerosol": False,
-                    }
                 )
-                for spec in ALL_CM_SPEC:
-                    if do_ICs:
-                        if spec not in list(ncouti.variables.keys()):
-                            warnings.warn(
-                                "Species {} was not found in template CMAQ IC file -- creating blank variable...".format(
-                                    spec
-                                )
-                            )
-                            isnetcdf4 = ncouti.data_model == "NETCDF4"
-                            ncouti.createVariable(
-                                varname=spec,
-                                datatype="f4",
-                                dimensions=ncouti.variables[defaultSpec].dimensions,
-                                zlib=isnetcdf4,
-                            )
-                            ncouti.long_name = "{:16}".format(spec)
-                            ncouti.units = "{:16}".format("ppmV")
-                            ncouti.var_desc = "{:80}".format("Variable " + spec)
-                        ncouti.variables[spec][:] = 0.0
-                    if do_BCs:
-                        if spec not in list(ncoutb.variables.keys()):
-                            warnings.warn(
-                                "Species {} was not found in template CMAQ BC file -- creating blank variable...".format(
-                                    spec
-                                )
-                            )
-                            isnetcdf4 = ncoutb.data_model == "NETCDF4"
-                            ncoutb.createVariable(
-                                varname=spec,
-                                datatype="f4",
-                                dimensions=ncoutb.variables[defaultSpec].dimensions,
-                                zlib=isnetcdf4,
-                            )
-                            ncoutb.long_name = "{:16}".format(spec)
-                            ncoutb.units = "{:16}".format("ppmV")
-                            ncoutb.var_desc = "{:80}".format("Variable " + spec)
-                        ncoutb.variables[spec][:] = 0.0
-
-                nspec = len(species_map)
-                for ispec in range(nspec):
-                    MZspec = species_map[ispec]["MZspec"]
-                    CMspec = species_map[ispec]["CMspec"]
-                    coefs = species_map[ispec]["coef"]
-                    Factor = 1.0e3  ## convert from ppm to ppb
-                    ##
-                    if do_ICs:
-                        out_interior = extract_and_interpolate_interior(
-                            MZspec, ncin, lens, LON, Iz, iMZtime, P, near_interior
-                        )
-                        out_interior += bias_correct
-                        print_interior_variable(MZspec, out_interior, Factor)
-                    ##
-                    if do_BCs:
-                        out_boundary = extract_and_interpolate_boundary(
-                            MZspec,
-                            ncin,
-                            lens,
-                            LONP,
-                            Iz,
-                            iMZtime_for_each_CMtime,
-                            P,
-                            near_boundary,
-                        )
-                        out_boundary += bias_correct
-                        print_boundary_variable(MZspec, out_boundary, Factor)
-                    ##
-                    if do_ICs:
-                        populate_interior_variable(ncouti, CMspec, out_interior, coefs)
-                    ##
-                    if do_BCs:
-                        populate_boundary_variable(ncoutb, CMspec, out_boundary, coefs)
-
-                if do_ICs:
-                    ncouti.close()
-                if do_BCs:
-                    ncoutb.close()
+
+        if max_workers == 1:
+            for task in tasks:
+                interpolateFromCAMSToCmaqGridForDomain(camsReader, **task)
+            return
+
+    ## fan the work out to worker processes, each with its own CAMS reader
+    ## (restricted to the same window), then report the output and
+    ## warnings in the order of the tasks
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_initCAMSWorker,
+        initargs=(inputCAMSFile, window),
+    ) as executor:
+        futures = [executor.submit(_runCAMSWorker, task) for task in tasks]
+        for future in futures:
+            output, caught = future.result()
+            print(output, end="")
+            for message, category, filename, lineno in caught:
+                warnings.warn_explicit(message, category, filename, lineno)
@@ -0,0 +1,146 @@
+"""Read the global CAMS CTM output, keeping recently used records in memory"""
+
+import collections
+import threading
+
+import netCDF4
+import numpy
+
+from setup_runs.cmaq.cams_regrid import cams_window
+from setup_runs.time_axis import decode_cf_time
+
+
+class CAMSReader:
+    """Read-only access to a CAMS file, shared across dates and domains
+
+    The file is opened once and the coordinates are decoded once (with
+    the times as a numpy.datetime64 array). Each
+    (species, time) record that is read is kept in a bounded LRU cache,
+    so that nested domains on the same date, and consecutive dates that
+    share a CAMS record, are served from memory rather than re-read.
+
+    Reading can be restricted to the block of the CAMS grid that covers
+    the CMAQ domains (see restrict_to), so that memory use scales with
+    the size of the domains rather than the globe. Pressure is not
+    stored: it is given by the 1D level axis.
+
+    Reads can be made from several threads: netCDF/HDF5 is not
+    thread-safe, so the file (and the cache) are accessed under a lock.
+
+    Args:
+        filename: path to the CAMS file
+        maxCachedRecords: maximum number of (species, time) records to keep in memory
+        window: tuple of (latitude, longitude) slices of the CAMS grid to restrict reading to (optional, see restrict_to)
+    """
+
+    def __init__(self, filename, maxCachedRecords=16, window=None):
+        self.filename = filename
+        self.maxCachedRecords = maxCachedRecords
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._nc = netCDF4.Dataset(filename, "r")
+        self._allLatitude = numpy.asarray(self._nc.variables["latitude"][:]).squeeze()
+        self._allLongitude = numpy.asarray(self._nc.variables["longitude"][:]).squeeze()
+        if window is None:
+            window = (
+                slice(0, len(self._allLatitude)),
+                slice(0, len(self._allLongitude)),
+            )
+        self.set_window(window)
+        self.level = numpy.asarray(self._nc.variables["level"][:])
+        time = self._nc.variables["time"]
+        if "units" in time.ncattrs():
+            self.times = decode_cf_time(time[:], time.units)
+        else:
+            self.times = decode_cf_time(time[:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, species):
+        return species in self._nc.variables
+
+    @property
+    def variables(self):
+        """The variables of the underlying netCDF file (for metadata)"""
+        return self._nc.variables
+
+    def close(self):
+        """Close the file and drop the cached records"""
+        self._cache.clear()
+        self._nc.close()
+
+    def restrict_to(self, lat, lon, halo=2):
+        """Only read the block of the CAMS grid covering a set of points
+
+        After this, the latitude and longitude attributes (and the
+        records returned by read) refer to the block rather than the
+        full CAMS grid. Any cached records are dropped.
+
+        Args:
+            lat: array of latitudes of the points to cover (any shape)
+            lon: array of longitudes of the points to cover (same shape as lat)
+            halo: number of extra CAMS grid-points to include on each side
+        """
+        self.set_window(
+            cams_window(lat, lon, self._allLatitude, self._allLongitude, halo)
+        )
+
+    def set_window(self, window):
+        """Only read a block of the CAMS grid
+
+        Args:
+            window: tuple of (latitude, longitude) slices of the CAMS grid
+        """
+        self.window = tuple(window)
+        self.latitude = self._allLatitude[self.window[0]]
+        self.longitude = self._allLongitude[self.window[1]]
+        self._cache.clear()
+
+    def read(self, species, itimes):
+        """Read one or more time records of a species
+
+        Records that are not already cached are read with a single read,
+        which only covers the requested times and the block of the CAMS
+        grid given by the window.
+
+        Args:
+            species: name of the CAMS variable
+            itimes: a time index, or a sequence of time indices
+
+        Returns:
+            varin: read-only array with shape (level, latitude, longitude), or (time, level, latitude, longitude) if itimes is a sequence
+        """
+        indices = numpy.atleast_1d(itimes).astype(int)
+        with self._lock:
+            records = self._read_records(species, indices)
+        if numpy.ndim(itimes) == 0:
+            return records[0]
+        return numpy.stack(records)
+
+    def _read_records(self, species, indices):
+        found = {}
+        for i in indices:
+            if (species, i) in self._cache:
+                self._cache.move_to_end((species, i))
+                found[i] = self._cache[(species, i)]
+        missing = sorted(set(indices.tolist()) - found.keys())
+        if missing:
+            ## read the missing records in one go
+            latSlice, lonSlice = self.window
+            slab = self._nc.variables[species][missing, :, latSlice, lonSlice]
+            for islab, i in enumerate(missing):
+                record = numpy.asarray(slab[islab])
+                record.flags.writeable = False
+                found[i] = record
+                self._store((species, i), record)
+        return [found[i] for i in indices]
+
+    def _store(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxCachedRecords:
+            self._cache.popitem(last=False)
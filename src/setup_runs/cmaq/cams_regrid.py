@@ -0,0 +1,533 @@
+"""Map points on the CMAQ grid onto the (rectilinear) CAMS grid"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy
+import scipy.sparse
+
+from setup_runs.utils import getDistanceFromLatLonInKm
+
+
+def nearest_cams_indices(lat, lon, latmz, lonmz):
+    """Find the nearest CAMS grid-point to each of a set of points
+
+    The CAMS grid is rectilinear, so rather than computing the distance
+    to every CAMS grid-point, the 1D latitude and longitude axes are
+    searched to find a small stencil of candidate grid-points around
+    each point (allowing for the longitudes wrapping around). The
+    closest candidate is then chosen using the great-circle distance,
+    which gives the same indices as a brute-force search over the full
+    CAMS grid.
+
+    Args:
+        lat: array of latitudes of the points to match (any shape)
+        lon: array of longitudes of the points to match (same shape as lat)
+        latmz: 1D array of CAMS latitudes (either ascending or descending)
+        lonmz: 1D array of CAMS longitudes (increasing, modulo 360)
+
+    Returns:
+        near: integer array with shape lat.shape + (2,), where the last axis holds the latitude and longitude indices of the nearest CAMS grid-point
+    """
+    lat = numpy.asarray(lat)
+    lon = numpy.asarray(lon)
+    latmz = numpy.asarray(latmz, dtype=float)
+    lonmz = numpy.asarray(lonmz, dtype=float)
+    nlat = len(latmz)
+    nlon = len(lonmz)
+    shape = lat.shape
+    lat = lat.ravel()
+    lon = lon.ravel()
+    ## candidate latitudes: two grid-points either side of each point
+    descending = nlat > 1 and latmz[0] > latmz[-1]
+    latAscending = latmz[::-1] if descending else latmz
+    ilat = numpy.searchsorted(latAscending, lat)
+    ilat = numpy.clip(ilat[:, numpy.newaxis] + numpy.arange(-2, 2), 0, nlat - 1)
+    if descending:
+        ilat = nlat - 1 - ilat
+    ## candidate longitudes: the pair bracketing each point, measured
+    ## relative to the first CAMS longitude so that the wrap at 360
+    ## degrees falls between the last and first grid-points
+    lonRelative = numpy.mod(lonmz - lonmz[0], 360.0)
+    ilon = numpy.searchsorted(lonRelative, numpy.mod(lon - lonmz[0], 360.0), "right")
+    ilon = numpy.stack([ilon - 1, ilon % nlon], axis=1)
+    ## combine into (latitude, longitude) pairs, sorted by their
+    ## position in the flattened CAMS grid so that ties are resolved
+    ## in the same way as numpy.argmin over the full grid
+    candidates = (ilat[:, :, numpy.newaxis] * nlon + ilon[:, numpy.newaxis, :]).reshape(
+        len(lat), -1
+    )
+    candidates.sort(axis=1)
+    icand, jcand = numpy.unravel_index(candidates, (nlat, nlon))
+    dists = getDistanceFromLatLonInKm(
+        lat[:, numpy.newaxis], lon[:, numpy.newaxis], latmz[icand], lonmz[jcand]
+    )
+    best = numpy.argmin(dists, axis=1)
+    rows = numpy.arange(len(lat))
+    near = numpy.stack([icand[rows, best], jcand[rows, best]], axis=-1)
+    return near.reshape(shape + (2,))
+
+
+def gather_columns(varin, Iz, near):
+    """Extract the columns of a CAMS field at a set of grid-points and levels
+
+    Args:
+        varin: CAMS field, with the last three axes being (level, latitude, longitude)
+        Iz: array of indices of CAMS levels to extract
+        near: integer array of CAMS (latitude, longitude) indices, with the last axis having length 2 (as returned by nearest_cams_indices)
+
+    Returns:
+        columns: array with shape varin.shape[:-3] + (len(Iz),) + near.shape[:-1]
+    """
+    ix = near[..., 0]
+    iy = near[..., 1]
+    Iz = numpy.asarray(Iz).reshape((-1,) + (1,) * ix.ndim)
+    return numpy.asarray(varin)[..., Iz, ix, iy]
+
+
+def _cell_edges(centres):
+    """Estimate the edges of grid-cells from a 1D array of (increasing) cell centres"""
+    mid = 0.5 * (centres[1:] + centres[:-1])
+    first = centres[0] - (mid[0] - centres[0])
+    last = centres[-1] + (centres[-1] - mid[-1])
+    return numpy.concatenate([[first], mid, [last]])
+
+
+def _cams_axes(latmz, lonmz):
+    """Prepare the CAMS axes for searching
+
+    Returns:
+        latAscending: CAMS latitudes in ascending order
+        latIndex: array mapping indices of latAscending back to the original CAMS latitude indices
+        lonRelative: CAMS longitudes relative to the first CAMS longitude (in the range 0-360)
+        isGlobal: True if the CAMS longitudes wrap around the globe
+    """
+    latmz = numpy.asarray(latmz, dtype=float)
+    lonmz = numpy.asarray(lonmz, dtype=float)
+    latIndex = numpy.arange(len(latmz))
+    if len(latmz) > 1 and latmz[0] > latmz[-1]:
+        latIndex = latIndex[::-1]
+    lonRelative = numpy.mod(lonmz - lonmz[0], 360.0)
+    spacing = numpy.median(numpy.diff(lonRelative)) if len(lonmz) > 1 else 360.0
+    isGlobal = 360.0 - lonRelative[-1] <= 1.5 * spacing
+    return latmz[latIndex], latIndex, lonRelative, isGlobal
+
+
+def cams_window(lat, lon, latmz, lonmz, halo=2):
+    """Find the block of the CAMS grid that covers a set of points
+
+    The block spans the latitude/longitude bounding box of the points,
+    extended by a halo of CAMS grid-points on each side. If the box
+    crosses the first CAMS longitude (so that it cannot be read as a
+    single block), the full range of longitudes is used instead.
+
+    Args:
+        lat: array of latitudes of the points (any shape)
+        lon: array of longitudes of the points (same shape as lat)
+        latmz: 1D array of CAMS latitudes (either ascending or descending)
+        lonmz: 1D array of CAMS longitudes (increasing, modulo 360)
+        halo: number of extra CAMS grid-points to include on each side
+
+    Returns:
+        latSlice: slice of the CAMS latitude axis
+        lonSlice: slice of the CAMS longitude axis
+    """
+    lat = numpy.asarray(lat, dtype=float).ravel()
+    lon = numpy.asarray(lon, dtype=float).ravel()
+    latAscending, latIndex, lonRelative, isGlobal = _cams_axes(latmz, lonmz)
+    nlat = len(latAscending)
+    nlon = len(lonRelative)
+    ## latitude: indices of the grid-points bracketing the points
+    ilat = numpy.clip(
+        [
+            numpy.searchsorted(latAscending, lat.min()) - 1 - halo,
+            numpy.searchsorted(latAscending, lat.max()) + halo,
+        ],
+        0,
+        nlat - 1,
+    )
+    ilat = latIndex[ilat]
+    latSlice = slice(int(ilat.min()), int(ilat.max()) + 1)
+    ## longitude: as for latitude, measured relative to the first CAMS
+    ## longitude
+    lonPoint = numpy.mod(lon - numpy.asarray(lonmz, dtype=float)[0], 360.0)
+    ilon = numpy.searchsorted(lonRelative, lonPoint, "right") - 1
+    ifirst = int(ilon.min()) - halo
+    ilast = int(ilon.max()) + 1 + halo
+    crossesWrap = lonPoint.max() - lonPoint.min() > 180.0
+    if isGlobal and (crossesWrap or ifirst < 0 or ilast > nlon - 1):
+        lonSlice = slice(0, nlon)
+    else:
+        lonSlice = slice(max(ifirst, 0), min(ilast, nlon - 1) + 1)
+    return latSlice, lonSlice
+
+
+def bilinear_weights(lat, lon, latmz, lonmz):
+    """Calculate a sparse matrix of bilinear interpolation weights from the CAMS grid to a set of points
+
+    Interpolation is linear in latitude and longitude between the four
+    CAMS grid-points surrounding each point. Points beyond the edges of
+    the CAMS grid take the values at the nearest edge.
+
+    Args:
+        lat: array of latitudes of the points to interpolate to (any shape)
+        lon: array of longitudes of the points to interpolate to (same shape as lat)
+        latmz: 1D array of CAMS latitudes (either ascending or descending)
+        lonmz: 1D array of CAMS longitudes (increasing, modulo 360)
+
+    Returns:
+        weights: scipy.sparse.csr_matrix with one row per point (in the order of lat.ravel()) and one column per CAMS grid-point (in the order of a flattened (latitude, longitude) array)
+    """
+    lat = numpy.asarray(lat, dtype=float).ravel()
+    lon = numpy.asarray(lon, dtype=float).ravel()
+    latAscending, latIndex, lonRelative, isGlobal = _cams_axes(latmz, lonmz)
+    nlat = len(latAscending)
+    nlon = len(lonRelative)
+    ## latitude: bracketing pair of grid-points and the linear weight
+    ilat = numpy.clip(numpy.searchsorted(latAscending, lat) - 1, 0, max(nlat - 2, 0))
+    ilat1 = numpy.minimum(ilat + 1, nlat - 1)
+    dlat = latAscending[ilat1] - latAscending[ilat]
+    wlat = numpy.divide(
+        lat - latAscending[ilat], dlat, out=numpy.zeros_like(lat), where=dlat > 0
+    )
+    wlat = numpy.clip(wlat, 0.0, 1.0)
+    ## longitude: bracketing pair of grid-points (which may wrap
+    ## around from the last to the first CAMS longitude)
+    lonPoint = numpy.mod(lon - numpy.asarray(lonmz, dtype=float)[0], 360.0)
+    ilon = numpy.searchsorted(lonRelative, lonPoint, "right") - 1
+    ilon1 = (ilon + 1) % nlon
+    dlon = numpy.mod(lonRelative[ilon1] - lonRelative[ilon], 360.0)
+    dlon[dlon == 0.0] = 360.0
+    wlon = (lonPoint - lonRelative[ilon]) / dlon
+    if not isGlobal:
+        ## points in the gap between the last and first longitudes
+        ## take the value from the nearest of the two
+        inGap = ilon == nlon - 1
+        wlon[inGap] = (wlon[inGap] > 0.5).astype(float)
+    ##
+    rows = numpy.repeat(numpy.arange(len(lat)), 4)
+    cols = numpy.stack(
+        [
+            latIndex[ilat] * nlon + ilon,
+            latIndex[ilat] * nlon + ilon1,
+            latIndex[ilat1] * nlon + ilon,
+            latIndex[ilat1] * nlon + ilon1,
+        ],
+        axis=1,
+    ).ravel()
+    vals = numpy.stack(
+        [
+            (1.0 - wlat) * (1.0 - wlon),
+            (1.0 - wlat) * wlon,
+            wlat * (1.0 - wlon),
+            wlat * wlon,
+        ],
+        axis=1,
+    ).ravel()
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(lat), nlat * nlon))
+
+
+def cell_half_widths(LAT, LON):
+    """Estimate the half-widths (in degrees) of the CMAQ grid-cells
+
+    The extent of each cell is approximated by the latitude/longitude
+    bounding box spanned by the vectors to its neighbours.
+
+    Args:
+        LAT: 2D array of latitudes of the CMAQ cell centres (ROW, COL)
+        LON: 2D array of longitudes of the CMAQ cell centres (ROW, COL)
+
+    Returns:
+        halfLat: array of half-widths in latitude (same shape as LAT)
+        halfLon: array of half-widths in longitude (same shape as LON)
+    """
+    LAT = numpy.asarray(LAT, dtype=float)
+    LON = numpy.unwrap(
+        numpy.unwrap(numpy.asarray(LON, dtype=float), period=360.0, axis=0),
+        period=360.0,
+        axis=1,
+    )
+    dlatRow, dlatCol = numpy.gradient(LAT)
+    dlonRow, dlonCol = numpy.gradient(LON)
+    halfLat = 0.5 * (numpy.abs(dlatRow) + numpy.abs(dlatCol))
+    halfLon = 0.5 * (numpy.abs(dlonRow) + numpy.abs(dlonCol))
+    return halfLat, halfLon
+
+
+def _overlaps(lower, upper, cellLower, cellUpper):
+    """Find the overlaps between a set of intervals and a sorted set of cells
+
+    Returns:
+        icell: indices of the overlapping cells, one row per interval
+        overlap: the extent of the overlaps (zero where there is no overlap)
+    """
+    istart = numpy.searchsorted(cellUpper, lower, "right")
+    iend = numpy.searchsorted(cellLower, upper, "left")
+    ncand = max(int((iend - istart).max(initial=0)), 1)
+    icell = numpy.clip(
+        istart[:, numpy.newaxis] + numpy.arange(ncand), 0, len(cellLower) - 1
+    )
+    overlap = numpy.minimum(upper[:, numpy.newaxis], cellUpper[icell]) - numpy.maximum(
+        lower[:, numpy.newaxis], cellLower[icell]
+    )
+    overlap[numpy.arange(ncand) >= (iend - istart)[:, numpy.newaxis]] = 0.0
+    return icell, numpy.maximum(overlap, 0.0)
+
+
+def conservative_weights(lat, lon, halfLat, halfLon, latmz, lonmz):
+    """Calculate a sparse matrix of area-weighted (conservative) remapping weights from the CAMS grid to a set of cells
+
+    Each target cell is treated as a latitude/longitude box, and is
+    given the average of the CAMS cells it overlaps, weighted by the
+    area of the overlap on the sphere. Cells that do not overlap the
+    CAMS grid take the value of the nearest CAMS grid-point.
+
+    Args:
+        lat: array of latitudes of the centres of the target cells (any shape)
+        lon: array of longitudes of the centres of the target cells (same shape as lat)
+        halfLat: half-widths of the target cells in latitude (broadcastable to lat)
+        halfLon: half-widths of the target cells in longitude (broadcastable to lat)
+        latmz: 1D array of CAMS latitudes (either ascending or descending)
+        lonmz: 1D array of CAMS longitudes (increasing, modulo 360)
+
+    Returns:
+        weights: scipy.sparse.csr_matrix with one row per target cell (in the order of lat.ravel()) and one column per CAMS grid-point (in the order of a flattened (latitude, longitude) array)
+    """
+    halfLat = numpy.broadcast_to(halfLat, numpy.shape(lat)).ravel()
+    halfLon = numpy.broadcast_to(halfLon, numpy.shape(lat)).ravel()
+    lat = numpy.asarray(lat, dtype=float).ravel()
+    lon = numpy.asarray(lon, dtype=float).ravel()
+    latAscending, latIndex, lonRelative, isGlobal = _cams_axes(latmz, lonmz)
+    nlat = len(latAscending)
+    nlon = len(lonRelative)
+    ## latitude overlaps, measured in sin(latitude) so that the
+    ## product with the longitude overlap is proportional to area
+    latEdges = numpy.clip(_cell_edges(latAscending), -90.0, 90.0)
+    sinEdges = numpy.sin(numpy.deg2rad(latEdges))
+    sinLower = numpy.sin(numpy.deg2rad(numpy.clip(lat - halfLat, -90.0, 90.0)))
+    sinUpper = numpy.sin(numpy.deg2rad(numpy.clip(lat + halfLat, -90.0, 90.0)))
+    ilat, latOverlap = _overlaps(sinLower, sinUpper, sinEdges[:-1], sinEdges[1:])
+    ## longitude overlaps, with the CAMS cells repeated either side
+    ## of the 0-360 range to allow for boxes crossing the wrap
+    lonEdges = _cell_edges(lonRelative)
+    offsets = [-360.0, 0.0, 360.0] if isGlobal else [0.0]
+    lonLower = numpy.concatenate([lonEdges[:-1] + o for o in offsets])
+    lonUpper = numpy.concatenate([lonEdges[1:] + o for o in offsets])
+    lonPoint = numpy.mod(lon - numpy.asarray(lonmz, dtype=float)[0], 360.0)
+    ilon, lonOverlap = _overlaps(
+        lonPoint - halfLon, lonPoint + halfLon, lonLower, lonUpper
+    )
+    ilon = ilon % nlon
+    ##
+    area = latOverlap[:, :, numpy.newaxis] * lonOverlap[:, numpy.newaxis, :]
+    cols = latIndex[ilat][:, :, numpy.newaxis] * nlon + ilon[:, numpy.newaxis, :]
+    rows = numpy.broadcast_to(
+        numpy.arange(len(lat))[:, numpy.newaxis, numpy.newaxis], area.shape
+    )
+    total = area.sum(axis=(1, 2))
+    hasOverlap = total > 0
+    area = area / numpy.where(hasOverlap, total, 1.0)[:, numpy.newaxis, numpy.newaxis]
+    keep = area > 0
+    rows = rows[keep]
+    cols = cols[keep]
+    vals = area[keep]
+    ## fall back to the nearest CAMS grid-point where there is no overlap
+    if not hasOverlap.all():
+        missing = numpy.where(~hasOverlap)[0]
+        near = nearest_cams_indices(lat[missing], lon[missing], latmz, lonmz)
+        rows = numpy.concatenate([rows, missing])
+        cols = numpy.concatenate([cols, near[:, 0] * nlon + near[:, 1]])
+        vals = numpy.concatenate([vals, numpy.ones(len(missing))])
+    return scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(lat), nlat * nlon))
+
+
+def remap_columns(varin, Iz, weights):
+    """Interpolate the columns of a CAMS field to a set of points using a sparse weight matrix
+
+    All levels (and any leading axes, such as time) are interpolated
+    with a single sparse matrix product.
+
+    Args:
+        varin: CAMS field, with the last three axes being (level, latitude, longitude)
+        Iz: array of indices of CAMS levels to extract
+        weights: sparse weight matrix (as returned by bilinear_weights or conservative_weights)
+
+    Returns:
+        columns: array with shape varin.shape[:-3] + (len(Iz), npoints)
+    """
+    varin = numpy.asarray(varin)[..., Iz, :, :]
+    leading = varin.shape[:-2]
+    X = varin.reshape((-1, varin.shape[-2] * varin.shape[-1]))
+    return weights.dot(X.T).T.reshape(leading + (weights.shape[0],))
+
+
+def map_columns(varin, Iz, mapping):
+    """Map the columns of a CAMS field to a set of points
+
+    Args:
+        varin: CAMS field, with the last three axes being (level, latitude, longitude)
+        Iz: array of indices of CAMS levels to extract
+        mapping: either an array of nearest CAMS (latitude, longitude) indices (see gather_columns) or a sparse weight matrix (see remap_columns)
+
+    Returns:
+        columns: array with shape varin.shape[:-3] + (len(Iz),) followed by either mapping.shape[:-1] (for nearest indices) or the number of points (for sparse weights)
+    """
+    if scipy.sparse.issparse(mapping):
+        return remap_columns(varin, Iz, mapping)
+    return gather_columns(varin, Iz, mapping)
+
+
+def boundary_to_interior_indices(nrow, ncol, nthik=1):
+    """Find the nearest interior grid-cell to each CMAQ boundary (PERIM) point
+
+    The boundary points are ordered as in I/O API boundary files,
+    i.e. the southern, eastern, northern and western edges in turn,
+    each ordered by row and then column.
+
+    Args:
+        nrow: number of rows in the CMAQ grid
+        ncol: number of columns in the CMAQ grid
+        nthik: thickness of the boundary (in grid-cells)
+
+    Returns:
+        irow: row index of the nearest interior cell, one per boundary point
+        icol: column index of the nearest interior cell, one per boundary point
+    """
+    edges = [
+        (numpy.arange(-nthik, 0), numpy.arange(0, ncol + nthik)),
+        (numpy.arange(0, nrow + nthik), numpy.arange(ncol, ncol + nthik)),
+        (numpy.arange(nrow, nrow + nthik), numpy.arange(-nthik, ncol)),
+        (numpy.arange(-nthik, nrow), numpy.arange(-nthik, 0)),
+    ]
+    irow, icol = zip(*[numpy.meshgrid(r, c, indexing="ij") for r, c in edges])
+    irow = numpy.clip(numpy.concatenate([i.ravel() for i in irow]), 0, nrow - 1)
+    icol = numpy.clip(numpy.concatenate([i.ravel() for i in icol]), 0, ncol - 1)
+    return irow, icol
+
+
+def vertical_interpolation_weights(PSURF, sigma, mtop, levels):
+    """Calculate weights to interpolate from the CAMS pressure levels to the CMAQ layers
+
+    The pressure at the middle of each CMAQ layer is calculated for each
+    column and time from the surface pressure and the sigma levels.
+    Interpolation is then linear in log(pressure) between the CAMS
+    levels bracketing the middle of the layer. Layers above the top (or
+    below the bottom) CAMS level take the value from that level.
+
+    Args:
+        PSURF: array of surface pressures (units = Pa), with shape (TSTEP,) followed by the shape of the grid (e.g. (ROW, COL) or (PERIM,))
+        sigma: 1D array of the CMAQ sigma levels (the VGLVLS attribute), from the surface upwards
+        mtop: pressure at the top of the CMAQ model (the VGTOP attribute, units = Pa)
+        levels: 1D array of the CAMS pressure levels (units = Pa), in ascending order
+
+    Returns:
+        Iz: int16 (or int32, for more than 32767 CAMS levels) array with shape (TSTEP, LAY) followed by the shape of the grid, containing the index of the CAMS level at or above (in pressure) the middle of each CMAQ layer
+        wz: float32 array of the same shape, containing the weight to give to the CAMS level Iz+1 (the weight for level Iz is 1 - wz)
+    """
+    PSURF = numpy.asarray(PSURF, dtype=float)
+    sigma = numpy.asarray(sigma, dtype=float)
+    logLevels = numpy.log(numpy.asarray(levels, dtype=float))
+    nlev = len(logLevels)
+    ## pressure at the CMAQ layer edges and middles, with the layer
+    ## axis inserted after the time axis
+    sigma = sigma.reshape((1, -1) + (1,) * (PSURF.ndim - 1))
+    PRES_CM = (PSURF[:, numpy.newaxis] - mtop) * sigma + mtop
+    logPres = numpy.log((PRES_CM[:, 1:] + PRES_CM[:, :-1]) / 2.0)
+    ##
+    Iz = numpy.clip(numpy.searchsorted(logLevels, logPres) - 1, 0, max(nlev - 2, 0))
+    ## there are few CAMS levels, so the indices do not need 64 bits
+    Iz = Iz.astype(numpy.int16 if nlev <= numpy.iinfo(numpy.int16).max else numpy.int32)
+    Iz1 = numpy.minimum(Iz + 1, nlev - 1)
+    dlog = logLevels[Iz1] - logLevels[Iz]
+    wz = numpy.divide(
+        logPres - logLevels[Iz], dlog, out=numpy.zeros_like(logPres), where=dlog > 0
+    )
+    return Iz, numpy.clip(wz, 0.0, 1.0).astype(numpy.float32)
+
+
+def interpolate_vertically(columns, Iz, wz, axis):
+    """Interpolate CAMS columns to the CMAQ layers
+
+    Args:
+        columns: array of CAMS values on the CAMS levels, e.g. with axes (level, ROW, COL)
+        Iz: integer array of CAMS level indices for each CMAQ layer (see vertical_interpolation_weights), with the same number of dimensions as columns and with the other axes broadcastable against those of columns
+        wz: array of weights with the same shape as Iz
+        axis: the level/layer axis of columns, Iz and wz
+
+    Returns:
+        out: array with the CAMS levels of columns replaced by the CMAQ layers
+    """
+    nlev = columns.shape[axis]
+    lower = numpy.take_along_axis(columns, Iz, axis=axis)
+    upper = numpy.take_along_axis(columns, numpy.minimum(Iz + 1, nlev - 1), axis=axis)
+    upper -= lower
+    upper *= wz
+    upper += lower
+    return upper
+
+
+def sparse_to_arrays(name, matrix):
+    """Convert a sparse matrix to a dictionary of arrays, so it can be stored with numpy.savez"""
+    matrix = scipy.sparse.csr_matrix(matrix)
+    return {
+        name + "_data": matrix.data,
+        name + "_indices": matrix.indices,
+        name + "_indptr": matrix.indptr,
+        name + "_shape": numpy.array(matrix.shape),
+    }
+
+
+def arrays_to_sparse(name, arrays):
+    """Convert a dictionary of arrays (from sparse_to_arrays) back to a sparse matrix"""
+    return scipy.sparse.csr_matrix(
+        (arrays[name + "_data"], arrays[name + "_indices"], arrays[name + "_indptr"]),
+        shape=tuple(arrays[name + "_shape"]),
+    )
+
+
+def grid_fingerprint(*items):
+    """Calculate a fingerprint (hash) of a set of grid definitions
+
+    Args:
+        items: strings, numbers and/or numpy arrays describing the grids (e.g. the contents of the GRIDDESC file and the latitudes and longitudes)
+
+    Returns:
+        fingerprint: hexadecimal string that changes if any of the items change
+    """
+    sha = hashlib.sha1()
+    for item in items:
+        if isinstance(item, str):
+            sha.update(item.encode())
+        else:
+            item = numpy.ascontiguousarray(item)
+            sha.update(str((item.dtype.str, item.shape)).encode())
+            sha.update(item.tobytes())
+    return sha.hexdigest()
+
+
+def load_or_compute_weights(cacheDir, fingerprint, compute):
+    """Load regridding weights from the on-disk cache, calculating and storing them if need be
+
+    Args:
+        cacheDir: directory in which the cached weights are stored
+        fingerprint: fingerprint of the grids (from grid_fingerprint), used to name the cache file
+        compute: function taking no arguments that calculates the weights, returning a dictionary of numpy arrays
+
+    Returns:
+        weights: dictionary of numpy arrays
+    """
+    cacheFile = os.path.join(cacheDir, "cams_weights_{}.npz".format(fingerprint))
+    if os.path.exists(cacheFile):
+        with numpy.load(cacheFile) as npz:
+            return {k: npz[k] for k in npz.files}
+    ##
+    weights = compute()
+    os.makedirs(cacheDir, exist_ok=True)
+    ## write to a temporary file and then rename, so that other
+    ## processes never see a partially-written cache file
+    fd, tmpFile = tempfile.mkstemp(dir=cacheDir, suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        numpy.savez_compressed(f, **weights)
+    os.replace(tmpFile, cacheFile)
+    return weights
@@ -20,25 +20,482 @@ for date in dates:
       if MCIP failed:
           Abort
       endif
-      Compress to netCDF4 using ncks
+      Compress to netCDF4
   endfor
 endfor
 """
 
 import netCDF4
+import numpy
 import datetime
 import subprocess
-from setup_runs.utils import replace_and_write
+import collections
+import concurrent.futures
+import functools
+import threading
+from setup_runs.compression import compress_nc_file, compress_nc_files
+from setup_runs.cmaq.mcip_manifest import (
+    mcip_update_reason,
+    remove_manifest,
+    write_manifest,
+)
+from setup_runs.utils import replace_and_write, stage_file, substitute_lines
 import os
 import glob
 import tempfile
-from shutil import copyfile
+import shutil
+
+## netCDF/HDF5 is not thread-safe, so when runMCIP runs jobs on threads,
+## only one of them at a time uses netCDF4 in this process
+netcdfLock = threading.Lock()
 
 
 def to_wrf_filename(domain: str, time: datetime.datetime) -> str:
     return f'WRFOUT_{domain}_{time.strftime("%Y-%m-%dT%H%M")}Z.nc'
 
 
+def mcip_wrf_files(wrfDir, date, dom):
+    """List the 25 hourly WRFOUT files that MCIP needs for one date and domain
+
+    Args:
+        wrfDir: directory containing the WRF output, in a subdirectory per date (<yyyymmddhh>)
+        date: date to process
+        dom: name of the domain (e.g. 'd01')
+
+    Returns:
+        WRFfiles: list of paths to the WRFOUT files, from 00Z on the date to 00Z the next day
+    """
+    times = [date + datetime.timedelta(hours=h) for h in range(25)]
+    return [
+        os.path.join(wrfDir, date.strftime("%Y%m%d%H"), to_wrf_filename(dom, time))
+        for time in times
+    ]
+
+
+def wrf_patches_needed(
+    path, simulation_start_date=None, truelat2=None, add_qsnow=False
+):
+    """Find which fixes need to be applied to a WRFOUT file before running MCIP
+
+    Args:
+        path: Path to the WRFOUT file
+        simulation_start_date: required value of the SIMULATION_START_DATE attribute (or None to leave it as is)
+        truelat2: required value of the TRUELAT2 attribute (or None to leave it as is)
+        add_qsnow: True/False - should a QSNOW variable be added if it is missing?
+
+    Returns:
+        patches: set of the fixes needed, from 'SIMULATION_START_DATE', 'TRUELAT2' and 'QSNOW'
+    """
+    patches = set()
+    with netCDF4.Dataset(path, "r") as nc:
+        attrs = nc.ncattrs()
+        if simulation_start_date is not None and (
+            "SIMULATION_START_DATE" not in attrs
+            or nc.getncattr("SIMULATION_START_DATE") != simulation_start_date
+        ):
+            patches.add("SIMULATION_START_DATE")
+        if truelat2 is not None and (
+            "TRUELAT2" not in attrs
+            or numpy.float32(nc.getncattr("TRUELAT2")) != numpy.float32(truelat2)
+        ):
+            patches.add("TRUELAT2")
+        if add_qsnow and "QSNOW" not in nc.variables:
+            patches.add("QSNOW")
+    return patches
+
+
+def prepare_wrf_file(path, patches, simulation_start_date=None, truelat2=None):
+    """Apply fixes to a (staged) WRFOUT file in place, opening it once
+
+    QSNOW is defined with a fill value of zero rather than being written
+    out, so adding it costs no more than a change to the header.
+
+    Args:
+        path: Path to the WRFOUT file
+        patches: set of the fixes to apply (see wrf_patches_needed)
+        simulation_start_date: value of the SIMULATION_START_DATE attribute
+        truelat2: value of the TRUELAT2 attribute
+
+    Returns:
+        Nothing
+    """
+    if not patches:
+        return
+    with netCDF4.Dataset(path, "a") as nc:
+        if "SIMULATION_START_DATE" in patches:
+            nc.setncattr("SIMULATION_START_DATE", simulation_start_date)
+        if "TRUELAT2" in patches:
+            nc.setncattr("TRUELAT2", numpy.float32(truelat2))
+        if "QSNOW" in patches:
+            nc.createVariable(
+                "QSNOW",
+                "f4",
+                ("Time", "bottom_top", "south_north", "west_east"),
+                zlib=True,
+                fill_value=numpy.float32(0.0),
+            )
+
+
+def prepare_wrf_files(
+    paths, patches, simulation_start_date=None, truelat2=None, max_workers=1
+):
+    """Apply fixes to a set of (staged) WRFOUT files, optionally in parallel
+
+    netCDF/HDF5 is not thread-safe, so the files are spread over worker
+    processes rather than threads.
+
+    Args:
+        paths: list of paths to the WRFOUT files
+        patches: list of sets of the fixes to apply, one per file (see wrf_patches_needed)
+        simulation_start_date: value of the SIMULATION_START_DATE attribute
+        truelat2: value of the TRUELAT2 attribute
+        max_workers: number of worker processes (1 means the files are prepared in this process)
+
+    Returns:
+        nfixed: the number of files that were changed
+    """
+    tasks = [(path, patch) for path, patch in zip(paths, patches) if patch]
+    prepare = functools.partial(
+        _prepare_wrf_task,
+        simulation_start_date=simulation_start_date,
+        truelat2=truelat2,
+    )
+    if max_workers == 1 or len(tasks) <= 1:
+        for task in tasks:
+            prepare(task)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(max_workers, len(tasks))
+        ) as executor:
+            ## consume the results, so that any errors are raised
+            list(executor.map(prepare, tasks))
+    return len(tasks)
+
+
+def _prepare_wrf_task(task, simulation_start_date, truelat2):
+    path, patch = task
+    prepare_wrf_file(path, patch, simulation_start_date, truelat2)
+
+
+def mcip_terminated_normally(logPath):
+    """Check whether MCIP finished correctly, i.e. its output ends with 'NORMAL TERMINATION'
+
+    Args:
+        logPath: Path to the file containing the output of the run.mcip script
+
+    Returns:
+        True if MCIP finished correctly, False if not
+    """
+    with open(logPath, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - 4096, 0))
+        tail = f.read()
+    return tail.rstrip(b"\n").split(b"\n")[-1] == b"NORMAL TERMINATION"
+
+
+def run_mcip_job(
+    date,
+    idom,
+    dom,
+    metDir,
+    wrfDir,
+    geoDir,
+    ProgDir,
+    APPL,
+    CoordName,
+    GridName,
+    scripts,
+    compressWithNco=True,
+    fix_simulation_start_date=True,
+    fix_truelat2=False,
+    truelat2=None,
+    wrfRunName=None,
+    doArchiveWrf=False,
+    add_qsnow=False,
+    staging="link",
+    prepare_workers=1,
+    compress_workers=1,
+    forceUpdate=True,
+    manifest_hash=False,
+    compress_executor=None,
+):
+    """Run MCIP for one date and domain
+
+    The output of MCIP is written to a log file (run.mcip.<dom>.log) in
+    the MCIP directory, rather than being held in memory.
+
+    Args:
+        date: date to process
+        idom: index of the domain (in the lists APPL, CoordName and GridName)
+        dom: name of the domain (e.g. 'd01')
+        compress_executor: ProcessPoolExecutor to compress the MCIP output in, rather than in this process (optional)
+        See runMCIP for the other arguments
+
+    Returns:
+        Nothing
+    """
+    print("date = {}, dom = {}".format(date, dom))
+    tmpfl = tempfile.mktemp(suffix=".tar")
+    cwd = os.getcwd()
+    nMinsPerInterval = 60
+    yyyymmddhh = date.strftime("%Y%m%d%H")
+    yyyymmdd_dashed = date.strftime("%Y-%m-%d")
+    mcipDir = "{}/{}/{}".format(metDir, yyyymmdd_dashed, dom)
+    ##
+    ## the Fortran links and namelist are written to a working directory
+    ## of their own, so that jobs can run side by side
+    workDir = "{}/work".format(mcipDir)
+    ##
+    times = [date + datetime.timedelta(hours=h) for h in range(25)]
+    WRFfiles = mcip_wrf_files(wrfDir, date, dom)
+    outPaths = [
+        "{}/{}".format(mcipDir, os.path.basename(WRFfile)) for WRFfile in WRFfiles
+    ]
+    geoFile = "{}/geo_em.{}.nc".format(geoDir, dom)
+    # {}/{}'.format(wrfDir,date.strftime('%Y%m%d%H'))---by Sougol
+    subs = [
+        ["set DataPath   = TEMPLATE", "set DataPath   = {}".format(mcipDir)],
+        ["set InMetDir   = TEMPLATE", "set InMetDir   = {}".format(mcipDir)],
+        ["set OutDir     = TEMPLATE", "set OutDir     = {}".format(mcipDir)],
+        [
+            "set InMetFiles = ( TEMPLATE )",
+            "set InMetFiles = ( {} )".format(" ".join(outPaths)),
+        ],
+        [
+            "set InTerFile  = TEMPLATE",
+            "set InTerFile  = {}".format(geoFile),
+        ],
+        [
+            "set MCIP_START = TEMPLATE",
+            "set MCIP_START = {}:00:00.0000".format(date.strftime("%Y-%m-%d-%H")),
+        ],
+        [
+            "set MCIP_END   = TEMPLATE",
+            "set MCIP_END   = {}:00:00.0000".format(times[-1].strftime("%Y-%m-%d-%H")),
+        ],
+        [
+            "set INTVL      = TEMPLATE",
+            "set INTVL      = {}".format(int(round(nMinsPerInterval))),
+        ],
+        ["set APPL       = TEMPLATE", "set APPL       = {}".format(APPL[idom])],
+        [
+            "set CoordName  = TEMPLATE",
+            "set CoordName  = {}".format(CoordName[idom]),
+        ],
+        [
+            "set GridName   = TEMPLATE",
+            "set GridName   = {}".format(GridName[idom]),
+        ],
+        ["set ProgDir    = TEMPLATE", "set ProgDir    = {}".format(ProgDir)],
+        ["set WorkDir    = $OutDir", "set WorkDir    = {}".format(workDir)],
+    ]
+    scriptLines = substitute_lines(scripts["mcipRun"]["lines"], subs, strict=False)
+    ##
+    ## MCIP is only run again if its inputs (or the run script) have
+    ## changed, or its output is incomplete
+    if not forceUpdate:
+        reason = mcip_update_reason(mcipDir, WRFfiles + [geoFile], scriptLines)
+        if reason is None:
+            print("\t\tMCIP output is up to date, skipping")
+            return
+        print("\t\tRun MCIP, as the " + reason)
+    remove_manifest(mcipDir)
+    os.makedirs(workDir, exist_ok=True)
+    ##
+    ## only files that need fixing are staged as writable (so
+    ## that the fixes are never made to the WRF output itself)
+    wrfstrttime = date.strftime("%Y-%m-%d_%H:%M:%S")
+    patches = []
+    for src in WRFfiles:
+        if not os.path.exists(src):
+            raise AssertionError(f"WRF output {src} not found")
+        with netcdfLock:
+            patches.append(
+                wrf_patches_needed(
+                    src,
+                    simulation_start_date=(
+                        wrfstrttime if fix_simulation_start_date else None
+                    ),
+                    truelat2=truelat2 if fix_truelat2 else None,
+                    add_qsnow=add_qsnow,
+                )
+            )
+    methods = collections.Counter(
+        stage_file(src, dst, mode=staging, writable=len(patch) > 0)
+        for src, dst, patch in zip(WRFfiles, outPaths, patches)
+    )
+    print(
+        "\t\tStaged WRF files: "
+        + ", ".join("{} x {}".format(n, m) for m, n in sorted(methods.items()))
+    )
+
+    ## the fixes are made in place, so a reflinked file only
+    ## gets private copies of the blocks that change
+    with netcdfLock:
+        nfixed = prepare_wrf_files(
+            outPaths,
+            patches,
+            simulation_start_date=wrfstrttime,
+            truelat2=truelat2,
+            max_workers=prepare_workers,
+        )
+    print("\t\tApplied fixes to {} WRF files".format(nfixed))
+
+    ##
+    print("\t\tCreate temporary run.mcip script")
+    ## pdb.set_trace()
+    ##
+    tmpRunMcipPath = "{}/run.mcip.{}.csh".format(mcipDir, dom)
+    replace_and_write(
+        lines=scriptLines,
+        outfile=tmpRunMcipPath,
+        substitutions=[],
+        makeExecutable=True,
+    )
+    ##
+    ## print '4. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
+    command = tmpRunMcipPath
+    commandList = command.split(" ")
+    print("\t\t\t" + command)
+    ## delete any existing files
+    for metfile in glob.glob("{}/MET*".format(mcipDir)):
+        print("rm", metfile)
+        os.remove(metfile)
+
+    for gridfile in glob.glob("{}/GRID*".format(mcipDir)):
+        print("rm", gridfile)
+        os.remove(gridfile)
+
+    ## print '5. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
+    ##
+    logPath = "{}/run.mcip.{}.log".format(mcipDir, dom)
+    errPath = "{}/run.mcip.{}.err".format(mcipDir, dom)
+    print("\t\tRun temporary run.mcip script, writing its output to", logPath)
+    with open(logPath, "wb") as log, open(errPath, "wb") as err:
+        p = subprocess.Popen(commandList, stdout=log, stderr=err, cwd=workDir)
+        p.wait()
+    if not mcip_terminated_normally(logPath):
+        with open(errPath) as err:
+            print("stderr = " + err.read())
+        raise RuntimeError("Error from run.mcip, see {} ...".format(logPath))
+    shutil.rmtree(workDir)
+    ##
+
+    for outPath in outPaths:
+        os.unlink(outPath)
+    if compressWithNco:
+        outFiles = sorted(
+            glob.glob("{}/MET*_*".format(mcipDir))
+            + glob.glob("{}/GRID*_*".format(mcipDir))
+        )
+        print("\t\tCompress {} MCIP output files".format(len(outFiles)))
+        if compress_executor is None:
+            with netcdfLock:
+                compress_nc_files(outFiles, max_workers=compress_workers)
+        else:
+            ## the files are compressed in worker processes, so the other
+            ## jobs can carry on meanwhile. The lock is only held while
+            ## submitting, so that no thread is using netCDF if the
+            ## workers are forked
+            with netcdfLock:
+                futures = [
+                    compress_executor.submit(compress_nc_file, outFile)
+                    for outFile in outFiles
+                ]
+            for future in futures:
+                future.result()
+
+    write_manifest(mcipDir, WRFfiles + [geoFile], scriptLines, with_hash=manifest_hash)
+
+    if doArchiveWrf and (wrfRunName is not None) and False:
+        print("\t\tChecking MCIP output in folder {}".format(mcipDir))
+        ## double check that all the files MCIP files are present before archiving the WRF files
+        filetypes = [
+            "GRIDBDY2D",
+            "GRIDCRO2D",
+            "GRIDDOT2D",
+            "METBDY3D",
+            "METCRO2D",
+            "METCRO3D",
+            "METDOT3D",
+        ]
+        for filetype in filetypes:
+            matches = glob.glob("{}/{}_*".format(mcipDir, filetype))
+            if len(matches) != 1:
+                raise RuntimeError(
+                    "{} file not found in folder {} ... ".format(filetype, mcipDir)
+                )
+        ##
+        thisWRFdir = "{}/{}".format(wrfDir, yyyymmddhh)
+        os.chdir(thisWRFdir)
+        ##
+        wrfouts = glob.glob("WRFOUT_{}_*".format(dom))
+        ##
+        command = "tar -cvf {} {}".format(tmpfl, " ".join(wrfouts))
+        print("\t\t\t" + command)
+        commandList = command.split(" ")
+        p = subprocess.Popen(
+            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = p.communicate()
+        if len(stderr) > 0:
+            print("stdout = " + stdout)
+            print("stderr = " + stderr)
+            raise RuntimeError("Error from tar...")
+        ##
+        command = "mdss mkdir ns0890/data/WRF/{}/".format(wrfRunName)
+        print("\t\t\t" + command)
+        commandList = command.split(" ")
+        p = subprocess.Popen(
+            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = p.communicate()
+        if len(stderr) > 0:
+            print("stdout = " + stdout)
+            print("stderr = " + stderr)
+            raise RuntimeError("Error from mdss...")
+        ##
+        command = "mdss put {} ns0890/data/WRF/{}/WRFOUT_{}_{}.tar".format(
+            tmpfl, wrfRunName, yyyymmddhh, dom
+        )
+        print("\t\t\t" + command)
+        commandList = command.split(" ")
+        p = subprocess.Popen(
+            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = p.communicate()
+        if len(stderr) > 0:
+            print("stdout = " + stdout)
+            print("stderr = " + stderr)
+            raise RuntimeError("Error from mdss...")
+        ##
+        command = "rm -f {}".format(tmpfl)
+        print("\t\t\t" + command)
+        commandList = command.split(" ")
+        p = subprocess.Popen(
+            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = p.communicate()
+        if len(stderr) > 0:
+            print("stdout = " + stdout)
+            print("stderr = " + stderr)
+            raise RuntimeError("Error from rm...")
+        ##
+        command = "rm {}".format(" ".join(wrfouts))
+        print("\t\t\t" + command)
+        commandList = command.split(" ")
+        p = subprocess.Popen(
+            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = p.communicate()
+        if len(stderr) > 0:
+            print("stdout = " + stdout)
+            print("stderr = " + stderr)
+            raise RuntimeError("Error from rm...")
+        ##
+        os.chdir(cwd)
+
+
 def runMCIP(
     dates,
     domains,
@@ -57,9 +514,18 @@ def runMCIP(
     wrfRunName=None,
     doArchiveWrf=False,
     add_qsnow=False,
+    staging="link",
+    prepare_workers=1,
+    compress_workers=1,
+    forceUpdate=True,
+    manifest_hash=False,
+    max_workers=1,
 ):
     """Function to run MCIP from python
 
+    Each date and domain is an independent MCIP job (see run_mcip_job).
+    MCIP is single-threaded, so up to max_workers jobs are run at once.
+
     Args:
         dates: array of dates to process
         domains: list of which domains should be run?
@@ -71,8 +537,14 @@ def runMCIP(
         CoordName: Map projection name (for MCIP). 16-character maximum. list: one per domain
         GridName: Grid name (for MCIP). 16-character maximum. list: one per domain
         scripts: dictionary of scripts, including an entry with the key 'mcipRun'
-        compressWithNco: True/False - compress output using ncks?
+        compressWithNco: True/False - compress the output to netCDF4 (see setup_runs.compression)?
         fix_simulation_start_date: True/False - adjust the SIMULATION_START_DATE attribute in wrfout files?
+        staging: how to stage the WRFOUT files in the MCIP directory, either 'link' (hardlinks, reflinks or symbolic links where possible, see setup_runs.utils.stage_file) or 'copy'
+        prepare_workers: number of worker processes used to apply the fixes to the WRFOUT files (see prepare_wrf_files)
+        compress_workers: number of worker processes used to compress the MCIP output of each job, when the jobs are run one at a time (otherwise the output of every job is compressed in a shared pool of max_workers processes)
+        forceUpdate: True/False - run MCIP even if the output is up to date? If False, MCIP is only run for the dates and domains whose inputs have changed or whose output is incomplete (see setup_runs.cmaq.mcip_manifest)
+        manifest_hash: True/False - record (and compare) SHA-256 hashes of the input and output files, rather than only their sizes and modification times?
+        max_workers: number of MCIP jobs to run at once (defaults to 1, i.e. one at a time)
 
     Returns:
         Nothing
@@ -81,12 +553,6 @@ def runMCIP(
 
     #########
 
-    tmpfl = tempfile.mktemp(suffix=".tar")
-    cwd = os.getcwd()
-
-    ndoms = len(domains)
-    nMinsPerInterval = [60] * ndoms
-
     if not os.path.exists(metDir):
         os.mkdir(metDir)
     ##
@@ -103,280 +569,50 @@ def runMCIP(
             if not os.path.exists(mcipDir):
                 os.mkdir(mcipDir)
 
-    for idate, date in enumerate(dates):
-        print("date =", date)
-        yyyymmddhh = date.strftime("%Y%m%d%H")
-        yyyymmdd_dashed = date.strftime("%Y-%m-%d")
-        for idom, dom in enumerate(domains):
-            print("\tdom =", dom)
-            ##
-            mcipDir = "{}/{}/{}".format(metDir, yyyymmdd_dashed, dom)
-            ##
-            times = [date + datetime.timedelta(hours=h) for h in range(25)]
-            WRFfiles = [
-                os.path.join(wrfDir, yyyymmddhh, to_wrf_filename(dom, time))
-                for time in times
-            ]
-            outPaths = [
-                "{}/{}".format(mcipDir, os.path.basename(WRFfile))
-                for WRFfile in WRFfiles
-            ]
-            for src, dst in zip(WRFfiles, outPaths):
-                if not os.path.exists(src):
-                    raise AssertionError(f"WRF output {src} not found")
-                copyfile(src, dst)
-                ## print 1. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
-
-            if fix_simulation_start_date:
-                print("\t\tFix up SIMULATION_START_DATE attribute with ncatted")
-                wrfstrttime = date.strftime("%Y-%m-%d_%H:%M:%S")
-                for outPath in outPaths:
-                    command = "ncatted -O -a SIMULATION_START_DATE,global,m,c,{} {} {}".format(
-                        wrfstrttime, outPath, outPath
-                    )
-                    print("\t\t\t" + command)
-                    commandList = command.split(" ")
-                    ##
-                    p = subprocess.Popen(
-                        commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                    )
-                    stdout, stderr = p.communicate()
-                    if len(stderr) > 0:
-                        print("stdout = " + str(stdout))
-                        print("stderr = " + str(stderr))
-                        raise RuntimeError("Error from atted...")
-
-            if add_qsnow:
-                print("\t\tAdd an artificial variable ('QSNOW') to the WRFOUT files")
-                wrfstrttime = date.strftime("%Y-%m-%d_%H:%M:%S")
-                for outPath in outPaths:
-                    nc = netCDF4.Dataset(outPath, "a")
-                    nc.createVariable(
-                        "QSNOW",
-                        "f4",
-                        ("Time", "bottom_top", "south_north", "west_east"),
-                        zlib=True,
-                    )
-                    nc.variables["QSNOW"][:] = 0.0
-                    nc.close()
-
-            if fix_truelat2 and (truelat2 is not None):
-                print("\t\tFix up TRUELAT2 attribute with ncatted")
-                for outPath in outPaths:
-                    command = "ncatted -O -a TRUELAT2,global,m,f,{} {} {}".format(
-                        truelat2, outPath, outPath
-                    )
-                    print("\t\t\t" + command)
-                    commandList = command.split(" ")
-                    ##
-                    p = subprocess.Popen(
-                        commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                    )
-                    stdout, stderr = p.communicate()
-                    if len(stderr) > 0:
-                        print("stdout = " + stdout)
-                        print("stderr = " + stderr)
-                        raise RuntimeError("Error from atted...")
-                    ## print '3. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
-
-            ##
-            print("\t\tCreate temporary run.mcip script")
-            ## pdb.set_trace()
-            # {}/{}'.format(wrfDir,date.strftime('%Y%m%d%H'))---by Sougol
-            subs = [
-                ["set DataPath   = TEMPLATE", "set DataPath   = {}".format(mcipDir)],
-                ["set InMetDir   = TEMPLATE", "set InMetDir   = {}".format(mcipDir)],
-                ["set OutDir     = TEMPLATE", "set OutDir     = {}".format(mcipDir)],
-                [
-                    "set InMetFiles = ( TEMPLATE )",
-                    "set InMetFiles = ( {} )".format(" ".join(outPaths)),
-                ],
-                [
-                    "set InTerFile  = TEMPLATE",
-                    "set InTerFile  = {}/geo_em.{}.nc".format(geoDir, dom),
-                ],
-                [
-                    "set MCIP_START = TEMPLATE",
-                    "set MCIP_START = {}:00:00.0000".format(
-                        date.strftime("%Y-%m-%d-%H")
-                    ),
-                ],
-                [
-                    "set MCIP_END   = TEMPLATE",
-                    "set MCIP_END   = {}:00:00.0000".format(
-                        times[-1].strftime("%Y-%m-%d-%H")
-                    ),
-                ],
-                [
-                    "set INTVL      = TEMPLATE",
-                    "set INTVL      = {}".format(int(round(nMinsPerInterval[idom]))),
-                ],
-                ["set APPL       = TEMPLATE", "set APPL       = {}".format(APPL[idom])],
-                [
-                    "set CoordName  = TEMPLATE",
-                    "set CoordName  = {}".format(CoordName[idom]),
-                ],
-                [
-                    "set GridName   = TEMPLATE",
-                    "set GridName   = {}".format(GridName[idom]),
-                ],
-                ["set ProgDir    = TEMPLATE", "set ProgDir    = {}".format(ProgDir)],
-            ]
-            ##
-            tmpRunMcipPath = "{}/run.mcip.{}.csh".format(mcipDir, dom)
-            replace_and_write(
-                lines=scripts["mcipRun"]["lines"],
-                outfile=tmpRunMcipPath,
-                substitutions=subs,
-                strict=False,
-                makeExecutable=True,
-            )
-            ##
-            ## print '4. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
-            command = tmpRunMcipPath
-            commandList = command.split(" ")
-            print("\t\t\t" + command)
-            ## delete any existing files
-            for metfile in glob.glob("{}/MET*".format(mcipDir)):
-                print("rm", metfile)
-                os.remove(metfile)
-
-            for gridfile in glob.glob("{}/GRID*".format(mcipDir)):
-                print("rm", gridfile)
-                os.remove(gridfile)
-
-            ## print '5. # WRF files =',len([f for f in os.listdir(mcipDir) if f.startswith('wrfout_')])
-            ##
-            print("\t\tRun temporary run.mcip script")
-            p = subprocess.Popen(
-                commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            stdout, stderr = p.communicate()
-            if stdout.split(b"\n")[-2] != b"NORMAL TERMINATION":
-                print("stdout = " + str(stdout.decode()))
-                print("stderr = " + str(stderr.decode()))
-                raise RuntimeError("Error from run.mcip ...")
-            ##
-
-            for outPath in outPaths:
-                os.unlink(outPath)
-            if compressWithNco:
-                for metfile in glob.glob("{}/MET*_*".format(mcipDir)):
-                    print("\t\tCompress {} with ncks".format(metfile))
-                    command = "ncks -4 -L4 -O {} {}".format(metfile, metfile)
-                    print("\t\t\t" + command)
-                    commandList = command.split(" ")
-                    ##
-                    p = subprocess.Popen(
-                        commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                    )
-                    stdout, stderr = p.communicate()
-                    if len(stderr) > 0:
-                        print("stdout = " + str(stdout))
-                        print("stderr = " + str(stderr))
-                        raise RuntimeError("Error from ncks...")
-
-                for gridfile in glob.glob("{}/GRID*_*".format(mcipDir)):
-                    print("\t\tCompress {} with ncks".format(gridfile))
-                    command = "ncks -4 -L4 -O {} {}".format(gridfile, gridfile)
-                    print("\t\t\t" + command)
-                    commandList = command.split(" ")
-                    ##
-                    p = subprocess.Popen(
-                        commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                    )
-                    stdout, stderr = p.communicate()
-                    if len(stderr) > 0:
-                        print("stdout = " + str(stdout))
-                        print("stderr = " + str(stderr))
-                        raise RuntimeError("Error from ncks...")
-
-            if doArchiveWrf and (wrfRunName is not None) and False:
-                print("\t\tChecking MCIP output in folder {}".format(mcipDir))
-                ## double check that all the files MCIP files are present before archiving the WRF files
-                filetypes = [
-                    "GRIDBDY2D",
-                    "GRIDCRO2D",
-                    "GRIDDOT2D",
-                    "METBDY3D",
-                    "METCRO2D",
-                    "METCRO3D",
-                    "METDOT3D",
-                ]
-                for filetype in filetypes:
-                    matches = glob.glob("{}/{}_*".format(mcipDir, filetype))
-                    if len(matches) != 1:
-                        raise RuntimeError(
-                            "{} file not found in folder {} ... ".format(
-                                filetype, mcipDir
-                            )
-                        )
-                ##
-                thisWRFdir = "{}/{}".format(wrfDir, yyyymmddhh)
-                os.chdir(thisWRFdir)
-                ##
-                wrfouts = glob.glob("WRFOUT_{}_*".format(dom))
-                ##
-                command = "tar -cvf {} {}".format(tmpfl, " ".join(wrfouts))
-                print("\t\t\t" + command)
-                commandList = command.split(" ")
-                p = subprocess.Popen(
-                    commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                stdout, stderr = p.communicate()
-                if len(stderr) > 0:
-                    print("stdout = " + stdout)
-                    print("stderr = " + stderr)
-                    raise RuntimeError("Error from tar...")
-                ##
-                command = "mdss mkdir ns0890/data/WRF/{}/".format(wrfRunName)
-                print("\t\t\t" + command)
-                commandList = command.split(" ")
-                p = subprocess.Popen(
-                    commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                stdout, stderr = p.communicate()
-                if len(stderr) > 0:
-                    print("stdout = " + stdout)
-                    print("stderr = " + stderr)
-                    raise RuntimeError("Error from mdss...")
-                ##
-                command = "mdss put {} ns0890/data/WRF/{}/WRFOUT_{}_{}.tar".format(
-                    tmpfl, wrfRunName, yyyymmddhh, dom
-                )
-                print("\t\t\t" + command)
-                commandList = command.split(" ")
-                p = subprocess.Popen(
-                    commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                stdout, stderr = p.communicate()
-                if len(stderr) > 0:
-                    print("stdout = " + stdout)
-                    print("stderr = " + stderr)
-                    raise RuntimeError("Error from mdss...")
-                ##
-                command = "rm -f {}".format(tmpfl)
-                print("\t\t\t" + command)
-                commandList = command.split(" ")
-                p = subprocess.Popen(
-                    commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                stdout, stderr = p.communicate()
-                if len(stderr) > 0:
-                    print("stdout = " + stdout)
-                    print("stderr = " + stderr)
-                    raise RuntimeError("Error from rm...")
-                ##
-                command = "rm {}".format(" ".join(wrfouts))
-                print("\t\t\t" + command)
-                commandList = command.split(" ")
-                p = subprocess.Popen(
-                    commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                stdout, stderr = p.communicate()
-                if len(stderr) > 0:
-                    print("stdout = " + stdout)
-                    print("stderr = " + stderr)
-                    raise RuntimeError("Error from rm...")
-                ##
-                os.chdir(cwd)
+    runJob = functools.partial(
+        run_mcip_job,
+        metDir=metDir,
+        wrfDir=wrfDir,
+        geoDir=geoDir,
+        ProgDir=ProgDir,
+        APPL=APPL,
+        CoordName=CoordName,
+        GridName=GridName,
+        scripts=scripts,
+        compressWithNco=compressWithNco,
+        fix_simulation_start_date=fix_simulation_start_date,
+        fix_truelat2=fix_truelat2,
+        truelat2=truelat2,
+        wrfRunName=wrfRunName,
+        doArchiveWrf=doArchiveWrf,
+        add_qsnow=add_qsnow,
+        staging=staging,
+        prepare_workers=prepare_workers,
+        compress_workers=compress_workers,
+        forceUpdate=forceUpdate,
+        manifest_hash=manifest_hash,
+    )
+    jobs = [(date, idom, dom) for date in dates for idom, dom in enumerate(domains)]
+    if max_workers == 1:
+        for job in jobs:
+            runJob(*job)
+    else:
+        ## the jobs are run as subprocesses, so threads are enough to
+        ## keep max_workers of them going, while the output is compressed
+        ## in a pool of worker processes shared by the jobs (netCDF is
+        ## not thread-safe, so the threads would take turns otherwise)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers
+        ) as executor, concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers
+        ) as compressExecutor:
+            runJob = functools.partial(runJob, compress_executor=compressExecutor)
+            futures = [executor.submit(runJob, *job) for job in jobs]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    future.result()
+            except BaseException:
+                ## don't start any more jobs if one of them fails
+                for future in futures:
+                    future.cancel()
+                raise
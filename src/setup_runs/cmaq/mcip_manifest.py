@@ -0,0 +1,164 @@
+"""Record the inputs and outputs of each MCIP run, so that only out-of-date runs are repeated
+
+Each MCIP directory (one per date and domain) holds a manifest
+(mcip_manifest.json) recording the size and modification time (and
+optionally a SHA-256 hash) of the WRFOUT and geo_em files the run used,
+a hash of the rendered run.mcip script, and the same details for the
+files MCIP produced. MCIP only needs to be run again if an input or the
+script has changed, or if the outputs are incomplete or have changed.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+manifestName = "mcip_manifest.json"
+
+## the files that MCIP produces
+mcipOutputTypes = [
+    "GRIDBDY2D",
+    "GRIDCRO2D",
+    "GRIDDOT2D",
+    "METBDY3D",
+    "METCRO2D",
+    "METCRO3D",
+    "METDOT3D",
+]
+
+
+def sha256_file(path, blocksize=2**20):
+    """Calculate the SHA-256 hash of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_record(path, with_hash=False):
+    """Describe a file by its size and modification time (and optionally its hash)
+
+    Args:
+        path: Path to the file
+        with_hash: True/False - include a SHA-256 hash of the contents?
+
+    Returns:
+        record: dictionary with the keys 'size', 'mtime' and (if with_hash) 'sha256'
+    """
+    stat = os.stat(path)
+    record = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if with_hash:
+        record["sha256"] = sha256_file(path)
+    return record
+
+
+def file_changed(path, record):
+    """Check whether a file differs from a record made by file_record
+
+    If the record has a hash, the hash decides (so a file that has been
+    touched but not changed is not counted as changed). Otherwise the
+    size and modification time are compared.
+    """
+    if not os.path.exists(path):
+        return True
+    stat = os.stat(path)
+    if stat.st_size != record["size"]:
+        return True
+    if stat.st_mtime_ns == record["mtime"]:
+        return False
+    if "sha256" in record:
+        return sha256_file(path) != record["sha256"]
+    return True
+
+
+def script_hash(lines):
+    """Calculate the SHA-256 hash of a rendered script (a list of lines)"""
+    return hashlib.sha256("".join(lines).encode()).hexdigest()
+
+
+def mcip_outputs(mcipDir):
+    """List the MCIP output files (including GRIDDESC) in a directory"""
+    outputs = glob.glob("{}/GRIDDESC".format(mcipDir))
+    for filetype in mcipOutputTypes:
+        outputs += glob.glob("{}/{}_*".format(mcipDir, filetype))
+    return sorted(outputs)
+
+
+def write_manifest(mcipDir, inputs, scriptLines, with_hash=False):
+    """Record the inputs and outputs of a successful MCIP run
+
+    Args:
+        mcipDir: the MCIP directory for one date and domain
+        inputs: list of paths to the input files (WRFOUT and geo_em files)
+        scriptLines: the rendered run.mcip script, as a list of lines
+        with_hash: True/False - record SHA-256 hashes of the files?
+
+    Returns:
+        Nothing
+    """
+    manifest = {
+        "inputs": {path: file_record(path, with_hash) for path in inputs},
+        "script": script_hash(scriptLines),
+        "outputs": {
+            os.path.basename(path): file_record(path, with_hash)
+            for path in mcip_outputs(mcipDir)
+        },
+    }
+    tmpPath = "{}/{}.tmp".format(mcipDir, manifestName)
+    with open(tmpPath, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmpPath, "{}/{}".format(mcipDir, manifestName))
+
+
+def remove_manifest(mcipDir):
+    """Remove the manifest of an MCIP directory (before MCIP is run again)"""
+    path = "{}/{}".format(mcipDir, manifestName)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def read_manifest(mcipDir):
+    """Read the manifest of an MCIP directory (or None if there isn't one)"""
+    path = "{}/{}".format(mcipDir, manifestName)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def mcip_update_reason(mcipDir, inputs, scriptLines):
+    """Find why (if at all) MCIP needs to be run again for one date and domain
+
+    Output from before manifests were written (i.e. a complete set of
+    MCIP files without a manifest) is taken to be up to date. Inputs
+    that no longer exist (e.g. WRFOUT files that have been archived) are
+    not counted as changed.
+
+    Args:
+        mcipDir: the MCIP directory for one date and domain
+        inputs: list of paths to the input files (WRFOUT and geo_em files)
+        scriptLines: the rendered run.mcip script, as a list of lines
+
+    Returns:
+        reason: description of why MCIP needs to be run, or None if the output is up to date
+    """
+    outputs = mcip_outputs(mcipDir)
+    outputTypes = {os.path.basename(path).split("_")[0] for path in outputs}
+    missing = [t for t in ["GRIDDESC"] + mcipOutputTypes if t not in outputTypes]
+    if missing:
+        return "MCIP output is incomplete (missing {})".format(", ".join(missing))
+    manifest = read_manifest(mcipDir)
+    if manifest is None:
+        return None
+    if manifest["script"] != script_hash(scriptLines):
+        return "run.mcip script has changed"
+    if sorted(manifest["inputs"]) != sorted(inputs):
+        return "set of input files has changed"
+    for path, record in manifest["inputs"].items():
+        if os.path.exists(path) and file_changed(path, record):
+            return "input {} has changed".format(path)
+    for name, record in manifest["outputs"].items():
+        if file_changed("{}/{}".format(mcipDir, name), record):
+            return "output {} has changed".format(name)
+    return None
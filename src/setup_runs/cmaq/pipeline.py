@@ -0,0 +1,291 @@
+"""Run the CMAQ preprocessing (MCIP, then the initial and boundary conditions) for a set of dates
+
+The preprocessing is either run in one go, once the WRF output for every
+date is in place (see run_mcip, prepare_ic_bc_templates and make_ic_bc),
+or streamed: coordinate_cmaq_preprocessing watches the WRF staging area
+(see setup_runs.wrf.publish) and starts each step as soon as its inputs
+are ready, so that the preprocessing of the early dates overlaps with
+the WRF run for the later ones:
+
+- MCIP for a date and domain starts once its 25 hourly WRFOUT files are staged
+- the template IC/BC files are made once MCIP has finished for every domain of the first date
+- the ICs/BCs for a date are made once MCIP has finished for every domain of that date
+"""
+
+import concurrent.futures
+import os
+import time
+
+from attrs import define
+
+from setup_runs.cmaq.cams import interpolateFromCAMSToCmaqGrid
+from setup_runs.cmaq.mcip import mcip_wrf_files, runMCIP
+from setup_runs.cmaq.mcip_preparation import getMcipGridNames
+from setup_runs.cmaq.read_config_cmaq import CMAQConfig
+from setup_runs.cmaq.run_scripts import (
+    prepareTemplateBconFiles,
+    prepareTemplateIconFiles,
+)
+
+
+@define
+class ICBCTemplates:
+    """The template IC/BC files, and the MCIP grid details needed to fill them
+
+    Attributes:
+        templateIconFiles: list of the template ICON files (one per domain)
+        templateBconFiles: list of the template BCON files (one per domain)
+        GridNames: list of MCIP grid names (one per domain)
+        APPL: list of MCIP output suffixes (one per domain)
+    """
+
+    templateIconFiles: list[str]
+    templateBconFiles: list[str]
+    GridNames: list[str]
+    APPL: list[str]
+
+
+def run_mcip(setup_cmaq: CMAQConfig, scripts, dates, domains=None, max_workers=1):
+    """Run MCIP for a set of dates and domains with the settings in the configuration
+
+    Args:
+        setup_cmaq: the CMAQ configuration
+        scripts: dictionary of scripts, including an entry with the key 'mcipRun'
+        dates: list of dates to process
+        domains: list of the domains to process (defaults to every domain in the configuration)
+        max_workers: number of MCIP jobs to run at once
+
+    Returns:
+        Nothing
+    """
+    if domains is None:
+        domains = setup_cmaq.domains
+    ## the MCIP names are given per domain, so pick out those of the domains to run
+    idoms = [setup_cmaq.domains.index(dom) for dom in domains]
+    runMCIP(
+        dates=dates,
+        domains=domains,
+        metDir=setup_cmaq.metDir,
+        wrfDir=setup_cmaq.wrfDir,
+        geoDir=setup_cmaq.geoDir,
+        ProgDir=setup_cmaq.MCIPdir,
+        APPL=[setup_cmaq.scenarioTag[idom] for idom in idoms],
+        CoordName=[setup_cmaq.mapProjName[idom] for idom in idoms],
+        GridName=[setup_cmaq.gridName[idom] for idom in idoms],
+        scripts=scripts,
+        compressWithNco=True,
+        fix_simulation_start_date=True,
+        fix_truelat2=False,
+        truelat2=None,
+        wrfRunName=None,
+        doArchiveWrf=False,
+        add_qsnow=setup_cmaq.add_qsnow,
+        staging=setup_cmaq.wrfStaging,
+        forceUpdate=setup_cmaq.forceUpdateMcip,
+        manifest_hash=setup_cmaq.MCIPManifestHash,
+        max_workers=max_workers,
+    )
+
+
+def prepare_ic_bc_templates(setup_cmaq: CMAQConfig, scripts, date) -> ICBCTemplates:
+    """Make the template IC/BC files from profiles (using ICON and BCON)
+
+    Args:
+        setup_cmaq: the CMAQ configuration
+        scripts: dictionary of scripts, including entries with the keys 'bconRun' and 'iconRun'
+        date: the date whose MCIP output the templates are made from (usually the first date)
+
+    Returns:
+        templates: the template files, and the MCIP grid details needed to fill them
+    """
+    _, GridNames, APPL = getMcipGridNames(setup_cmaq.metDir, [date], setup_cmaq.domains)
+    kwargs = dict(
+        date=date,
+        domains=setup_cmaq.domains,
+        ctmDir=setup_cmaq.ctmDir,
+        metDir=setup_cmaq.metDir,
+        CMAQdir=setup_cmaq.CMAQdir,
+        CFG=setup_cmaq.run,
+        mech=setup_cmaq.mechCMAQ,
+        GridNames=GridNames,
+        mcipsuffix=APPL,
+        scripts=scripts,
+        forceUpdate=setup_cmaq.forceUpdateICandBC,
+    )
+    templateBconFiles = prepareTemplateBconFiles(**kwargs)
+    templateIconFiles = prepareTemplateIconFiles(**kwargs)
+    return ICBCTemplates(
+        templateIconFiles=templateIconFiles,
+        templateBconFiles=templateBconFiles,
+        GridNames=GridNames,
+        APPL=APPL,
+    )
+
+
+def make_ic_bc(
+    setup_cmaq: CMAQConfig,
+    dates,
+    templates: ICBCTemplates,
+    initialDate=None,
+    max_workers=1,
+):
+    """Fill the template IC/BC files with CAMS values for a set of dates
+
+    Args:
+        setup_cmaq: the CMAQ configuration
+        dates: list of dates to process
+        templates: the template files (see prepare_ic_bc_templates)
+        initialDate: the first date of the simulation, the only one that ICs are made for (defaults to dates[0])
+        max_workers: number of worker processes to spread the dates and domains over
+
+    Returns:
+        Nothing
+    """
+    interpolateFromCAMSToCmaqGrid(
+        dates,
+        setup_cmaq.domains,
+        setup_cmaq.mech,
+        setup_cmaq.inputCAMSFile,
+        templates.templateIconFiles,
+        templates.templateBconFiles,
+        setup_cmaq.metDir,
+        setup_cmaq.ctmDir,
+        templates.GridNames,
+        mcipsuffix=templates.APPL,
+        forceUpdate=setup_cmaq.forceUpdateICandBC,
+        bias_correct=setup_cmaq.CAMSToCmaqBiasCorrect,
+        interpolation=setup_cmaq.CAMSInterpolation,
+        timeResolvedBCs=setup_cmaq.timeResolvedBCs,
+        species_map=setup_cmaq.CAMSSpeciesMap,
+        max_workers=max_workers,
+        initialDate=initialDate,
+    )
+
+
+def count_staged_files(wrfDir, date, dom) -> int:
+    """Count how many of the WRFOUT files that MCIP needs for a date and domain are in place
+
+    Args:
+        wrfDir: directory containing the (staged) WRF output, in a subdirectory per date
+        date: date to check
+        dom: name of the domain (e.g. 'd01')
+
+    Returns:
+        nstaged: number of the files present (25 when MCIP can run)
+    """
+    return sum(os.path.exists(path) for path in mcip_wrf_files(wrfDir, date, dom))
+
+
+def coordinate_cmaq_preprocessing(
+    setup_cmaq: CMAQConfig, dates, scripts, max_workers=None
+):
+    """Run MCIP and then the ICs/BCs for each date as soon as the WRF output it needs is staged
+
+    Every step is run in a pool of worker processes (each MCIP job, the
+    template IC/BC files and the ICs/BCs for each date), and the WRF
+    staging area (setup_cmaq.wrfDir) is checked for newly published
+    files every setup_cmaq.streamPollSeconds. If any step fails, no more
+    steps are started and the error is raised.
+
+    Args:
+        setup_cmaq: the CMAQ configuration
+        dates: list of dates to process
+        scripts: dictionary of scripts (see setup_runs.utils.loadScripts)
+        max_workers: number of steps to run at once (defaults to setup_cmaq.MCIPMaxWorkers)
+
+    Returns:
+        Nothing
+    """
+    if max_workers is None:
+        max_workers = setup_cmaq.MCIPMaxWorkers
+    domains = setup_cmaq.domains
+    pendingMcip = [(date, dom) for date in dates for dom in domains]
+    mcipDone = set()
+    pendingICandBC = list(dates) if setup_cmaq.prepareICandBC else []
+    templates = None
+    templatesSubmitted = False
+    nstaged = -1
+    lastProgress = time.monotonic()
+    idleTimeout = setup_cmaq.streamIdleTimeoutHours * 3600.0
+    ##
+    futures = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while pendingMcip or pendingICandBC or futures:
+                ## start the MCIP jobs whose WRF output has all been staged
+                counts = {
+                    job: count_staged_files(setup_cmaq.wrfDir, *job)
+                    for job in pendingMcip
+                }
+                if sum(counts.values()) != nstaged:
+                    nstaged = sum(counts.values())
+                    lastProgress = time.monotonic()
+                for date, dom in [job for job, n in counts.items() if n == 25]:
+                    print("Starting MCIP for {} {}".format(date, dom))
+                    future = executor.submit(
+                        run_mcip, setup_cmaq, scripts, [date], [dom]
+                    )
+                    futures[future] = ("mcip", (date, dom))
+                    pendingMcip.remove((date, dom))
+                ## the templates need the MCIP output of the first date
+                if (
+                    pendingICandBC
+                    and not templatesSubmitted
+                    and all((dates[0], dom) in mcipDone for dom in domains)
+                ):
+                    print("Preparing the template IC/BC files")
+                    future = executor.submit(
+                        prepare_ic_bc_templates, setup_cmaq, scripts, dates[0]
+                    )
+                    futures[future] = ("templates", None)
+                    templatesSubmitted = True
+                ## then the ICs/BCs for each date need its own MCIP output
+                if templates is not None:
+                    for date in list(pendingICandBC):
+                        if all((date, dom) in mcipDone for dom in domains):
+                            print("Preparing the ICs/BCs for {}".format(date))
+                            future = executor.submit(
+                                make_ic_bc, setup_cmaq, [date], templates, dates[0]
+                            )
+                            futures[future] = ("icbc", date)
+                            pendingICandBC.remove(date)
+                ##
+                if futures:
+                    done, _ = concurrent.futures.wait(
+                        futures,
+                        timeout=setup_cmaq.streamPollSeconds,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                else:
+                    done = set()
+                    time.sleep(setup_cmaq.streamPollSeconds)
+                for future in done:
+                    kind, key = futures.pop(future)
+                    result = future.result()
+                    lastProgress = time.monotonic()
+                    if kind == "mcip":
+                        mcipDone.add(key)
+                    elif kind == "templates":
+                        templates = result
+                ## only give up while waiting for WRF (i.e. with nothing running)
+                if (
+                    idleTimeout > 0
+                    and not futures
+                    and time.monotonic() - lastProgress > idleTimeout
+                ):
+                    raise RuntimeError(
+                        "No WRF output has been staged in {} for {} hours, "
+                        "still waiting for {}".format(
+                            setup_cmaq.wrfDir,
+                            setup_cmaq.streamIdleTimeoutHours,
+                            ", ".join(
+                                "{} {}".format(date.strftime("%Y-%m-%d"), dom)
+                                for date, dom in pendingMcip
+                            ),
+                        )
+                    )
+        except BaseException:
+            ## don't start any more steps if one of them fails
+            for future in futures:
+                future.cancel()
+            raise
@@ -156,6 +156,105 @@ class CMAQConfig:
     CAMSToCmaqBiasCorrect: float
     """Pre-set is (1.838 - 1.771)"""
     # TODO: Add description for CAMSToCmaqBiasCorrect?
+    CAMSInterpolation: str = field(default="nearest")
+    """horizontal interpolation from the CAMS grid to the CMAQ grid, one of
+    'nearest' (nearest neighbour), 'bilinear' or 'conservative' (area-weighted)"""
+
+    @CAMSInterpolation.validator
+    def check_CAMSInterpolation(self, attribute, value):
+        interpolation_methods = ["nearest", "bilinear", "conservative"]
+        if value not in interpolation_methods:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must be one of {interpolation_methods}"
+            )
+
+    timeResolvedBCs: bool = field(default="False", converter=boolean_converter)
+    """write boundary conditions for every time step of the day (interpolated
+    linearly in time between the CAMS records), rather than a single record"""
+    CAMSSpeciesMap: list[dict[str, str | float]] = field(
+        factory=lambda: [{"MZspec": "ch4_c", "CMspec": "CH4", "coef": 1.0}]
+    )
+    """mapping from CAMS species to CMAQ species. Each entry has the keys
+    'MZspec' (the CAMS variable, e.g. 'ch4_c', 'co' or 'go3'), 'CMspec' (the
+    CMAQ species) and optionally 'coef' (a coefficient to multiply the CAMS
+    values by, defaults to 1). A CAMS species can be mapped to several CMAQ
+    species (e.g. tagged CH4 tracers), and several CAMS species can be summed
+    into one CMAQ species"""
+
+    @CAMSSpeciesMap.validator
+    def check_CAMSSpeciesMap(self, attribute, value):
+        for entry in value:
+            if "MZspec" not in entry or "CMspec" not in entry:
+                raise ValueError(
+                    f"Each entry of {attribute.name} must have the keys 'MZspec' and 'CMspec'"
+                )
+
+    CAMSMaxWorkers: int = field(default=1, converter=int)
+    """number of worker processes used to prepare the initial and boundary
+    conditions (one date and domain per process). 1 means no worker processes"""
+
+    @CAMSMaxWorkers.validator
+    def check_CAMSMaxWorkers(self, attribute, value):
+        if value < 1:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must be at least 1"
+            )
+
+    wrfStaging: str = field(default="link")
+    """how the WRFOUT files are staged in the MCIP directories, either 'link'
+    (hardlinks, reflinks or symbolic links where possible, only copying
+    files when these are not supported) or 'copy'"""
+
+    @wrfStaging.validator
+    def check_wrfStaging(self, attribute, value):
+        staging_modes = ["link", "copy"]
+        if value not in staging_modes:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must be one of {staging_modes}"
+            )
+
+    MCIPMaxWorkers: int = field(default=1, converter=int)
+    """number of MCIP jobs (one per date and domain) to run at once. MCIP is
+    single-threaded, so this can be up to the number of cores"""
+
+    @MCIPMaxWorkers.validator
+    def check_MCIPMaxWorkers(self, attribute, value):
+        if value < 1:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must be at least 1"
+            )
+
+    MCIPManifestHash: bool = field(default="False", converter=boolean_converter)
+    """record SHA-256 hashes of the MCIP inputs and outputs, so that files
+    that have been touched but not changed do not cause MCIP to be re-run
+    (rather than only comparing their sizes and modification times)"""
+
+    streamFromWrf: bool = field(default="False", converter=boolean_converter)
+    """start MCIP (and then the initial and boundary conditions) for each
+    date and domain as soon as its WRFOUT files are published to wrfDir,
+    rather than waiting for the whole WRF run to finish (wrfDir should then
+    be the wrfout_staging_dir of the WRF configuration)"""
+    streamPollSeconds: float = field(default=10.0, converter=float)
+    """number of seconds between checks for newly published WRFOUT files
+    when streamFromWrf is set"""
+
+    @streamPollSeconds.validator
+    def check_streamPollSeconds(self, attribute, value):
+        if value <= 0:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must be positive"
+            )
+
+    streamIdleTimeoutHours: float = field(default=0.0, converter=float)
+    """give up waiting for WRFOUT files when streamFromWrf is set, if none
+    has been published for this many hours (0 means wait indefinitely)"""
+
+    @streamIdleTimeoutHours.validator
+    def check_streamIdleTimeoutHours(self, attribute, value):
+        if value < 0:
+            raise ValueError(
+                f"Configuration value for {attribute.name} must not be negative"
+            )
 
 
 def create_cmaq_config_object(config: dict[str, str | int | float]) -> CMAQConfig:
@@ -0,0 +1,156 @@
+"""Compress netCDF files to netCDF4/HDF5 in-process (rather than with ncks or nccopy)"""
+
+import concurrent.futures
+import functools
+import os
+import shutil
+import tempfile
+
+import netCDF4
+import numpy
+
+
+def check_ppc(ppc):
+    """Check a number of significant digits to retain (as for the --ppc option of ncks)
+
+    Args:
+        ppc: number of significant digits (or None to retain all)
+
+    Returns:
+        Nothing (raises RuntimeError if ppc is not valid)
+    """
+    if ppc is None:
+        return
+    if not isinstance(ppc, int):
+        raise RuntimeError("Argument ppc should be an integer...")
+    elif ppc < 1 or ppc > 6:
+        raise RuntimeError("Argument ppc should be between 1 and 6...")
+
+
+def variable_chunksizes(var, chunking=None):
+    """Choose the chunk sizes for a variable
+
+    By default (as for ncks), each chunk holds one record of the
+    unlimited dimension and the full extent of the other dimensions.
+
+    Args:
+        var: netCDF4.Variable to choose the chunk sizes for
+        chunking: dictionary of chunk sizes for named dimensions, overriding the defaults (optional)
+
+    Returns:
+        chunksizes: list of chunk sizes, one per dimension of var
+    """
+    chunking = chunking or {}
+    chunksizes = []
+    for dimName in var.dimensions:
+        dim = var.group().dimensions[dimName]
+        if dimName in chunking:
+            size = chunking[dimName]
+        elif dim.isunlimited():
+            size = 1
+        else:
+            size = len(dim)
+        chunksizes.append(max(1, min(size, max(len(dim), 1))))
+    return chunksizes
+
+
+def compress_nc_file(filename, complevel=4, shuffle=True, ppc=None, chunking=None):
+    """Rewrite a netCDF file as a compressed netCDF4 file, in place
+
+    The compressed copy is written to a temporary file in the same
+    directory, which then replaces the original, so the original is
+    left untouched if anything fails.
+
+    Args:
+        filename: Path to the netCDF file to compress
+        complevel: deflate level (1-9)
+        shuffle: True/False - apply the shuffle filter before deflating?
+        ppc: number of significant digits to retain in floating-point variables (default is to retain all)
+        chunking: dictionary of chunk sizes for named dimensions (see variable_chunksizes)
+
+    Returns:
+        Nothing
+    """
+    check_ppc(ppc)
+    fd, tmpfile = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(filename)),
+        prefix=os.path.basename(filename) + ".",
+        suffix=".tmp",
+    )
+    os.close(fd)
+    try:
+        with netCDF4.Dataset(filename, "r") as src, netCDF4.Dataset(
+            tmpfile, "w", format="NETCDF4"
+        ) as dst:
+            src.set_auto_maskandscale(False)
+            dst.set_auto_maskandscale(False)
+            dst.setncatts({k: src.getncattr(k) for k in src.ncattrs()})
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+            for name, var in src.variables.items():
+                _copy_variable(dst, var, complevel, shuffle, ppc, chunking)
+        shutil.copymode(filename, tmpfile)
+        os.replace(tmpfile, filename)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+def _copy_variable(dst, var, complevel, shuffle, ppc, chunking):
+    attrs = {k: var.getncattr(k) for k in var.ncattrs() if k != "_FillValue"}
+    kwargs = {}
+    if "_FillValue" in var.ncattrs():
+        kwargs["fill_value"] = var.getncattr("_FillValue")
+    ## variable-length types cannot be compressed
+    if var.ndim > 0 and var.dtype is not str:
+        kwargs.update(
+            compression="zlib",
+            complevel=complevel,
+            shuffle=shuffle,
+            chunksizes=variable_chunksizes(var, chunking),
+        )
+        if ppc is not None and numpy.issubdtype(var.dtype, numpy.floating):
+            kwargs["significant_digits"] = ppc
+    out = dst.createVariable(var.name, var.dtype, var.dimensions, **kwargs)
+    out.setncatts(attrs)
+    ## copy record by record, so that only one record is held in memory
+    if var.ndim > 0 and var.group().dimensions[var.dimensions[0]].isunlimited():
+        for irec in range(var.shape[0]):
+            out[irec] = var[irec]
+    else:
+        out[...] = var[...]
+
+
+def compress_nc_files(
+    filenames, complevel=4, shuffle=True, ppc=None, chunking=None, max_workers=1
+):
+    """Compress a set of netCDF files in place, optionally in parallel
+
+    netCDF/HDF5 is not thread-safe, so the files are spread over worker
+    processes rather than threads.
+
+    Args:
+        filenames: list of paths to the netCDF files to compress
+        complevel, shuffle, ppc, chunking: see compress_nc_file
+        max_workers: number of worker processes (1 means the files are compressed in this process)
+
+    Returns:
+        Nothing
+    """
+    check_ppc(ppc)
+    compress = functools.partial(
+        compress_nc_file,
+        complevel=complevel,
+        shuffle=shuffle,
+        ppc=ppc,
+        chunking=chunking,
+    )
+    if max_workers == 1 or len(filenames) <= 1:
+        for filename in filenames:
+            compress(filename)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(max_workers, len(filenames))
+        ) as executor:
+            ## consume the results, so that any errors are raised
+            list(executor.map(compress, filenames))
@@ -0,0 +1,144 @@
+"""A minimal wrapper of the Linux inotify API (via ctypes), for watching directories for new files"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+
+## event masks (from <sys/inotify.h>)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+## flags for inotify_init1 (the same values as O_NONBLOCK and O_CLOEXEC)
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+## struct inotify_event {int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[];}
+_eventHeader = struct.Struct("iIII")
+
+
+def _libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init1"):
+        return None
+    return libc
+
+
+def inotify_available() -> bool:
+    """Check whether inotify can be used on this system"""
+    libc = _libc()
+    if libc is None:
+        return False
+    fd = libc.inotify_init1(IN_CLOEXEC)
+    if fd < 0:
+        return False
+    os.close(fd)
+    return True
+
+
+def parse_events(buffer: bytes) -> list[tuple[int, int, str]]:
+    """Unpack a buffer read from an inotify file descriptor
+
+    Args:
+        buffer: bytes read from the inotify file descriptor
+
+    Returns:
+        events: list of (wd, mask, name) tuples
+    """
+    events = []
+    offset = 0
+    while offset + _eventHeader.size <= len(buffer):
+        wd, mask, _, length = _eventHeader.unpack_from(buffer, offset)
+        offset += _eventHeader.size
+        name = buffer[offset : offset + length].rstrip(b"\0")
+        offset += length
+        events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+
+class Inotify:
+    """Watch a set of directories for events on the files in them
+
+    Example:
+        with Inotify(["."]) as watcher:
+            for path, mask in watcher.read_events(timeout=60.0):
+                ...
+    """
+
+    def __init__(self, directories, mask=IN_CLOSE_WRITE | IN_MOVED_TO):
+        """
+        Args:
+            directories: list of the directories to watch
+            mask: the events to watch for (IN_CLOSE_WRITE and IN_MOVED_TO by default)
+        """
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError("inotify is not available on this system")
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.directories = {}
+        try:
+            for directory in directories:
+                wd = self._libc.inotify_add_watch(
+                    self.fd, os.fsencode(directory), mask | IN_ONLYDIR
+                )
+                if wd < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, os.strerror(errno), directory)
+                self.directories[wd] = directory
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def read_events(self, timeout=None) -> list[tuple[str, int]]:
+        """Wait for events
+
+        Args:
+            timeout: maximum number of seconds to wait (None to wait indefinitely)
+
+        Returns:
+            events: list of (path, mask) tuples, where path is the file
+                in the watched directory (or None for IN_Q_OVERFLOW, when
+                events have been lost); empty if the timeout was reached
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        buffer = b""
+        while True:
+            try:
+                buffer += os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+        events = []
+        for wd, mask, name in parse_events(buffer):
+            if mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif mask & IN_IGNORED or wd not in self.directories:
+                continue
+            else:
+                events.append((os.path.join(self.directories[wd], name), mask))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
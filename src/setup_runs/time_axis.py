@@ -0,0 +1,109 @@
+"""Decode and match the time axes of the MCIP/CMAQ and CAMS files"""
+
+import re
+import warnings
+
+import numpy
+
+cfUnits = {"days": "D", "hours": "h", "minutes": "m", "seconds": "s"}
+
+
+def decode_tflag(TFLAG):
+    """Decode an I/O API TFLAG array into datetimes
+
+    Args:
+        TFLAG: integer array of (YYYYDDD, HHMMSS) pairs, with shape (TSTEP, 2)
+
+    Returns:
+        times: numpy.datetime64 array (with a resolution of seconds) with shape (TSTEP,)
+    """
+    TFLAG = numpy.asarray(TFLAG, dtype=numpy.int64).reshape(-1, 2)
+    yyyy = TFLAG[:, 0] // 1000
+    jjj = TFLAG[:, 0] % 1000
+    hh = TFLAG[:, 1] // 10000
+    mm = (TFLAG[:, 1] // 100) % 100
+    ss = TFLAG[:, 1] % 100
+    years = (yyyy - 1970).astype("datetime64[Y]").astype("datetime64[s]")
+    seconds = (jjj - 1) * 86400 + hh * 3600 + mm * 60 + ss
+    return years + seconds.astype("timedelta64[s]")
+
+
+def decode_cf_time(values, units="hours since 1900-01-01 00:00:00"):
+    """Decode a CF-style time axis (e.g. 'hours since 1900-01-01') into datetimes
+
+    Args:
+        values: array of (whole) numbers of time units since the reference time
+        units: CF units string, of the form '<days|hours|minutes|seconds> since <date> [time]'
+
+    Returns:
+        times: numpy.datetime64 array (with a resolution of seconds)
+    """
+    match = re.match(
+        r"\s*(\w+)\s+since\s+(\S+)(?:\s+(\d{1,2}:\d{2}(?::\d{2})?))?", units
+    )
+    if match is None or match.group(1) not in cfUnits:
+        raise ValueError("Unsupported time units: {}".format(units))
+    step, date, time = match.groups()
+    reference = numpy.datetime64("{}T{}".format(date, time or "00:00:00"), "s")
+    offsets = numpy.asarray(values).astype(numpy.int64)
+    return reference + offsets.astype("timedelta64[{}]".format(cfUnits[step]))
+
+
+def match_times(times, recordTimes):
+    """Find the latest record at or before each time
+
+    Where all of the records are after a time, the nearest record is
+    used instead, and a warning is raised.
+
+    Args:
+        times: numpy.datetime64 array of the times to match
+        recordTimes: numpy.datetime64 array of the times of the records, in ascending order
+
+    Returns:
+        irecord: integer array of indices of the records, one per time
+    """
+    times = numpy.asarray(times, dtype="datetime64[s]")
+    recordTimes = numpy.asarray(recordTimes, dtype="datetime64[s]")
+    irecord = numpy.searchsorted(recordTimes, times, "right") - 1
+    before = irecord < 0
+    if before.any():
+        irecord[before] = numpy.argmin(
+            numpy.abs(recordTimes[numpy.newaxis, :] - times[before, numpy.newaxis]),
+            axis=1,
+        )
+        warnings.warn(
+            "All dates were negative for date {}, using nearest match: {}".format(
+                _format(times[before][0]), _format(recordTimes[irecord[before][0]])
+            )
+        )
+    return irecord
+
+
+def linear_interpolation_weights(times, recordTimes):
+    """Calculate weights to interpolate linearly in time between records
+
+    Times before the first record take the first record (with a
+    warning, see match_times), and times after the last record take
+    the last record.
+
+    Args:
+        times: numpy.datetime64 array of the times to interpolate to
+        recordTimes: numpy.datetime64 array of the times of the records, in ascending order
+
+    Returns:
+        i0: array of indices of the record at or before each time
+        i1: array of indices of the record after each time
+        wt: float32 array of weights to give to record i1 (the weight for i0 is 1 - wt)
+    """
+    times = numpy.asarray(times, dtype="datetime64[s]")
+    recordTimes = numpy.asarray(recordTimes, dtype="datetime64[s]")
+    i0 = match_times(times, recordTimes)
+    i1 = numpy.minimum(i0 + 1, len(recordTimes) - 1)
+    dt = (recordTimes[i1] - recordTimes[i0]).astype(numpy.float64)
+    elapsed = (times - recordTimes[i0]).astype(numpy.float64)
+    wt = numpy.divide(elapsed, dt, out=numpy.zeros_like(elapsed), where=dt > 0)
+    return i0, i1, numpy.clip(wt, 0.0, 1.0).astype(numpy.float32)
+
+
+def _format(time):
+    return numpy.datetime_as_string(time, unit="s").replace("T", " ")
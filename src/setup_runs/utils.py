@@ -1,9 +1,14 @@
 """Utility functions used by a number of different functions"""
 
 import numpy
-import subprocess
 import os
 import copy
+import fcntl
+import shutil
+from setup_runs.compression import compress_nc_file
+
+## ioctl request to clone a file's extents (Linux, linux/fs.h)
+FICLONE = 0x40049409
 
 
 def deg2rad(deg):
@@ -50,7 +55,7 @@ def getDistanceFromLatLonInKm(lat1, lon1, lat2, lon2):
 
 
 def compressNCfile(filename, ppc=None):
-    """Compress a netCDF3 file to netCDF4 using ncks
+    """Compress a netCDF3 file to netCDF4 (see setup_runs.compression)
 
     Args:
         filename: Path to the netCDF3 file to commpress
@@ -61,34 +66,85 @@ def compressNCfile(filename, ppc=None):
     """
 
     if os.path.exists(filename):
-        print("Compress file {} with ncks".format(filename))
-        command = "ncks -4 -L4 -O {} {}".format(filename, filename)
-        print("\t" + command)
-        commandList = command.split(" ")
-        if ppc is None:
-            ppcText = ""
-        else:
-            if not isinstance(ppc, int):
-                raise RuntimeError("Argument ppc should be an integer...")
-            elif ppc < 1 or ppc > 6:
-                raise RuntimeError("Argument ppc should be between 1 and 6...")
-            else:
-                ppcText = "--ppc default={}".format(ppc)
-                commandList = [commandList[0]] + ppcText.split(" ") + commandList[1:]
-        ##
-        ##
-        p = subprocess.Popen(
-            commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        stdout, stderr = p.communicate()
-        if len(stderr) > 0 or len(stdout) > 0:
-            print("stdout = " + stdout.decode())
-            print("stderr = " + stderr.decode())
-            raise RuntimeError("Error from ncks...")
+        print("Compress file {}".format(filename))
+        compress_nc_file(filename, ppc=ppc)
     else:
         print("File {} not found...".format(filename))
 
 
+def reflink_file(src, dst):
+    """Make a copy-on-write clone (reflink) of a file
+
+    The clone shares its data blocks with the source until either file is
+    modified, so it costs no I/O or space up front. This is only
+    supported by some filesystems (e.g. btrfs, XFS), and both files must
+    be on the same filesystem.
+
+    Args:
+        src: Path to the file to clone
+        dst: Path to the clone (which should not exist)
+
+    Returns:
+        Nothing (raises OSError if the clone could not be made)
+    """
+    with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+
+def stage_file(src, dst, mode="link", writable=False):
+    """Make a file available at a new path, avoiding copying it where possible
+
+    In 'link' mode, the cheapest of these methods that works is used:
+
+    - a hardlink (not if writable, as changes would also be made to src)
+    - a reflink, i.e. a copy-on-write clone (see reflink_file), where
+      later changes only cost the blocks that are modified
+    - a symbolic link (not if writable)
+    - a copy
+
+    In 'copy' mode the file is always copied. Any existing file at dst is
+    replaced.
+
+    Args:
+        src: Path to the file to stage
+        dst: Path to stage the file at
+        mode: 'link' or 'copy'
+        writable: Boolean (True/False) for whether dst will be modified, in which case it must not share changes with src
+
+    Returns:
+        method: the method used, one of 'hardlink', 'reflink', 'symlink' or 'copy'
+    """
+    if mode not in ["link", "copy"]:
+        raise ValueError("Staging mode should be one of 'link' or 'copy'")
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "link":
+        if not writable:
+            try:
+                os.link(src, dst)
+                return "hardlink"
+            except OSError:
+                pass
+        try:
+            reflink_file(src, dst)
+            return "reflink"
+        except OSError:
+            pass
+        if not writable:
+            try:
+                os.symlink(os.path.abspath(src), dst)
+                return "symlink"
+            except OSError:
+                pass
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
 def loadScripts(scripts):
     """Read the contents (i.e. the lines of text) of a set of scripts into a dictionary
 
@@ -116,18 +172,16 @@ def loadScripts(scripts):
     return scripts
 
 
-def replace_and_write(lines, outfile, substitutions, strict=True, makeExecutable=False):
-    """Make a set of substitutions from a list of strings and write to file
+def substitute_lines(lines, substitutions, strict=True):
+    """Make a set of substitutions from a list of strings
 
     Args:
         lines: List of strings
-        outfile: Place to write the destination
         substitutions: List of substitutions
         strict: Boolean, if True, it will cause an error if substitutions don't mattch exactly once
-        makeExecutable: Make the output script an executable
 
     Returns:
-        Nothing
+        Lines: List of strings with the substitutions made
     """
     Lines = copy.copy(lines)
     for subst in substitutions:
@@ -141,6 +195,23 @@ def replace_and_write(lines, outfile, substitutions, strict=True, makeExecutable
                 Lines[iline] = Lines[iline].replace(token, replc)
         elif strict:
             raise ValueError("Token '%s' matches %i times..." % (token, nmatches))
+    return Lines
+
+
+def replace_and_write(lines, outfile, substitutions, strict=True, makeExecutable=False):
+    """Make a set of substitutions from a list of strings and write to file
+
+    Args:
+        lines: List of strings
+        outfile: Place to write the destination
+        substitutions: List of substitutions
+        strict: Boolean, if True, it will cause an error if substitutions don't mattch exactly once
+        makeExecutable: Make the output script an executable
+
+    Returns:
+        Nothing
+    """
+    Lines = substitute_lines(lines, substitutions, strict)
     if os.path.exists(outfile):
         os.remove(outfile)
     f = open(outfile, "w")
@@ -2,93 +2,366 @@ from pathlib import Path
 
 import netCDF4
 import numpy
+from attrs import define, field
 
+from setup_runs.wrf.variable_selection import unselectedActions
 
-def average_fields(inFile: str | Path, outFile: str | Path, outputTime: str):
-    dimensions = {}
-    variables = {}
-    attributes = {}
+## attributes that make netCDF4 return masked (or scaled) arrays
+maskAndScaleAttributes = [
+    "_FillValue",
+    "missing_value",
+    "valid_min",
+    "valid_max",
+    "valid_range",
+    "scale_factor",
+    "add_offset",
+]
 
-    src = netCDF4.Dataset(inFile)
-    # Get the dimensions of the file
-    for name, dim in src.dimensions.items():
-        dimlen = len(dim)
-        ##
-        dimensions[name] = dimlen
-    # Get the global attributes
-    attributes["global"] = {a: src.getncattr(a) for a in src.ncattrs()}
-    # Get the metadata about the variables
-    for name, var in src.variables.items():
-        if "_FillValue" in var.ncattrs():
-            fill_value = var.getncattr("_FillValue")
+## the most time steps of a float32 field that are summed in float32 (rather than float64)
+float32SumMaxSteps = 16
+
+
+def time_axis(dimensions: tuple[str, ...], name: str = "") -> int | None:
+    """Find the position of the Time dimension of a variable
+
+    Args:
+        dimensions: the names of the variable's dimensions
+        name: the name of the variable (used in the error message)
+
+    Returns:
+        iTime: index of the Time dimension, or None if the variable does not vary in time
+    """
+    iTime = [idim for idim, dim in enumerate(dimensions) if dim == "Time"]
+    if len(iTime) == 0:
+        return None
+    elif len(iTime) == 1:
+        return iTime[0]
+    else:
+        raise RuntimeError(
+            "Multiple matches for the Time dimension for variable {}".format(name)
+        )
+
+
+def needs_masking(var: netCDF4.Variable) -> bool:
+    """Check whether a variable has attributes that netCDF4 would mask or scale it by"""
+    return any(a in var.ncattrs() for a in maskAndScaleAttributes)
+
+
+def accumulator_dtype(dtype: numpy.dtype, ntime: int) -> numpy.dtype:
+    """Choose the type of the running sum when averaging ntime values of a given type
+
+    float32 fields are summed in float32 when there are few enough time
+    steps for the rounding error to stay within a few units in the last
+    place; everything else is summed in float64 (as numpy.mean does).
+    """
+    if dtype == numpy.float32 and ntime <= float32SumMaxSteps:
+        return numpy.dtype(numpy.float32)
+    return numpy.dtype(numpy.float64)
+
+
+def average_variable(var: netCDF4.Variable, out: netCDF4.Variable):
+    """Average one variable over its Time dimension, writing the result to out
+
+    The average is accumulated one time slab at a time, so only a single
+    slab and the running sum are held in memory. Variables without fill
+    values or scaling attributes (i.e. nearly all of WRF's output) are
+    read without netCDF4's masking and summed into a preallocated buffer;
+    otherwise masked (missing) values are excluded from the average.
+
+    Args:
+        var: the variable to average
+        out: the output variable (with a Time dimension of length 1)
+
+    Returns:
+        Nothing
+    """
+    _average(var, out, time_axis(var.dimensions, var.name), needs_masking(var))
+
+
+def _average(var, out, iTime, masked):
+    if iTime is None:
+        out[...] = var[...]
+    elif masked:
+        _average_masked(var, out, iTime)
+    else:
+        var.set_auto_maskandscale(False)
+        out.set_auto_maskandscale(False)
+        _average_plain(var, out, iTime)
+
+
+def _average_plain(var, out, iTime):
+    ntime = var.shape[iTime]
+    shape = list(var.shape)
+    shape[iTime] = 1
+    total = numpy.zeros(shape, dtype=accumulator_dtype(var.dtype, ntime))
+    for itime in range(ntime):
+        index = (slice(None),) * iTime + (slice(itime, itime + 1),)
+        numpy.add(total, var[index], out=total)
+    total /= ntime
+    out[...] = total
+
+
+def _average_masked(var, out, iTime):
+    ntime = var.shape[iTime]
+    shape = list(var.shape)
+    shape[iTime] = 1
+    total = numpy.zeros(shape)
+    count = None
+    for itime in range(ntime):
+        index = (slice(None),) * iTime + (slice(itime, itime + 1),)
+        slab = var[index]
+        if numpy.ma.is_masked(slab):
+            if count is None:
+                count = numpy.full(shape, itime, dtype=numpy.int64)
+            count += ~numpy.ma.getmaskarray(slab)
+            total += slab.filled(0)
         else:
-            fill_value = None
-        ##
-        variables[name] = {
-            "dtype": var.dtype,
-            "dimensions": var.dimensions,
-            "fill_value": fill_value,
-        }
-        variables[name]["dimlens"] = numpy.array(
-            [
-                dimensions[dim] if dimensions[dim] is not None else 1
-                for dim in variables[name]["dimensions"]
-            ]
+            if count is not None:
+                count += 1
+            total += numpy.ma.getdata(slab)
+    if count is None:
+        total /= ntime
+    else:
+        total = numpy.ma.masked_where(count == 0, total)
+        total /= numpy.maximum(count, 1)
+    out[...] = total
+
+
+def first_time_step(var: netCDF4.Variable, out: netCDF4.Variable):
+    """Copy the first time-step of a variable to out (without averaging)"""
+    _first_time_step(var, out, time_axis(var.dimensions, var.name))
+
+
+def _first_time_step(var, out, iTime):
+    if iTime is None:
+        out[...] = var[...]
+    else:
+        var.set_auto_maskandscale(False)
+        out.set_auto_maskandscale(False)
+        out[...] = var[(slice(None),) * iTime + (slice(0, 1),)]
+
+
+def check_unselected(unselected: str):
+    """Check what is to be done with the unselected variables (see average_fields)"""
+    if unselected not in unselectedActions:
+        raise ValueError(
+            "unselected should be one of {}, not {}".format(
+                ", ".join(unselectedActions), unselected
+            )
         )
-        attributes[name] = {a: var.getncattr(a) for a in var.ncattrs()}
-    ##
-    variables["Times"]["dimlens"][0] = 1
-    ## average to a _single_ time-step
-    dimensions["Time"] = 1
-    average = {}
-    for name in variables.keys():
-        if name != "Times":
-            average[name] = numpy.zeros(variables[name]["dimlens"])
-    for name in variables.keys():
-        if name != "Times":
-            iTime = [
-                idim
-                for idim, dim in enumerate(variables[name]["dimensions"])
-                if dim == "Time"
-            ]
-            if len(iTime) == 0:
-                average[name] = src.variables[name][:]
-            elif len(iTime) == 1:
-                iTime = iTime[0]
-                average[name] = src.variables[name][:].mean(axis=iTime, keepdims=True)
-            else:
-                raise RuntimeError(
-                    "Multiple matches for the Time dimension for variable {}".format(
-                        name
-                    )
-                )
-    src.close()
-    ## create an output file
-    trg = netCDF4.Dataset(outFile, mode="w")
-    for dim in dimensions.keys():
-        trg.createDimension(dim, dimensions[dim])
-    ##
-    trg.setncatts(attributes["global"])
-    ##
-    for name in variables.keys():
-        ## set up the variables
-        trg.createVariable(
-            name,
-            variables[name]["dtype"].str[1:],
-            variables[name]["dimensions"],
-            zlib=(variables[name]["dtype"].str[1:] == "f4"),
-            fill_value=variables[name]["fill_value"],
+
+
+@define
+class VariableSchema:
+    """How one variable of a WRF output file is written to the averaged file
+
+    Attributes:
+        name: name of the variable
+        dtype: type of the variable (as a numpy type string, e.g. 'f4')
+        dimensions: names of the variable's dimensions
+        attributes: the variable's attributes (except _FillValue)
+        fillValue: the variable's _FillValue (or None)
+        iTime: index of the Time dimension (or None if the variable does not vary in time)
+        action: 'average', 'first' (write the first time-step) or 'times' (write the output time-string)
+        compression: keyword arguments for netCDF4.Dataset.createVariable setting the compression
+    """
+
+    name: str
+    dtype: str
+    dimensions: tuple[str, ...]
+    attributes: dict
+    fillValue: object = None
+    iTime: int | None = None
+    action: str = "average"
+    compression: dict = field(factory=dict)
+
+    @property
+    def masked(self) -> bool:
+        return self.fillValue is not None or any(
+            a in self.attributes for a in maskAndScaleAttributes
         )
-        trg.variables[name].setncatts(attributes[name])
-        ## write out the data
+
+
+@define
+class AveragingSchema:
+    """The layout of the averaged files made from WRF output files with the same structure
+
+    Attributes:
+        signature: the structure of the input files this schema applies to (see file_signature)
+        dimensions: lengths of the output dimensions (with Time of length 1)
+        variables: list of VariableSchema, one per output variable
+    """
+
+    signature: tuple
+    dimensions: dict[str, int]
+    variables: list[VariableSchema]
+
+
+def file_signature(
+    src: netCDF4.Dataset, variables: set[str] | None = None, unselected: str = "drop"
+) -> tuple:
+    """Describe the structure of a WRF output file (and the variable selection), without reading any attributes
+
+    Files with the same signature (e.g. the hourly output files for one
+    domain) are averaged with the same AveragingSchema.
+    """
+    return (
+        tuple(
+            (name, len(dim)) for name, dim in src.dimensions.items() if name != "Time"
+        ),
+        tuple(
+            (name, var.dtype.str, var.dimensions) for name, var in src.variables.items()
+        ),
+        None if variables is None else tuple(sorted(variables)),
+        unselected,
+    )
+
+
+def build_schema(
+    src: netCDF4.Dataset, variables: set[str] | None = None, unselected: str = "drop"
+) -> AveragingSchema:
+    """Work out the layout of the averaged file for a WRF output file
+
+    Args:
+        src: the open WRF output file
+        variables, unselected: see average_fields
+
+    Returns:
+        schema: AveragingSchema for src (and any other file with the same signature)
+    """
+    check_unselected(unselected)
+    ## average to a _single_ time-step
+    dimensions = {
+        name: 1 if name == "Time" else len(dim) for name, dim in src.dimensions.items()
+    }
+    schemas = []
+    for name, var in src.variables.items():
         if name == "Times":
-            trg.variables[name][:] = numpy.array(
-                [c for c in outputTime], dtype="|S1"
-            ).reshape(variables[name]["dimlens"])
+            action = "times"
+        elif variables is None or name in variables:
+            action = "average"
+        elif unselected == "first":
+            action = "first"
         else:
-            trg.variables[name][:] = average[name]
-    ##
-    trg.close()
+            continue
+        dtype = var.dtype.str[1:]
+        attributes = {a: var.getncattr(a) for a in var.ncattrs()}
+        schemas.append(
+            VariableSchema(
+                name=name,
+                dtype=dtype,
+                dimensions=var.dimensions,
+                fillValue=attributes.pop("_FillValue", None),
+                attributes=attributes,
+                iTime=time_axis(var.dimensions, name),
+                action=action,
+                compression={"zlib": True} if dtype == "f4" else {},
+            )
+        )
+    return AveragingSchema(
+        signature=file_signature(src, variables, unselected),
+        dimensions=dimensions,
+        variables=schemas,
+    )
+
+
+def average_fields(
+    inFile: str | Path,
+    outFile: str | Path,
+    outputTime: str,
+    variables: set[str] | None = None,
+    unselected: str = "drop",
+    schemas: dict | None = None,
+    globalAttributes: dict | None = None,
+):
+    """Average a WRF output file to a single time-step
+
+    The output file (with the same dimensions, attributes and variables,
+    but a Time dimension of length 1) is created before any data are read,
+    then each variable is averaged and written in turn, so the memory
+    needed is bounded by the largest single time slab of a variable
+    rather than by the size of the file.
+
+    Args:
+        inFile: Path to the WRF output file
+        outFile: Path to the averaged file to write
+        outputTime: the time-string to write to the Times variable (format %Y-%m-%d_%H:%M:%S)
+        variables: set of the variables to average (default is every variable, see setup_runs.wrf.variable_selection)
+        unselected: what to do with the variables not in variables, either 'drop' (leave them out) or 'first' (write their first time-step)
+        schemas: dictionary of AveragingSchema by file signature, reused (and updated) across calls (optional)
+        globalAttributes: dictionary of global attributes to set in the output file, overriding those of the input file (optional)
+
+    Returns:
+        Nothing
+    """
+    check_unselected(unselected)
+    if schemas is None:
+        schemas = {}
+    with netCDF4.Dataset(inFile) as src, netCDF4.Dataset(outFile, mode="w") as trg:
+        signature = file_signature(src, variables, unselected)
+        if signature not in schemas:
+            schemas[signature] = build_schema(src, variables, unselected)
+        schema = schemas[signature]
+        ##
+        for name, dimlen in schema.dimensions.items():
+            trg.createDimension(name, dimlen)
+        ## the global attributes are read for every file, as the times in them may differ
+        attrs = {a: src.getncattr(a) for a in src.ncattrs()}
+        if globalAttributes is not None:
+            attrs.update(globalAttributes)
+        trg.setncatts(attrs)
+        ##
+        for vs in schema.variables:
+            ## set up the variable
+            out = trg.createVariable(
+                vs.name,
+                vs.dtype,
+                vs.dimensions,
+                fill_value=vs.fillValue,
+                **vs.compression,
+            )
+            out.setncatts(vs.attributes)
+            ## write out the data
+            var = src.variables[vs.name]
+            if vs.action == "times":
+                out[:] = numpy.array([c for c in outputTime], dtype="|S1").reshape(
+                    out.shape
+                )
+            elif vs.action == "average":
+                _average(var, out, vs.iTime, vs.masked)
+            else:
+                _first_time_step(var, out, vs.iTime)
+
+
+def average_files(
+    jobs: list[tuple[str | Path, str | Path, str]],
+    variables: set[str] | None = None,
+    unselected: str = "drop",
+    schemas: dict | None = None,
+    globalAttributes: dict | None = None,
+):
+    """Average a batch of WRF output files, working out the output layout once per domain
+
+    Args:
+        jobs: list of (inFile, outFile, outputTime) tuples (see average_fields)
+        variables, unselected, globalAttributes: see average_fields
+        schemas: dictionary of AveragingSchema by file signature, reused (and updated) across calls (optional)
+
+    Returns:
+        Nothing
+    """
+    if schemas is None:
+        schemas = {}
+    for inFile, outFile, outputTime in jobs:
+        average_fields(
+            inFile,
+            outFile,
+            outputTime,
+            variables=variables,
+            unselected=unselected,
+            schemas=schemas,
+            globalAttributes=globalAttributes,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,121 @@
+"""Spread jobs over a pool of worker processes, taking turns between groups of jobs (e.g. WRF domains)"""
+
+import collections
+import concurrent.futures
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class FairPool:
+    """Run a function on a stream of items in worker processes
+
+    Items are queued by key (e.g. the domain of a WRF output file) and
+    the keys take turns, so one busy domain cannot hold up the others.
+    At most max_in_flight items are handed to the workers at once (the
+    rest wait in the queues), and an item is never queued or run again
+    while it is already queued or running.
+
+    Example:
+        with FairPool(process_file, max_workers=3) as pool:
+            for path in paths:
+                pool.submit(path, key=domain_of(path))
+            pool.drain()
+    """
+
+    def __init__(
+        self, func, max_workers, max_in_flight=None, initializer=None, initargs=()
+    ):
+        """
+        Args:
+            func: function to call with each item (must be picklable)
+            max_workers: number of worker processes
+            max_in_flight: most items to hand to the workers at once (default max_workers)
+            initializer, initargs: function (and its arguments) to call when each worker starts
+        """
+        self.func = func
+        self.max_in_flight = max_in_flight or max_workers
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers, initializer=initializer, initargs=initargs
+        )
+        self.queues = collections.OrderedDict()
+        self.running = {}
+        self.active = set()
+
+    def submit(self, item, key=None) -> bool:
+        """Queue an item to be processed
+
+        Args:
+            item: argument for func (must be hashable and picklable)
+            key: the group the item belongs to
+
+        Returns:
+            queued: True if the item was queued, False if it was already queued or running
+        """
+        if item in self.active:
+            return False
+        self.active.add(item)
+        self.queues.setdefault(key, collections.deque()).append(item)
+        self.dispatch()
+        return True
+
+    def dispatch(self):
+        """Hand queued items to the workers, taking one from each key in turn"""
+        while len(self.running) < self.max_in_flight and self.queues:
+            key, queue = next(iter(self.queues.items()))
+            item = queue.popleft()
+            ## move the key to the back of the line
+            del self.queues[key]
+            if queue:
+                self.queues[key] = queue
+            self.running[self.executor.submit(self.func, item)] = item
+
+    def collect(self, timeout=0.0) -> int:
+        """Wait for running items to finish, then hand more items to the workers
+
+        Errors raised by func are logged, not raised, so one bad item does
+        not stop the rest (the item can then be submitted again).
+
+        Args:
+            timeout: longest time to wait for an item to finish (None to wait for at least one)
+
+        Returns:
+            nfinished: number of items that finished
+        """
+        if not self.running:
+            return 0
+        done, _ = concurrent.futures.wait(
+            self.running,
+            timeout=timeout,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        for future in done:
+            item = self.running.pop(future)
+            self.active.discard(item)
+            if future.exception() is not None:
+                logger.error("Error processing %s", item, exc_info=future.exception())
+        self.dispatch()
+        return len(done)
+
+    def __contains__(self, item) -> bool:
+        """Is the item queued or running?"""
+        return item in self.active
+
+    @property
+    def busy(self) -> bool:
+        """Are any items queued or running?"""
+        return len(self.active) > 0
+
+    def drain(self):
+        """Wait until every queued item has been processed"""
+        while self.busy:
+            self.collect(timeout=None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
@@ -0,0 +1,34 @@
+"""Publish averaged WRF output files to a staging area, where CMAQ's preprocessing can pick them up while WRF is still running
+
+The staging area mirrors the layout that MCIP reads (one subdirectory
+per WRF run, named <yyyymmddhh> after the start of the run, see
+setup_runs.cmaq.mcip.mcip_wrf_files). Each file is staged under a
+temporary name and then renamed into place, so a file in the staging
+area is always complete.
+"""
+
+import os
+from pathlib import Path
+
+from setup_runs.utils import stage_file
+
+
+def publish_file(path: str | Path, publishDir: str | Path) -> Path:
+    """Make an averaged WRF output file available in a staging directory
+
+    Args:
+        path: Path to the averaged file
+        publishDir: directory to publish the file to (created if need be)
+
+    Returns:
+        published: Path to the published file
+    """
+    path = Path(path)
+    published = Path(publishDir) / path.name
+    os.makedirs(publishDir, exist_ok=True)
+    if published.exists() and os.path.samefile(path, published):
+        return published
+    tmpPath = published.with_name(".{}.tmp".format(path.name))
+    stage_file(path, tmpPath, mode="link")
+    os.replace(tmpPath, published)
+    return published
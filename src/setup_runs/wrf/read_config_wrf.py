@@ -57,6 +57,9 @@ class WRFConfig:
     """filename of the template script to coordinate the process"""
     check_wrfout_in_background_script: str
     """"""
+    wrfout_staging_dir: str
+    """directory to publish the averaged WRF output to while WRF runs, in a subdirectory 
+    per run (<yyyymmddhh>), so that CMAQ's preprocessing can start early (empty to disable)"""
     only_edit_namelists: str = field(converter=boolean_converter)
     """should the only task performed by the python script be to edit the WRF namelists and the shell 
     scripts (the daily run-script, the daily clean-up script and the main coordination script)"""
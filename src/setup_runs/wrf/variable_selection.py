@@ -0,0 +1,174 @@
+"""Choose which WRF output variables are averaged (and kept) in the hourly files
+
+By default every variable is averaged. A selection can instead be made
+from an explicit list, from the variables that MCIP reads, and from the
+variables added to the history stream by a WRF iofields file (such as
+domains/*/add_remove_var.txt). Variables outside the selection are either
+dropped or passed through as their first time-step, without averaging.
+"""
+
+from pathlib import Path
+
+## the WRF variables that MCIP reads (see setup_wrfem.f90 and rdwrfem.f90),
+## including the optional ones it uses if present
+mcipVariables = {
+    ## coordinates and map factors
+    "Times",
+    "XLAT",
+    "XLONG",
+    "XLAT_U",
+    "XLONG_U",
+    "XLAT_V",
+    "XLONG_V",
+    "MAPFAC_M",
+    "MAPFAC_U",
+    "MAPFAC_V",
+    "MAPFAC_UY",
+    "MAPFAC_VX",
+    "F",
+    "ZNU",
+    "ZNW",
+    "HGT",
+    ## the model-top pressure (MCIP stops if it is missing)
+    "P_TOP",
+    ## 3-D state
+    "U",
+    "V",
+    "W",
+    "T",
+    "P",
+    "PB",
+    "PH",
+    "PHB",
+    "MU",
+    "MUB",
+    "QVAPOR",
+    "QCLOUD",
+    "QRAIN",
+    "QICE",
+    "QSNOW",
+    "QGRAUP",
+    "CLDFRA",
+    "TKE",
+    "TKE_PBL",
+    "TKE_MYJ",
+    ## surface and boundary layer
+    "PSFC",
+    "T2",
+    "Q2",
+    "TH2",
+    "U10",
+    "V10",
+    "TSK",
+    "SST",
+    "HFX",
+    "LH",
+    "QFX",
+    "UST",
+    "PBLH",
+    "RMOL",
+    "ZNT",
+    "RA",
+    "RS",
+    "RAINC",
+    "RAINNC",
+    "SNOWNC",
+    "SWDOWN",
+    "GLW",
+    "ALBEDO",
+    "EMISS",
+    ## land surface
+    "LU_INDEX",
+    "IVGTYP",
+    "LANDUSEF",
+    "LANDMASK",
+    "XLAND",
+    "VEGFRA",
+    "VEGF_PX",
+    "LAI",
+    "LAI_PX",
+    "ISLTYP",
+    "ZS",
+    "DZS",
+    "SMOIS",
+    "TSLB",
+    "CANWAT",
+    "SNOWC",
+    "SNOWH",
+    "SEAICE",
+    "WSAT_PX",
+    "WFC_PX",
+    "WWLT_PX",
+    "CSAND_PX",
+    "FMSAND_PX",
+    "CLAY_PX",
+    "FRC_URB2D",
+}
+
+## what can be done with the variables outside the selection
+unselectedActions = ["drop", "first"]
+
+
+def read_iofields_file(path: str | Path) -> tuple[set[str], set[str]]:
+    """Read the variables added to and removed from the history stream by a WRF iofields file
+
+    Each line of the file looks like '+:h:0:U,V,T' (add to history
+    stream 0) or '-:h:0:ZS,DZS' (remove from it). Lines starting with
+    '#' are comments.
+
+    Args:
+        path: Path to the iofields file (e.g. add_remove_var.txt)
+
+    Returns:
+        added: set of the variables added to history stream 0
+        removed: set of the variables removed from history stream 0
+    """
+    added = set()
+    removed = set()
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            fields = line.split(":", maxsplit=3)
+            if len(fields) != 4 or fields[0] not in ["+", "-"]:
+                raise RuntimeError(
+                    "Could not parse line '{}' of iofields file {}".format(line, path)
+                )
+            action, stream, streamId, names = fields
+            if stream.lower() != "h" or streamId != "0":
+                continue
+            names = {name.strip() for name in names.split(",") if name.strip()}
+            if action == "+":
+                added |= names
+            else:
+                removed |= names
+    return added, removed
+
+
+def selected_variables(
+    variables: list[str] | None = None,
+    mcip: bool = False,
+    iofieldsFile: str | Path | None = None,
+) -> set[str] | None:
+    """Build the set of variables to average
+
+    Args:
+        variables: explicit list of variable names to include
+        mcip: True/False - include the variables that MCIP reads?
+        iofieldsFile: Path to a WRF iofields file, whose added variables are included
+
+    Returns:
+        selection: set of variable names, or None if nothing was selected (i.e. keep every variable)
+    """
+    if not variables and not mcip and iofieldsFile is None:
+        return None
+    selection = {"Times"}
+    if variables:
+        selection |= set(variables)
+    if mcip:
+        selection |= mcipVariables
+    if iofieldsFile is not None:
+        added, _ = read_iofields_file(iofieldsFile)
+        selection |= added
+    return selection
@@ -5,7 +5,7 @@ export NCPUS=${NCPUS:-1}
 ulimit -s unlimited
 cd ${RUN_DIR} || exit 1
 
-python3 checkWrfoutInBackground.py --verify-steps --watch > wrf-background.log 2>&1 &
+python3 checkWrfoutInBackground.py --verify-steps --watch --simulation-start-date ${firstTimeToKeep} ${PUBLISH_OPTIONS} > wrf-background.log 2>&1 &
 backgroundPID=$!
 
 echo running with $NCPUS mpi ranks
@@ -14,8 +14,10 @@ time mpirun -np $NCPUS ./wrf.exe >& wrf.log
 ## give the python script a chance to finish
 sleep 30
 
-## kill the process that was running in the background
+## kill the process that was running in the background, and wait for it
+## to finish the files it is averaging
 kill $backgroundPID
+wait $backgroundPID
 
 if [ ! -e rsl.out.0000 ] ; then
     echo "wrf.exe did not complete successfully - exiting"
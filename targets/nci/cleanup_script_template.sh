@@ -47,15 +47,19 @@ for wrfoutfile in `find . -type f -iname 'wrfout_*'` ; do
     fi
 done
 
-for file in wrfout_*; do
-  echo "WARNING: $file remains unprocessed. Attempting to process"
-  python3 checkWrfoutInBackground.py --no-verify-steps --timeout 0 $file
+## process any leftover files in a single batch
+leftovers=(wrfout_*)
+if [ -e "${leftovers[0]}" ] ; then
+  echo "WARNING: ${#leftovers[@]} wrfout files remain unprocessed. Attempting to process them"
+  python3 checkWrfoutInBackground.py --no-verify-steps --timeout 0 --simulation-start-date ${firstTimeToKeep} ${PUBLISH_OPTIONS} "${leftovers[@]}"
 
-  if [ -e $file ] ; then
-    echo "Could not process $file. Exiting."
-    exit
-  fi
-done
+  for file in "${leftovers[@]}"; do
+    if [ -e $file ] ; then
+      echo "Could not process $file. Exiting."
+      exit
+    fi
+  done
+fi
 
 
 echo "Compress files"
@@ -24,7 +24,7 @@ module load conda/analysis3
 ulimit -s unlimited
 cd ${RUN_DIR}
 
-python3 checkWrfoutInBackground.py --verify-steps --watch > wrf-background.log 2>&1 &
+python3 checkWrfoutInBackground.py --verify-steps --watch --simulation-start-date ${firstTimeToKeep} ${PUBLISH_OPTIONS} > wrf-background.log 2>&1 &
 backgroundPID=$!
 
 echo running with $PBS_NCPUS mpi ranks
@@ -33,8 +33,10 @@ time /apps/openmpi/4.0.2/bin/mpirun -np $PBS_NCPUS -report-bindings ./wrf.exe >&
 ## give the python script a chance to finish
 sleep 75
 
-## kill the process that was running in the background
+## kill the process that was running in the background, and wait for it
+## to finish the files it is averaging
 kill $backgroundPID
+wait $backgroundPID
 
 if [ ! -e rsl.out.0000 ] ; then
     echo "wrf.exe did not complete successfully - exiting"
@@ -0,0 +1,293 @@
+"""Synthetic MCIP, CAMS, template and WRF output files for the benchmarks
+
+The sizes are set on the command line, e.g.
+
+    pytest tests/benchmarks --grid-size 10x10 --grid-size 1000x1000 --cams-days 31
+"""
+
+import datetime
+import tracemalloc
+
+import netCDF4
+import numpy
+import pytest
+
+DATE = datetime.datetime(2022, 7, 22)
+MCIP_SUFFIX = "bench"
+GRID_NAME = "benchgrid"
+NLAY = 32
+WRF_STEPS = 12
+CAMS_STEP_HOURS = 3
+CAMS_LEVELS = [1, 2, 3, 5, 7, 10, 20, 30, 50, 70, 100, 150, 200]
+CAMS_LEVELS += [250, 300, 400, 500, 600, 700, 800, 850, 900, 925, 950, 1000]
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--grid-size",
+        action="append",
+        default=[],
+        help="size of the synthetic CMAQ grid as ROWxCOL (can be repeated, defaults to 10x10)",
+    )
+    parser.addoption(
+        "--cams-days",
+        action="append",
+        default=[],
+        type=int,
+        help="number of days of synthetic 3-hourly CAMS data (can be repeated, defaults to 1)",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    if "grid_size" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("grid_size") or ["10x10"]
+        metafunc.parametrize("grid_size", sizes, scope="session")
+    if "cams_days" in metafunc.fixturenames:
+        days = metafunc.config.getoption("cams_days") or [1]
+        metafunc.parametrize("cams_days", days, scope="session")
+
+
+def _ioapi_dimensions(nc, nvar, nlay=1):
+    nc.createDimension("TSTEP", None)
+    nc.createDimension("DATE-TIME", 2)
+    nc.createDimension("LAY", nlay)
+    nc.createDimension("VAR", nvar)
+
+
+def _domain(nrow, ncol, dx=0.1, lat0=-25.0, lon0=135.0):
+    """Latitudes and longitudes of a (slightly rotated) grid centred on Australia"""
+    R, C = numpy.meshgrid(
+        numpy.arange(nrow) - nrow / 2, numpy.arange(ncol) - ncol / 2, indexing="ij"
+    )
+    lat = lat0 + dx * (R + 0.02 * C)
+    lon = lon0 + dx * (C - 0.03 * R)
+    return lat.astype("f4"), lon.astype("f4")
+
+
+def _perimeter(lat, lon):
+    """Latitudes and longitudes of the ring of boundary points (NTHIK=1)"""
+    nrow, ncol = lat.shape
+    latPad = numpy.pad(lat, 1, mode="reflect", reflect_type="odd")
+    lonPad = numpy.pad(lon, 1, mode="reflect", reflect_type="odd")
+    irow = numpy.concatenate(
+        [
+            numpy.zeros(ncol + 1, dtype=int),
+            numpy.arange(1, nrow + 2),
+            numpy.full(ncol + 1, nrow + 1),
+            numpy.arange(0, nrow + 1),
+        ]
+    )
+    icol = numpy.concatenate(
+        [
+            numpy.arange(1, ncol + 2),
+            numpy.full(nrow + 1, ncol + 1),
+            numpy.arange(0, ncol + 1),
+            numpy.zeros(nrow + 1, dtype=int),
+        ]
+    )
+    return latPad[irow, icol], lonPad[irow, icol]
+
+
+def make_mcip_files(mcipdir, nrow, ncol, nlay=NLAY, date=DATE):
+    """Write synthetic GRIDDESC, GRIDCRO2D, GRIDBDY2D, METCRO3D and METCRO2D files"""
+    mcipdir.mkdir(parents=True, exist_ok=True)
+    lat, lon = _domain(nrow, ncol)
+    latp, lonp = _perimeter(lat, lon)
+    (mcipdir / "GRIDDESC").write_text(
+        "' '\n'LamCon_34S_150E'\n  2 -15.0 -40.0 133.0 133.0 -27.0\n' '\n"
+        "'{}'\n'LamCon_34S_150E' 0.0 0.0 10000.0 10000.0 {} {} 1\n' '\n".format(
+            GRID_NAME, ncol, nrow
+        )
+    )
+    with netCDF4.Dataset(mcipdir / "GRIDCRO2D_{}".format(MCIP_SUFFIX), "w") as nc:
+        _ioapi_dimensions(nc, 2)
+        nc.createDimension("ROW", nrow)
+        nc.createDimension("COL", ncol)
+        for name, values in [("LAT", lat), ("LON", lon)]:
+            nc.createVariable(name, "f4", ("TSTEP", "LAY", "ROW", "COL"))[0, 0] = values
+    with netCDF4.Dataset(mcipdir / "GRIDBDY2D_{}".format(MCIP_SUFFIX), "w") as nc:
+        _ioapi_dimensions(nc, 2)
+        nc.createDimension("PERIM", len(latp))
+        nc.NTHIK = numpy.int32(1)
+        for name, values in [("LAT", latp), ("LON", lonp)]:
+            nc.createVariable(name, "f4", ("TSTEP", "LAY", "PERIM"))[0, 0] = values
+    with netCDF4.Dataset(mcipdir / "METCRO3D_{}".format(MCIP_SUFFIX), "w") as nc:
+        _ioapi_dimensions(nc, 1, nlay)
+        nc.VGLVLS = (numpy.linspace(1.0, 0.0, nlay + 1) ** 1.5).astype("f4")
+        nc.VGTOP = numpy.float32(5000.0)
+    times = [date + datetime.timedelta(hours=h) for h in range(25)]
+    with netCDF4.Dataset(mcipdir / "METCRO2D_{}".format(MCIP_SUFFIX), "w") as nc:
+        _ioapi_dimensions(nc, 1)
+        nc.createDimension("ROW", nrow)
+        nc.createDimension("COL", ncol)
+        nc.TSTEP = numpy.int32(10000)
+        TFLAG = [[int(t.strftime("%Y%j")), int(t.strftime("%H%M%S"))] for t in times]
+        nc.createVariable("TFLAG", "i4", ("TSTEP", "VAR", "DATE-TIME"))[:] = (
+            numpy.array(TFLAG)[:, numpy.newaxis, :]
+        )
+        rng = numpy.random.default_rng(0)
+        PRSFC = rng.uniform(85000.0, 102000.0, size=(1, 1, nrow, ncol))
+        PRSFC = PRSFC + 200.0 * numpy.arange(len(times))[:, None, None, None]
+        nc.createVariable("PRSFC", "f4", ("TSTEP", "LAY", "ROW", "COL"))[:] = PRSFC
+
+
+def make_cams_file(filename, ndays, date=DATE):
+    """Write a synthetic global 0.75 degree, 3-hourly CAMS file covering ndays days from date"""
+    latmz = numpy.arange(90.0, -90.01, -0.75)
+    lonmz = numpy.arange(0.0, 360.0, 0.75)
+    levels = numpy.array(CAMS_LEVELS, dtype="f8")
+    start = date - datetime.timedelta(hours=2 * CAMS_STEP_HOURS)
+    ntime = ndays * 24 // CAMS_STEP_HOURS + 5
+    LON, LAT = numpy.meshgrid(numpy.deg2rad(lonmz), numpy.deg2rad(latmz))
+    field = 1.0e-6 * (1.0 + 0.05 * numpy.sin(3 * LAT) * numpy.cos(2 * LON))
+    profile = 1.0 - 0.01 * numpy.log(levels / 1000.0)
+    with netCDF4.Dataset(filename, "w") as nc:
+        nc.createDimension("time", ntime)
+        nc.createDimension("level", len(levels))
+        nc.createDimension("latitude", len(latmz))
+        nc.createDimension("longitude", len(lonmz))
+        time = nc.createVariable("time", "i4", ("time",))
+        time.units = "hours since 1900-01-01 00:00:00.0"
+        hours = (start - datetime.datetime(1900, 1, 1)).total_seconds() // 3600
+        time[:] = hours + CAMS_STEP_HOURS * numpy.arange(ntime)
+        nc.createVariable("level", "f8", ("level",))[:] = levels
+        nc.createVariable("latitude", "f4", ("latitude",))[:] = latmz
+        nc.createVariable("longitude", "f4", ("longitude",))[:] = lonmz
+        ch4 = nc.createVariable(
+            "ch4_c", "f4", ("time", "level", "latitude", "longitude")
+        )
+        for itime in range(ntime):
+            ch4[itime] = (1.0 + 0.001 * itime) * profile[:, None, None] * field
+
+
+def make_template_files(cmaqdir, nrow, ncol, nperim, nlay=NLAY):
+    """Write synthetic ICON and BCON template files, returning their filenames"""
+    cmaqdir.mkdir(parents=True, exist_ok=True)
+    filenames = {}
+    for kind, dims in [
+        ("icon", {"ROW": nrow, "COL": ncol}),
+        ("bcon", {"PERIM": nperim}),
+    ]:
+        filenames[kind] = cmaqdir / "template_{}_{}.nc".format(kind, GRID_NAME)
+        with netCDF4.Dataset(filenames[kind], "w") as nc:
+            _ioapi_dimensions(nc, 2, nlay)
+            for name, size in dims.items():
+                nc.createDimension(name, size)
+            nc.SDATE = numpy.int32(2022203)
+            nc.STIME = numpy.int32(0)
+            nc.TSTEP = numpy.int32(0)
+            nc.createVariable("TFLAG", "i4", ("TSTEP", "VAR", "DATE-TIME"))[0] = [
+                [2022203, 0],
+                [2022203, 0],
+            ]
+            for spec in ["O3", "CH4"]:
+                var = nc.createVariable(spec, "f4", ("TSTEP", "LAY") + tuple(dims))
+                var.long_name = "{:16}".format(spec)
+                var.units = "{:16}".format("ppmV")
+                var[0] = 0.03
+    return filenames
+
+
+def make_wrfout_file(filename, nrow, ncol, nlay=NLAY, ntime=WRF_STEPS, date=DATE):
+    """Write a synthetic WRF output file holding ntime 5-minute steps
+
+    The file has a mix of 3-D and 2-D float fields (similar in number to a
+    real wrfout file), an integer field and some static fields.
+    """
+    rng = numpy.random.default_rng(0)
+    with netCDF4.Dataset(filename, "w") as nc:
+        nc.createDimension("Time", None)
+        nc.createDimension("DateStrLen", 19)
+        nc.createDimension("bottom_top", nlay)
+        nc.createDimension("bottom_top_stag", nlay + 1)
+        nc.createDimension("soil_layers_stag", 4)
+        nc.createDimension("south_north", nrow)
+        nc.createDimension("west_east", ncol)
+        nc.TITLE = " OUTPUT FROM WRF V4.5 MODEL"
+        Times = nc.createVariable("Times", "S1", ("Time", "DateStrLen"))
+        fields = [
+            (name, ("Time", "bottom_top", "south_north", "west_east"))
+            for name in ["U", "V", "T", "P", "PB", "QVAPOR", "QCLOUD", "QRAIN"]
+        ]
+        fields += [
+            (name, ("Time", "bottom_top_stag", "south_north", "west_east"))
+            for name in ["W", "PH", "PHB"]
+        ]
+        fields += [
+            (name, ("Time", "soil_layers_stag", "south_north", "west_east"))
+            for name in ["TSLB", "SMOIS"]
+        ]
+        fields += [
+            (name, ("Time", "south_north", "west_east"))
+            for name in ["T2", "Q2", "U10", "V10", "PSFC", "RAINC", "RAINNC", "PBLH"]
+        ]
+        for name, dims in fields:
+            nc.createVariable(name, "f4", dims).units = "-"
+        nc.createVariable("ITIMESTEP", "i4", ("Time",))
+        nc.createVariable("HGT", "f4", ("south_north", "west_east"))[:] = 100.0
+        for itime in range(ntime):
+            time = date + datetime.timedelta(minutes=5 * itime)
+            Times[itime] = numpy.array(
+                list(time.strftime("%Y-%m-%d_%H:%M:%S")), dtype="S1"
+            )
+            for name, dims in fields:
+                var = nc[name]
+                var[itime] = rng.uniform(0.0, 1.0, size=var.shape[1:]).astype("f4")
+            nc["ITIMESTEP"][itime] = 30 * itime
+
+
+@pytest.fixture(scope="session")
+def wrfout_file(tmp_path_factory, grid_size):
+    nrow, ncol = [int(n) for n in grid_size.split("x")]
+    filename = tmp_path_factory.mktemp("wrfout_{}_".format(grid_size)) / (
+        DATE.strftime("wrfout_d01_%Y-%m-%d_%H:%M:%S")
+    )
+    make_wrfout_file(filename, nrow, ncol)
+    return filename
+
+
+@pytest.fixture(scope="session")
+def cams_file(tmp_path_factory, cams_days):
+    filename = tmp_path_factory.mktemp("cams") / "cams.nc"
+    make_cams_file(filename, cams_days)
+    return filename
+
+
+@pytest.fixture(scope="session")
+def synthetic_run(tmp_path_factory, grid_size, cams_file):
+    """Directories and files for a single date and domain"""
+    nrow, ncol = [int(n) for n in grid_size.split("x")]
+    root = tmp_path_factory.mktemp("run_{}_".format(grid_size))
+    mcipdir = root / "mcip" / DATE.strftime("%Y-%m-%d") / "d01"
+    make_mcip_files(mcipdir, nrow, ncol)
+    templates = make_template_files(root / "cmaq", nrow, ncol, 2 * (nrow + ncol + 2))
+    return dict(
+        root=root,
+        mcipdir=mcipdir,
+        metDir=root / "mcip",
+        ctmDir=root / "cmaq",
+        cams_file=cams_file,
+        templates=templates,
+        date=DATE,
+        grid=GRID_NAME,
+        mcipsuffix=MCIP_SUFFIX,
+    )
+
+
+@pytest.fixture
+def measure(benchmark):
+    """Benchmark a function, recording its peak (traced) memory use in the results"""
+
+    def run(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_MiB"] = peak / 2**20
+        return benchmark.pedantic(
+            func, args=args, kwargs=kwargs, rounds=3, warmup_rounds=0
+        )
+
+    return run
@@ -0,0 +1,192 @@
+"""Benchmarks of the phases of the CAMS to CMAQ interpolation
+
+Each phase (horizontal mapping, vertical mapping, gathering the CAMS
+values and writing the IC/BC files) is timed separately, along with a
+full run for a single date and domain. Run with
+
+    make benchmark
+
+or pytest tests/benchmarks --benchmark-only (see conftest.py for the
+options that set the sizes of the synthetic grids).
+"""
+
+import netCDF4
+import numpy
+import pytest
+import pytz
+
+from setup_runs.cmaq.cams import (
+    extract_and_interpolate_boundary,
+    extract_and_interpolate_interior,
+    interpolateFromCAMSToCmaqGrid,
+    write_ic_bc_file,
+)
+from setup_runs.cmaq.cams_reader import CAMSReader
+from setup_runs.cmaq.cams_regrid import (
+    boundary_to_interior_indices,
+    nearest_cams_indices,
+    vertical_interpolation_weights,
+)
+
+
+@pytest.fixture(scope="session")
+def domain(synthetic_run):
+    """The CMAQ coordinates and surface pressure for the synthetic run"""
+    mcipdir = synthetic_run["mcipdir"]
+    with netCDF4.Dataset(
+        mcipdir / "GRIDCRO2D_{}".format(synthetic_run["mcipsuffix"])
+    ) as nc:
+        LAT = nc.variables["LAT"][:].squeeze()
+        LON = nc.variables["LON"][:].squeeze()
+    with netCDF4.Dataset(
+        mcipdir / "GRIDBDY2D_{}".format(synthetic_run["mcipsuffix"])
+    ) as nc:
+        LATP = nc.variables["LAT"][:].squeeze()
+        LONP = nc.variables["LON"][:].squeeze()
+    with netCDF4.Dataset(
+        mcipdir / "METCRO3D_{}".format(synthetic_run["mcipsuffix"])
+    ) as nc:
+        sigma = nc.getncattr("VGLVLS")
+        mtop = nc.getncattr("VGTOP")
+    with netCDF4.Dataset(
+        mcipdir / "METCRO2D_{}".format(synthetic_run["mcipsuffix"])
+    ) as nc:
+        PSURF = nc.variables["PRSFC"][:, 0, :, :]
+    return dict(
+        LAT=LAT, LON=LON, LATP=LATP, LONP=LONP, sigma=sigma, mtop=mtop, PSURF=PSURF
+    )
+
+
+@pytest.fixture(scope="session")
+def window(synthetic_run, domain):
+    with CAMSReader(synthetic_run["cams_file"]) as camsReader:
+        camsReader.restrict_to(
+            numpy.concatenate([domain["LAT"].ravel(), domain["LATP"]]),
+            numpy.concatenate([domain["LON"].ravel(), domain["LONP"]]),
+        )
+        return camsReader.window
+
+
+@pytest.fixture(scope="session")
+def mapping(synthetic_run, domain, window):
+    """The horizontal and vertical mappings, and the CAMS times to use"""
+    with CAMSReader(synthetic_run["cams_file"], window=window) as camsReader:
+        latmz, lonmz = camsReader.latitude, camsReader.longitude
+        levels = camsReader.level.astype("float") * 100.0
+        iMZtime = numpy.searchsorted(
+            camsReader.times, numpy.datetime64(synthetic_run["date"]), "right"
+        )
+    irow, icol = boundary_to_interior_indices(*domain["LAT"].shape)
+    Iz_interior, wz_interior = vertical_interpolation_weights(
+        domain["PSURF"][:1], domain["sigma"], domain["mtop"], levels
+    )
+    Iz_boundary, wz_boundary = vertical_interpolation_weights(
+        domain["PSURF"][:1, irow, icol], domain["sigma"], domain["mtop"], levels
+    )
+    return dict(
+        interior=nearest_cams_indices(domain["LAT"], domain["LON"], latmz, lonmz),
+        boundary=nearest_cams_indices(domain["LATP"], domain["LONP"], latmz, lonmz),
+        Iz_interior=Iz_interior[0],
+        wz_interior=wz_interior[0],
+        Iz_boundary=Iz_boundary[0],
+        wz_boundary=wz_boundary[0],
+        iMZtime=iMZtime - 1,
+    )
+
+
+def test_001_nearest_neighbour_mapping(measure, synthetic_run, domain, window):
+    with CAMSReader(synthetic_run["cams_file"], window=window) as camsReader:
+        latmz, lonmz = camsReader.latitude, camsReader.longitude
+
+    def run():
+        nearest_cams_indices(domain["LAT"], domain["LON"], latmz, lonmz)
+        nearest_cams_indices(domain["LATP"], domain["LONP"], latmz, lonmz)
+
+    measure(run)
+
+
+def test_002_vertical_mapping(measure, synthetic_run, domain):
+    with CAMSReader(synthetic_run["cams_file"]) as camsReader:
+        levels = camsReader.level.astype("float") * 100.0
+    measure(
+        vertical_interpolation_weights,
+        domain["PSURF"],
+        domain["sigma"],
+        domain["mtop"],
+        levels,
+    )
+
+
+def test_003_gather(measure, synthetic_run, domain, window, mapping):
+    LON = domain["LON"]
+    LONP = domain["LONP"]
+    lens = {"LAY": len(domain["sigma"]) - 1}
+
+    def run():
+        ## nothing is cached, so every round reads from the file
+        with CAMSReader(
+            synthetic_run["cams_file"], maxCachedRecords=0, window=window
+        ) as camsReader:
+            extract_and_interpolate_interior(
+                "ch4_c",
+                camsReader,
+                lens,
+                LON,
+                mapping["Iz_interior"],
+                mapping["iMZtime"],
+                mapping["interior"],
+                wz=mapping["wz_interior"],
+            )
+            extract_and_interpolate_boundary(
+                "ch4_c",
+                camsReader,
+                lens,
+                LONP,
+                mapping["Iz_boundary"],
+                [mapping["iMZtime"]],
+                mapping["boundary"],
+                wz=mapping["wz_boundary"],
+            )
+
+    measure(run)
+
+
+def test_004_write(measure, synthetic_run, domain, tmp_path):
+    nlay = len(domain["sigma"]) - 1
+    rng = numpy.random.default_rng(0)
+    icFields = {
+        "CH4": rng.uniform(1.8, 2.0, (1, nlay) + domain["LON"].shape).astype("f4")
+    }
+    bcFields = {
+        "CH4": rng.uniform(1.8, 2.0, (1, nlay) + domain["LONP"].shape).astype("f4")
+    }
+    templates = synthetic_run["templates"]
+
+    def run():
+        write_ic_bc_file(templates["icon"], tmp_path / "ICON.nc", icFields, "O3")
+        write_ic_bc_file(templates["bcon"], tmp_path / "BCON.nc", bcFields, "O3")
+
+    measure(run)
+
+
+@pytest.mark.parametrize("timeResolvedBCs", [False, True])
+def test_005_interpolate_from_cams_to_cmaq_grid(
+    measure, synthetic_run, timeResolvedBCs
+):
+    date = pytz.UTC.localize(synthetic_run["date"])
+    templates = synthetic_run["templates"]
+    measure(
+        interpolateFromCAMSToCmaqGrid,
+        [date],
+        ["d01"],
+        "CH4only",
+        str(synthetic_run["cams_file"]),
+        [str(templates["icon"])],
+        [str(templates["bcon"])],
+        str(synthetic_run["metDir"]),
+        str(synthetic_run["ctmDir"]),
+        [synthetic_run["grid"]],
+        [synthetic_run["mcipsuffix"]],
+        True,
+        timeResolvedBCs=timeResolvedBCs,
+    )
@@ -0,0 +1,39 @@
+"""Benchmarks of averaging WRF output files (as check_wrfout_in_background.py does)
+
+Run with
+
+    make benchmark
+
+or pytest tests/benchmarks --benchmark-only (see conftest.py for the
+options that set the sizes of the synthetic grids).
+"""
+
+import netCDF4
+
+from setup_runs.wrf.average_fields import average_fields, average_variable
+
+
+def test_001_average_fields(measure, wrfout_file, tmp_path):
+    measure(
+        average_fields,
+        wrfout_file,
+        tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc",
+        "2022-07-22_00:00:00",
+    )
+
+
+def test_002_average_variables(measure, wrfout_file):
+    """Time the averaging alone (to an uncompressed, in-memory file)"""
+
+    def run():
+        with netCDF4.Dataset(wrfout_file) as src, netCDF4.Dataset(
+            "averaged.nc", "w", diskless=True
+        ) as trg:
+            for name, dim in src.dimensions.items():
+                trg.createDimension(name, 1 if name == "Time" else len(dim))
+            for name, var in src.variables.items():
+                if name != "Times":
+                    out = trg.createVariable(name, var.dtype, var.dimensions)
+                    average_variable(var, out)
+
+    measure(run)
@@ -0,0 +1,216 @@
+import netCDF4
+import numpy
+import pytest
+
+from setup_runs.wrf import average_fields as average_fields_module
+from setup_runs.wrf.average_fields import (
+    accumulator_dtype,
+    average_fields,
+    average_files,
+    needs_masking,
+    time_axis,
+)
+
+NTIME = 12
+
+
+def make_wrfout_file(path, ntime=NTIME):
+    rng = numpy.random.default_rng(0)
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.createDimension("Time", None)
+        nc.createDimension("DateStrLen", 19)
+        nc.createDimension("bottom_top", 4)
+        nc.createDimension("south_north", 5)
+        nc.createDimension("west_east", 6)
+        nc.TITLE = " OUTPUT FROM WRF V4.5 MODEL"
+        nc.DX = numpy.float32(10000.0)
+        Times = nc.createVariable("Times", "S1", ("Time", "DateStrLen"))
+        T = nc.createVariable(
+            "T", "f4", ("Time", "bottom_top", "south_north", "west_east")
+        )
+        T.units = "K"
+        T.stagger = ""
+        T2 = nc.createVariable("T2", "f4", ("Time", "south_north", "west_east"))
+        T2.units = "K"
+        ITIMESTEP = nc.createVariable("ITIMESTEP", "i4", ("Time",))
+        for itime in range(ntime):
+            time = "2022-07-22_00:{:02d}:00".format(5 * itime)
+            Times[itime] = numpy.array(list(time), dtype="S1")
+            T[itime] = rng.uniform(250.0, 310.0, size=(4, 5, 6))
+            T2[itime] = rng.uniform(250.0, 310.0, size=(5, 6))
+            ITIMESTEP[itime] = 30 * itime
+        nc.createVariable("HGT", "f4", ("south_north", "west_east"))[:] = numpy.arange(
+            30.0
+        ).reshape(5, 6)
+
+
+def test_001_average_fields(tmp_path):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    outFile = tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc"
+    make_wrfout_file(inFile)
+
+    average_fields(inFile, outFile, "2022-07-22_00:00:00")
+
+    with netCDF4.Dataset(inFile) as src, netCDF4.Dataset(outFile) as trg:
+        assert len(trg.dimensions["Time"]) == 1
+        assert trg.TITLE == src.TITLE
+        assert trg.DX == src.DX
+        assert set(trg.variables) == set(src.variables)
+        assert trg["T"].units == "K"
+        assert trg["T"].dtype == numpy.float32
+        assert trg["T"].filters()["zlib"]
+        assert netCDF4.chartostring(trg["Times"][:])[0] == "2022-07-22_00:00:00"
+        for name in ["T", "T2"]:
+            expected = src[name][:].mean(axis=0, keepdims=True)
+            numpy.testing.assert_allclose(trg[name][:], expected, rtol=1e-6)
+        assert trg["ITIMESTEP"][:].tolist() == [int(30 * (NTIME - 1) / 2)]
+        numpy.testing.assert_array_equal(trg["HGT"][:], src["HGT"][:])
+
+
+def test_002_average_fields_masked(tmp_path):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    outFile = tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc"
+    make_wrfout_file(inFile, ntime=3)
+    with netCDF4.Dataset(inFile, "a") as nc:
+        Q = nc.createVariable(
+            "Q", "f4", ("Time", "south_north", "west_east"), fill_value=-999.0
+        )
+        Q[:] = numpy.ones((3, 5, 6))
+        Q[0, 0, 0] = 4.0
+        Q[1, 0, 0] = numpy.ma.masked
+        Q[:, 1, 1] = numpy.ma.masked
+
+    average_fields(inFile, outFile, "2022-07-22_00:00:00")
+
+    with netCDF4.Dataset(outFile) as trg:
+        assert trg["Q"]._FillValue == -999.0
+        Q = trg["Q"][0]
+        assert Q[0, 0] == pytest.approx(2.5)
+        assert Q[1, 1] is numpy.ma.masked
+        assert Q[2, 2] == pytest.approx(1.0)
+
+
+def test_003_time_axis():
+    assert time_axis(("Time", "south_north")) == 0
+    assert time_axis(("south_north", "west_east")) is None
+    with pytest.raises(RuntimeError):
+        time_axis(("Time", "Time"), "T")
+
+
+def test_004_accumulator_dtype():
+    assert accumulator_dtype(numpy.dtype("f4"), 12) == numpy.float32
+    assert accumulator_dtype(numpy.dtype("f4"), 1000) == numpy.float64
+    assert accumulator_dtype(numpy.dtype("f8"), 12) == numpy.float64
+    assert accumulator_dtype(numpy.dtype("i4"), 12) == numpy.float64
+
+
+def test_005_needs_masking(tmp_path):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    make_wrfout_file(inFile, ntime=1)
+    with netCDF4.Dataset(inFile, "a") as nc:
+        nc.createVariable("Q", "f4", ("Time",), fill_value=-999.0)
+        assert needs_masking(nc["Q"])
+        assert not needs_masking(nc["T"])
+        nc["T"].scale_factor = 2.0
+        assert needs_masking(nc["T"])
+
+
+@pytest.mark.parametrize("unselected", ["drop", "first"])
+def test_006_average_selected_fields(tmp_path, unselected):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    outFile = tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc"
+    make_wrfout_file(inFile)
+
+    average_fields(
+        inFile,
+        outFile,
+        "2022-07-22_00:00:00",
+        variables={"T2", "HGT"},
+        unselected=unselected,
+    )
+
+    with netCDF4.Dataset(inFile) as src, netCDF4.Dataset(outFile) as trg:
+        numpy.testing.assert_allclose(
+            trg["T2"][:], src["T2"][:].mean(axis=0, keepdims=True), rtol=1e-6
+        )
+        numpy.testing.assert_array_equal(trg["HGT"][:], src["HGT"][:])
+        if unselected == "drop":
+            assert set(trg.variables) == {"Times", "T2", "HGT"}
+        else:
+            assert set(trg.variables) == set(src.variables)
+            numpy.testing.assert_array_equal(trg["T"][:], src["T"][:1])
+            assert trg["ITIMESTEP"][:].tolist() == [0]
+
+
+def test_007_average_fields_unselected_error(tmp_path):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    make_wrfout_file(inFile, ntime=1)
+    with pytest.raises(ValueError):
+        average_fields(inFile, tmp_path / "out.nc", "x", unselected="keep")
+
+
+def test_008_average_files(tmp_path, monkeypatch):
+    calls = []
+    build_schema = average_fields_module.build_schema
+
+    def counting_build_schema(*args, **kwargs):
+        calls.append(args[0].filepath())
+        return build_schema(*args, **kwargs)
+
+    monkeypatch.setattr(average_fields_module, "build_schema", counting_build_schema)
+    jobs = []
+    for hour in range(3):
+        inFile = tmp_path / "wrfout_d01_2022-07-22_{:02d}:00:00".format(hour)
+        make_wrfout_file(inFile, ntime=2)
+        jobs.append(
+            (
+                inFile,
+                tmp_path / "WRFOUT_d01_2022-07-22T{:02d}00Z.nc".format(hour),
+                "2022-07-22_{:02d}:00:00".format(hour),
+            )
+        )
+    ## a file with a different structure gets its own schema
+    with netCDF4.Dataset(jobs[2][0], "a") as nc:
+        nc.createVariable("Q2", "f4", ("Time", "south_north", "west_east"))[:] = 1.0
+
+    schemas = {}
+    average_files(jobs, schemas=schemas)
+
+    assert calls == [str(jobs[0][0]), str(jobs[2][0])]
+    assert len(schemas) == 2
+    for inFile, outFile, outputTime in jobs:
+        with netCDF4.Dataset(inFile) as src, netCDF4.Dataset(outFile) as trg:
+            assert netCDF4.chartostring(trg["Times"][:])[0] == outputTime
+            assert set(trg.variables) == set(src.variables)
+            assert trg["T"].units == "K"
+            numpy.testing.assert_allclose(
+                trg["T"][:], src["T"][:].mean(axis=0, keepdims=True), rtol=1e-6
+            )
+
+    ## a different selection of variables gets its own schema
+    average_files(jobs[:1], variables={"T2"}, schemas=schemas)
+    assert len(schemas) == 3
+    with netCDF4.Dataset(jobs[0][1]) as trg:
+        assert set(trg.variables) == {"Times", "T2"}
+
+
+def test_009_average_fields_global_attributes(tmp_path):
+    inFile = tmp_path / "wrfout_d01_2022-07-22_00:00:00"
+    outFile = tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc"
+    make_wrfout_file(inFile)
+    with netCDF4.Dataset(inFile, "a") as nc:
+        nc.SIMULATION_START_DATE = "2022-07-21_18:00:00"
+
+    average_fields(
+        inFile,
+        outFile,
+        "2022-07-22_00:00:00",
+        globalAttributes={"SIMULATION_START_DATE": "2022-07-22_00:00:00"},
+    )
+
+    with netCDF4.Dataset(outFile) as trg:
+        assert trg.SIMULATION_START_DATE == "2022-07-22_00:00:00"
+        assert trg.TITLE == " OUTPUT FROM WRF V4.5 MODEL"
+    ## the input file is left alone
+    with netCDF4.Dataset(inFile) as src:
+        assert src.SIMULATION_START_DATE == "2022-07-21_18:00:00"
@@ -0,0 +1,436 @@
+import datetime
+
+import netCDF4
+import numpy
+import pytest
+
+from setup_runs.cmaq.cams import (
+    extract_and_interpolate_boundary,
+    extract_and_interpolate_interior,
+    getCAMSVerticalWeights,
+    match_two_sorted_arrays,
+    moleMass,
+    write_ic_bc_file,
+)
+from setup_runs.cmaq.cams_reader import CAMSReader
+from setup_runs.cmaq.cams_regrid import (
+    bilinear_weights,
+    boundary_to_interior_indices,
+    cams_window,
+    conservative_weights,
+    grid_fingerprint,
+    interpolate_vertically,
+    map_columns,
+    load_or_compute_weights,
+    nearest_cams_indices,
+    vertical_interpolation_weights,
+)
+from setup_runs.time_axis import linear_interpolation_weights
+from setup_runs.utils import getDistanceFromLatLonInKm
+
+
+def _brute_force_nearest(lat, lon, latmz, lonmz):
+    LONMZ, LATMZ = numpy.meshgrid(lonmz, latmz)
+    near = numpy.zeros(lat.shape + (2,), dtype=int)
+    for idx in numpy.ndindex(lat.shape):
+        dists = getDistanceFromLatLonInKm(lat[idx], lon[idx], LATMZ, LONMZ)
+        near[idx] = numpy.unravel_index(numpy.argmin(dists), LATMZ.shape)
+    return near
+
+
+@pytest.mark.parametrize(
+    "latmz, lonmz",
+    [
+        pytest.param(
+            numpy.arange(90.0, -90.1, -0.75),
+            numpy.arange(0.0, 360.0, 0.75),
+            id="EAC4 grid",
+        ),
+        pytest.param(
+            numpy.arange(-90.0, 90.1, 1.0),
+            numpy.arange(-180.0, 180.0, 1.0),
+            id="ascending latitudes, -180 to 180",
+        ),
+    ],
+)
+def test_001_nearest_cams_indices(latmz, lonmz):
+    rng = numpy.random.default_rng(42)
+    lat = rng.uniform(-89.0, 89.0, size=(7, 9))
+    lon = rng.uniform(-180.0, 180.0, size=(7, 9))
+    # include points on the grid-points, at the midpoints and across the wrap
+    lat[0, :4] = [latmz[3], 0.5 * (latmz[3] + latmz[4]), -30.0, 45.0]
+    lon[0, :4] = [lonmz[5], 0.5 * (lonmz[5] + lonmz[6]), 179.9, -0.2]
+
+    near = nearest_cams_indices(lat, lon, latmz, lonmz)
+
+    assert near.shape == (7, 9, 2)
+    numpy.testing.assert_array_equal(near, _brute_force_nearest(lat, lon, latmz, lonmz))
+
+
+@pytest.fixture
+def cams_file(tmp_path):
+    rng = numpy.random.default_rng(0)
+    with netCDF4.Dataset(tmp_path / "cams.nc", "w") as nc:
+        nc.createDimension("time", 3)
+        nc.createDimension("level", 6)
+        nc.createDimension("latitude", 11)
+        nc.createDimension("longitude", 13)
+        nc.createVariable("time", "i4", ("time",))[:] = 1074288 + 3 * numpy.arange(3)
+        nc.createVariable("level", "f4", ("level",))[:] = [1, 10, 100, 500, 850, 1000]
+        nc.createVariable("latitude", "f4", ("latitude",))[:] = numpy.linspace(
+            -10, -40, 11
+        )
+        nc.createVariable("longitude", "f4", ("longitude",))[:] = numpy.linspace(
+            110, 160, 13
+        )
+        var = nc.createVariable(
+            "ch4_c", "f4", ("time", "level", "latitude", "longitude")
+        )
+        var[:] = rng.uniform(8e-7, 1.2e-6, size=(3, 6, 11, 13))
+    with netCDF4.Dataset(tmp_path / "cams.nc") as nc:
+        yield nc
+
+
+@pytest.fixture
+def cams_reader(cams_file):
+    with CAMSReader(cams_file.filepath(), maxCachedRecords=2) as reader:
+        yield reader
+
+
+def test_002_extract_and_interpolate_interior(cams_file, cams_reader):
+    rng = numpy.random.default_rng(1)
+    LON = numpy.zeros((5, 7))
+    lens = {"LAY": 4}
+    Iz = numpy.array([5, 5, 3, 0])
+    near_interior = numpy.stack(
+        [rng.integers(0, 11, size=LON.shape), rng.integers(0, 13, size=LON.shape)],
+        axis=-1,
+    )
+
+    out = extract_and_interpolate_interior(
+        "ch4_c", cams_reader, lens, LON, Iz, 1, near_interior
+    )
+
+    varin = cams_file["ch4_c"][1] * moleMass["air"] / moleMass["ch4_c"] * 1e6
+    expected = numpy.zeros(out.shape, dtype=numpy.float32)
+    for irow in range(LON.shape[0]):
+        for icol in range(LON.shape[1]):
+            ix, iy = near_interior[irow, icol, :]
+            expected[:, irow, icol] = varin[Iz, ix, iy]
+
+    assert out.dtype == numpy.float32
+    numpy.testing.assert_array_equal(out, expected)
+
+
+def test_003_extract_and_interpolate_boundary(cams_file, cams_reader):
+    rng = numpy.random.default_rng(2)
+    LONP = numpy.zeros(24)
+    lens = {"LAY": 4}
+    Iz = numpy.array([5, 4, 2, 1])
+    near_boundary = numpy.stack(
+        [rng.integers(0, 11, size=LONP.shape), rng.integers(0, 13, size=LONP.shape)],
+        axis=-1,
+    )
+
+    out = extract_and_interpolate_boundary(
+        "ch4_c", cams_reader, lens, LONP, Iz, [2, 2], near_boundary
+    )
+
+    varin = cams_file["ch4_c"][2] * moleMass["air"] / moleMass["ch4_c"] * 1e6
+    expected = numpy.zeros(out.shape, dtype=numpy.float32)
+    for iperim in range(LONP.shape[0]):
+        ix, iy = near_boundary[iperim, :]
+        expected[0, :, iperim] = varin[Iz, ix, iy]
+
+    assert out.dtype == numpy.float32
+    assert out.shape == (1, 4, 24)
+    numpy.testing.assert_array_equal(out, expected)
+
+
+def test_004_load_or_compute_weights(tmp_path):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return {"near_interior": numpy.arange(6).reshape(3, 2)}
+
+    fingerprint = grid_fingerprint("GRIDDESC", numpy.arange(3.0))
+    first = load_or_compute_weights(tmp_path, fingerprint, compute)
+    second = load_or_compute_weights(tmp_path, fingerprint, compute)
+
+    assert len(calls) == 1
+    numpy.testing.assert_array_equal(first["near_interior"], second["near_interior"])
+    assert fingerprint != grid_fingerprint("GRIDDESC", numpy.arange(4.0))
+
+
+def test_005_bilinear_weights():
+    latmz = numpy.arange(90.0, -90.1, -0.75)
+    lonmz = numpy.arange(0.0, 360.0, 0.75)
+    lat = numpy.array([[-25.1, -30.3], [10.0, 0.2]])
+    lon = numpy.array([[135.2, -179.8], [359.9, 0.1]])
+
+    weights = bilinear_weights(lat, lon, latmz, lonmz)
+
+    assert weights.shape == (4, len(latmz) * len(lonmz))
+    numpy.testing.assert_allclose(weights.sum(axis=1), 1.0)
+    # a field that is linear in latitude is reproduced exactly
+    field = numpy.broadcast_to(latmz[:, numpy.newaxis], (len(latmz), len(lonmz)))
+    out = map_columns(field[numpy.newaxis], [0], weights)
+    numpy.testing.assert_allclose(out[0], lat.ravel())
+
+
+def test_006_conservative_weights():
+    latmz = numpy.arange(90.0, -90.1, -0.75)
+    lonmz = numpy.arange(0.0, 360.0, 0.75)
+    lat = numpy.array([-25.1, -30.3, 10.0, 0.0])
+    lon = numpy.array([135.2, -179.8, 359.9, 0.1])
+
+    weights = conservative_weights(lat, lon, 0.05, 1.0, latmz, lonmz)
+
+    numpy.testing.assert_allclose(weights.sum(axis=1), 1.0)
+    # a 2 degree wide cell straddling the prime meridian overlaps 3 CAMS
+    # cells in longitude, in proportion to the length of the overlap
+    row = weights[3].toarray().reshape(len(latmz), len(lonmz))
+    numpy.testing.assert_allclose(
+        row.sum(axis=0)[[478, 479, 0, 1, 2]], [0.0, 0.2625, 0.375, 0.3625, 0.0]
+    )
+
+
+def test_007_match_two_sorted_arrays():
+    rng = numpy.random.default_rng(3)
+    arr1 = numpy.sort(rng.uniform(0, 100, size=25))
+    arr2 = numpy.concatenate([rng.uniform(-10, 110, size=40), arr1[[0, 5]]])
+
+    expected = [numpy.argmin(numpy.abs(arr1 - v)) for v in arr2]
+
+    numpy.testing.assert_array_equal(match_two_sorted_arrays(arr1, arr2), expected)
+
+
+def test_008_vertical_interpolation_weights():
+    levels = numpy.array([1, 10, 100, 500, 850, 1000]) * 100.0
+    sigma = numpy.array([1.0, 0.99, 0.9, 0.5, 0.1, 0.0])
+    mtop = 5000.0
+    PSURF = numpy.array([[[101000.0, 90000.0]], [[100000.0, 80000.0]]])
+
+    Iz, wz = vertical_interpolation_weights(PSURF, sigma, mtop, levels)
+
+    assert Iz.shape == (2, 5, 1, 2)
+    assert Iz.dtype == numpy.int16
+    # a field that is linear in log(pressure) is reproduced exactly
+    columns = numpy.log(levels)[:, numpy.newaxis, numpy.newaxis]
+    out = interpolate_vertically(columns[numpy.newaxis], Iz, wz, axis=1)
+    edges = (PSURF[:, numpy.newaxis] - mtop) * sigma[:, numpy.newaxis, numpy.newaxis]
+    expected = numpy.log((edges[:, 1:] + edges[:, :-1]) / 2.0 + mtop)
+    # except for the layer below the lowest CAMS level, which is constant
+    expected[0, 0, 0, 0] = numpy.log(levels[-1])
+    numpy.testing.assert_allclose(out, expected, rtol=1e-6)
+
+
+def test_009_boundary_to_interior_indices():
+    irow, icol = boundary_to_interior_indices(3, 4)
+
+    assert len(irow) == 2 * (3 + 4 + 2)
+    # the southern edge comes first and the western edge last
+    assert (irow[0], icol[0]) == (0, 0)
+    assert (irow[5], icol[5]) == (0, 3)
+    assert (irow[-1], icol[-1]) == (2, 0)
+
+
+def test_010_time_resolved_boundary(cams_reader):
+    rng = numpy.random.default_rng(4)
+    LONP = numpy.zeros(24)
+    lens = {"LAY": 4}
+    near_boundary = numpy.stack(
+        [rng.integers(0, 11, size=LONP.shape), rng.integers(0, 13, size=LONP.shape)],
+        axis=-1,
+    )
+    start = datetime.datetime(2022, 7, 22)
+    recordTimes = [start + datetime.timedelta(hours=3 * i) for i in range(3)]
+    times = [start + datetime.timedelta(hours=i) for i in range(1, 8)]
+    Iz = numpy.broadcast_to(numpy.array([5, 4, 2, 1])[:, numpy.newaxis], (7, 4, 24))
+    wz = numpy.full(Iz.shape, 0.25, dtype=numpy.float32)
+
+    i0, i1, wt = linear_interpolation_weights(times, recordTimes)
+    out = extract_and_interpolate_boundary(
+        "ch4_c", cams_reader, lens, LONP, Iz, [0], near_boundary, wz, (i0, i1, wt)
+    )
+
+    numpy.testing.assert_array_equal(i0, [0, 0, 1, 1, 1, 2, 2])
+    numpy.testing.assert_allclose(wt, [1 / 3, 2 / 3, 0, 1 / 3, 2 / 3, 0, 0])
+    assert out.shape == (7, 4, 24)
+    for itime in range(len(times)):
+        single = extract_and_interpolate_boundary(
+            "ch4_c",
+            cams_reader,
+            lens,
+            LONP,
+            Iz[itime],
+            [i0[itime]],
+            near_boundary,
+            wz[itime],
+        )
+        later = extract_and_interpolate_boundary(
+            "ch4_c",
+            cams_reader,
+            lens,
+            LONP,
+            Iz[itime],
+            [i1[itime]],
+            near_boundary,
+            wz[itime],
+        )
+        expected = single * (1 - wt[itime]) + later * wt[itime]
+        numpy.testing.assert_allclose(out[itime], expected[0], rtol=1e-6)
+
+
+def test_011_cams_reader_cache(cams_file, cams_reader):
+    assert cams_reader.times[0] == numpy.datetime64("2022-07-22T00:00:00")
+    numpy.testing.assert_array_equal(cams_reader.level, cams_file["level"][:])
+
+    both = cams_reader.read("ch4_c", [0, 1])
+    first = cams_reader.read("ch4_c", 0)
+
+    numpy.testing.assert_array_equal(both, cams_file["ch4_c"][0:2])
+    # records are served from the cache, and cannot be modified in place
+    assert first is cams_reader.read("ch4_c", 0)
+    assert not first.flags.writeable
+    # the least recently used record is dropped once the cache is full
+    cams_reader.read("ch4_c", 2)
+    assert set(cams_reader._cache) == {("ch4_c", 0), ("ch4_c", 2)}
+    assert "ch4_c" in cams_reader and "co" not in cams_reader
+
+
+def test_012_cams_window():
+    latmz = numpy.arange(90.0, -90.1, -0.75)
+    lonmz = numpy.arange(0.0, 360.0, 0.75)
+    lat = numpy.array([-10.2, -44.0])
+    lon = numpy.array([108.0, 160.1])
+
+    latSlice, lonSlice = cams_window(lat, lon, latmz, lonmz, halo=2)
+
+    assert latmz[latSlice][0] >= -10.2 + 0.75 * 2 and latmz[latSlice][-1] <= -44.0 - 1.5
+    assert lonmz[lonSlice][0] <= 108.0 - 1.5 and lonmz[lonSlice][-1] >= 160.1 + 1.5
+    assert len(lonmz[lonSlice]) < 80
+    # the nearest grid-points are the same within the window
+    near = nearest_cams_indices(lat, lon, latmz[latSlice], lonmz[lonSlice])
+    numpy.testing.assert_array_equal(
+        near + [latSlice.start, lonSlice.start],
+        nearest_cams_indices(lat, lon, latmz, lonmz),
+    )
+    # a box crossing the first CAMS longitude uses all the longitudes
+    _, lonSlice = cams_window(lat, [-2.0, 3.0], latmz, lonmz)
+    assert lonSlice == slice(0, len(lonmz))
+
+
+def test_013_cams_reader_window(cams_file, cams_reader):
+    cams_reader.restrict_to([-20.0, -25.0], [130.0, 140.0], halo=1)
+
+    numpy.testing.assert_array_equal(cams_reader.latitude, cams_file["latitude"][2:8])
+    numpy.testing.assert_array_equal(
+        cams_reader.longitude, cams_file["longitude"][3:10]
+    )
+    numpy.testing.assert_array_equal(
+        cams_reader.read("ch4_c", 1), cams_file["ch4_c"][1, :, 2:8, 3:10]
+    )
+
+
+def make_bcon_template(path, ntime=1, format="NETCDF3_64BIT_OFFSET", **storage):
+    with netCDF4.Dataset(path, "w", format=format) as nc:
+        nc.setncattr("VAR-LIST", "{:16}{:16}".format("O3", "CH4"))
+        nc.NVARS = numpy.int32(2)
+        nc.SDATE = numpy.int32(2022203)
+        nc.STIME = numpy.int32(0)
+        nc.TSTEP = numpy.int32(0 if ntime == 1 else 10000)
+        for name, size in [("TSTEP", None), ("DATE-TIME", 2), ("LAY", 3)]:
+            nc.createDimension(name, size)
+        nc.createDimension("VAR", 2)
+        nc.createDimension("PERIM", 8)
+        nc.createVariable("TFLAG", "i4", ("TSTEP", "VAR", "DATE-TIME"))[:] = [
+            [[2022203, 10000 * itime]] * 2 for itime in range(ntime)
+        ]
+        for spec in ["O3", "CH4"]:
+            var = nc.createVariable(spec, "f4", ("TSTEP", "LAY", "PERIM"), **storage)
+            var.units = "{:16}".format("ppmV")
+            var[:] = 0.03
+
+
+def test_014_write_ic_bc_file(tmp_path):
+    template = tmp_path / "template_bcon.nc"
+    make_bcon_template(template)
+    fields = {
+        "CH4": numpy.full((3, 3, 8), 1.9, dtype=numpy.float32),
+        "CO": numpy.full((3, 3, 8), 0.1, dtype=numpy.float32),
+    }
+    TFLAG = numpy.array([[2022203, 0], [2022203, 10000], [2022203, 20000]])
+
+    with pytest.warns(UserWarning, match="Species CO was not found"):
+        write_ic_bc_file(template, tmp_path / "BCON.nc", fields, "O3", TFLAG, 10000)
+
+    with netCDF4.Dataset(tmp_path / "BCON.nc") as nc:
+        assert nc.data_model == "NETCDF4"
+        assert nc.NVARS == 3 and nc.getncattr("VAR-LIST").split() == ["O3", "CH4", "CO"]
+        assert (nc.SDATE, nc.STIME, nc.TSTEP) == (2022203, 0, 10000)
+        numpy.testing.assert_array_equal(nc["TFLAG"][:, 2], TFLAG)
+        numpy.testing.assert_allclose(nc["O3"][:], 0.03)
+        numpy.testing.assert_array_equal(nc["CH4"][:], fields["CH4"])
+        numpy.testing.assert_array_equal(nc["CO"][:], fields["CO"])
+        assert nc["CO"].chunking() == [1, 1, 8]
+        assert nc["CO"].filters()["zlib"]
+
+
+def test_015_vertical_weights_for_ICs_and_BCs():
+    levels = numpy.array([1, 10, 100, 500, 850, 1000]) * 100.0
+    sigma = numpy.array([1.0, 0.99, 0.9, 0.5, 0.1, 0.0])
+    PSURF = numpy.linspace(80000.0, 101000.0, 4 * 3 * 4).reshape(4, 3, 4)
+
+    weights = getCAMSVerticalWeights(PSURF, sigma, 5000.0, levels, 1)
+
+    # the ICs (and time-invariant BCs) only need the first time step
+    assert weights["Iz_interior"].shape == (5, 3, 4)
+    assert weights["wz_interior"].shape == (5, 3, 4)
+    assert weights["Iz_boundary"].shape == (5, 2 * (3 + 4 + 2))
+    Iz, wz = vertical_interpolation_weights(PSURF[:1], sigma, 5000.0, levels)
+    numpy.testing.assert_array_equal(weights["Iz_interior"], Iz[0])
+    numpy.testing.assert_array_equal(weights["wz_interior"], wz[0])
+
+    # the BCs only need every step when they are time-resolved
+    weights = getCAMSVerticalWeights(PSURF, sigma, 5000.0, levels, 1, allSteps=True)
+    assert weights["Iz_boundary"].shape == (4, 5, 2 * (3 + 4 + 2))
+    numpy.testing.assert_array_equal(weights["Iz_interior"], Iz[0])
+
+    # nothing is calculated for the ICs when only the BCs are written
+    weights = getCAMSVerticalWeights(PSURF, sigma, 5000.0, levels, 1, interior=False)
+    assert set(weights) == {"Iz_boundary", "wz_boundary"}
+
+
+def test_016_write_ic_bc_file_keeps_template(tmp_path):
+    template = tmp_path / "template_bcon.nc"
+    make_bcon_template(template, ntime=2)
+    fields = {"CH4": numpy.full((1, 3, 8), 1.9, dtype=numpy.float32)}
+
+    write_ic_bc_file(template, tmp_path / "BCON.nc", fields, "O3")
+
+    # the snapshot is repeated for each time step of the template, in its format
+    with netCDF4.Dataset(template) as tmp, netCDF4.Dataset(tmp_path / "BCON.nc") as nc:
+        assert nc.data_model == "NETCDF3_64BIT_OFFSET"
+        assert len(nc.dimensions["TSTEP"]) == 2
+        assert (nc.SDATE, nc.STIME, nc.TSTEP) == (2022203, 0, 10000)
+        numpy.testing.assert_array_equal(nc["TFLAG"][:], tmp["TFLAG"][:])
+        numpy.testing.assert_allclose(nc["O3"][:], 0.03)
+        numpy.testing.assert_array_equal(nc["CH4"][:], fields["CH4"][[0, 0]])
+
+    # as is the chunking and compression of a netCDF4 template
+    make_bcon_template(
+        template, ntime=2, format="NETCDF4", chunksizes=[1, 3, 4], zlib=True
+    )
+    fields["CO"] = numpy.full((1, 3, 8), 0.1, dtype=numpy.float32)
+    with pytest.warns(UserWarning, match="Species CO was not found"):
+        write_ic_bc_file(template, tmp_path / "BCON.nc", fields, "O3")
+
+    with netCDF4.Dataset(tmp_path / "BCON.nc") as nc:
+        assert nc.data_model == "NETCDF4"
+        for spec in ["O3", "CH4", "CO"]:
+            assert nc[spec].chunking() == [1, 3, 4]
+            assert nc[spec].filters()["zlib"]
+        numpy.testing.assert_array_equal(nc["CO"][:], fields["CO"][[0, 0]])
+        numpy.testing.assert_array_equal(nc["TFLAG"][:, 2], nc["TFLAG"][:, 0])
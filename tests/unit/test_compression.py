@@ -0,0 +1,104 @@
+import os
+
+import netCDF4
+import numpy
+import pytest
+
+from setup_runs.compression import compress_nc_file, compress_nc_files
+
+
+def make_netcdf3_file(path):
+    rng = numpy.random.default_rng(0)
+    with netCDF4.Dataset(path, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+        nc.createDimension("TSTEP", None)
+        nc.createDimension("DATE-TIME", 2)
+        nc.createDimension("ROW", 5)
+        nc.createDimension("COL", 7)
+        nc.EXEC_ID = "{:80}".format("test")
+        nc.VGLVLS = numpy.array([1.0, 0.5, 0.0], dtype="f4")
+        TFLAG = nc.createVariable("TFLAG", "i4", ("TSTEP", "DATE-TIME"))
+        TFLAG.units = "<YYYYDDD,HHMMSS>"
+        TA = nc.createVariable("TA", "f4", ("TSTEP", "ROW", "COL"), fill_value=-9999.0)
+        TA.units = "K"
+        for itime in range(3):
+            TFLAG[itime] = [2022203, 10000 * itime]
+            TA[itime] = rng.uniform(250.0, 310.0, size=(5, 7))
+        TA[2, 0, 0] = numpy.ma.masked
+        nc.createVariable("HT", "f8", ("ROW", "COL"))[:] = numpy.arange(35.0).reshape(
+            5, 7
+        )
+        nc.createVariable("NTHIK", "i4", ())[...] = 1
+
+
+def read_all(path):
+    with netCDF4.Dataset(path) as nc:
+        nc.set_auto_maskandscale(False)
+        return (
+            {k: nc.getncattr(k) for k in nc.ncattrs()},
+            {
+                name: (var.dimensions, var[...], var.__dict__)
+                for name, var in nc.variables.items()
+            },
+        )
+
+
+def test_001_compress_nc_file(tmp_path):
+    path = tmp_path / "METCRO2D_test"
+    make_netcdf3_file(path)
+    attrs, variables = read_all(path)
+
+    compress_nc_file(path)
+
+    assert os.listdir(tmp_path) == ["METCRO2D_test"]
+    with netCDF4.Dataset(path) as nc:
+        assert nc.data_model == "NETCDF4"
+        assert nc.dimensions["TSTEP"].isunlimited()
+        assert nc["TA"].filters()["zlib"]
+        assert nc["TA"].filters()["shuffle"]
+        assert nc["TA"].chunking() == [1, 5, 7]
+        assert nc["NTHIK"].chunking() == "contiguous"
+    newAttrs, newVariables = read_all(path)
+    assert newAttrs.keys() == attrs.keys()
+    numpy.testing.assert_array_equal(newAttrs["VGLVLS"], attrs["VGLVLS"])
+    for name, (dims, values, varAttrs) in variables.items():
+        assert newVariables[name][0] == dims
+        numpy.testing.assert_array_equal(newVariables[name][1], values)
+        assert newVariables[name][2].keys() == varAttrs.keys()
+
+
+def test_002_compress_nc_file_ppc(tmp_path):
+    path = tmp_path / "METCRO2D_test"
+    make_netcdf3_file(path)
+    _, variables = read_all(path)
+
+    compress_nc_file(path, complevel=9, ppc=3, chunking={"ROW": 2})
+
+    with netCDF4.Dataset(path) as nc:
+        assert nc["TA"].filters()["complevel"] == 9
+        assert nc["TA"].chunking() == [1, 2, 7]
+        TA = nc["TA"][:]
+        ## the fill value is kept, and integers are not quantized
+        assert TA.mask[2, 0, 0]
+        numpy.testing.assert_array_equal(nc["TFLAG"][:], variables["TFLAG"][1])
+    numpy.testing.assert_allclose(TA[:2], variables["TA"][1][:2], rtol=1e-3)
+
+    with pytest.raises(RuntimeError, match="ppc"):
+        compress_nc_file(path, ppc=7)
+
+
+def test_003_compress_nc_files(tmp_path):
+    paths = [tmp_path / "METCRO2D_{}".format(i) for i in range(3)]
+    for path in paths:
+        make_netcdf3_file(path)
+    (tmp_path / "GRIDCRO2D_broken").write_text("not a netCDF file")
+
+    compress_nc_files(paths, max_workers=2)
+    for path in paths:
+        with netCDF4.Dataset(path) as nc:
+            assert nc.data_model == "NETCDF4"
+
+    ## a failure leaves the original file (and no temporary file) behind
+    with pytest.raises(OSError):
+        compress_nc_files([tmp_path / "GRIDCRO2D_broken"] + paths, max_workers=2)
+    assert (tmp_path / "GRIDCRO2D_broken").read_text() == "not a netCDF file"
+    assert len(os.listdir(tmp_path)) == 4
@@ -0,0 +1,52 @@
+import functools
+import logging
+
+from setup_runs.wrf.fair_pool import FairPool
+
+
+def record(path, item):
+    if item == "bad":
+        raise ValueError(item)
+    with open(path, "a") as f:
+        f.write(item + "\n")
+
+
+def test_001_fair_pool_order(tmp_path):
+    path = tmp_path / "order.txt"
+    with FairPool(functools.partial(record, path), max_workers=1) as pool:
+        for item, key in [("a1", "a"), ("a2", "a"), ("a3", "a"), ("b1", "b")]:
+            assert pool.submit(item, key=key)
+        ## at most max_in_flight items are handed to the workers
+        assert len(pool.running) == 1
+        assert pool.busy
+        pool.drain()
+        assert not pool.busy
+    assert path.read_text().split() == ["a1", "a2", "b1", "a3"]
+
+
+def test_002_fair_pool_no_duplicates(tmp_path):
+    path = tmp_path / "order.txt"
+    with FairPool(functools.partial(record, path), max_workers=2) as pool:
+        assert pool.submit("a1", key="a")
+        assert pool.submit("a2", key="a")
+        assert pool.submit("a3", key="a")
+        assert not pool.submit("a1", key="a")
+        assert not pool.submit("a3", key="a")
+        assert "a3" in pool
+        pool.drain()
+        assert "a3" not in pool
+        ## once finished, an item can be submitted again
+        assert pool.submit("a1", key="a")
+        pool.drain()
+    assert sorted(path.read_text().split()) == ["a1", "a1", "a2", "a3"]
+
+
+def test_003_fair_pool_errors(tmp_path, caplog):
+    path = tmp_path / "order.txt"
+    with caplog.at_level(logging.ERROR):
+        with FairPool(functools.partial(record, path), max_workers=2) as pool:
+            pool.submit("bad", key="a")
+            pool.submit("b1", key="b")
+            pool.drain()
+    assert path.read_text().split() == ["b1"]
+    assert "Error processing bad" in caplog.text
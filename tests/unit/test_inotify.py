@@ -0,0 +1,47 @@
+import os
+import struct
+
+import pytest
+
+from setup_runs.inotify import (
+    IN_CLOSE_WRITE,
+    IN_MOVED_TO,
+    Inotify,
+    inotify_available,
+    parse_events,
+)
+
+pytestmark = pytest.mark.skipif(
+    not inotify_available(), reason="inotify is not available"
+)
+
+
+def test_001_close_write_and_move(tmp_path):
+    with Inotify([str(tmp_path)]) as watcher:
+        assert watcher.read_events(timeout=0.01) == []
+
+        with open(tmp_path / "wrfout_d01", "w") as f:
+            f.write("data")
+        (tmp_path / "partial").write_text("data")
+        os.rename(tmp_path / "partial", tmp_path / "wrfout_d02")
+
+        events = watcher.read_events(timeout=1.0)
+
+    assert (str(tmp_path / "wrfout_d01"), IN_CLOSE_WRITE) in events
+    assert (str(tmp_path / "wrfout_d02"), IN_MOVED_TO) in events
+    assert watcher.fd == -1
+
+
+def test_002_errors(tmp_path):
+    with pytest.raises(OSError):
+        Inotify([str(tmp_path / "missing")])
+    (tmp_path / "file").write_text("")
+    with pytest.raises(OSError):
+        Inotify([str(tmp_path / "file")])
+
+
+def test_003_parse_events():
+    buffer = struct.pack("iIII", 1, IN_CLOSE_WRITE, 0, 16) + b"wrfout_d01".ljust(
+        16, b"\0"
+    )
+    assert parse_events(buffer) == [(1, IN_CLOSE_WRITE, "wrfout_d01")]
@@ -0,0 +1,218 @@
+import datetime
+import os
+import sys
+
+import netCDF4
+import numpy
+import pytest
+
+from setup_runs.cmaq.mcip import (
+    prepare_wrf_files,
+    runMCIP,
+    to_wrf_filename,
+    wrf_patches_needed,
+)
+
+
+def test_001_wrf_patches_needed(tmp_path):
+    path = tmp_path / "WRFOUT_d01_2022-07-22T0000Z.nc"
+    with netCDF4.Dataset(path, "w") as nc:
+        nc.SIMULATION_START_DATE = "2022-07-21_00:00:00"
+        nc.TRUELAT2 = numpy.float32(-40.0)
+
+    assert wrf_patches_needed(path) == set()
+    assert wrf_patches_needed(
+        path,
+        simulation_start_date="2022-07-22_00:00:00",
+        truelat2=-40.0,
+        add_qsnow=True,
+    ) == {"SIMULATION_START_DATE", "QSNOW"}
+    assert wrf_patches_needed(
+        path, simulation_start_date="2022-07-21_00:00:00", truelat2=-35.0
+    ) == {"TRUELAT2"}
+
+
+@pytest.fixture
+def wrf_files(tmp_path):
+    paths = []
+    for hour in range(3):
+        path = tmp_path / "WRFOUT_d01_2022-07-22T{:02d}00Z.nc".format(hour)
+        with netCDF4.Dataset(path, "w", format="NETCDF3_64BIT_OFFSET") as nc:
+            nc.createDimension("Time", None)
+            nc.createDimension("bottom_top", 4)
+            nc.createDimension("south_north", 3)
+            nc.createDimension("west_east", 2)
+            nc.SIMULATION_START_DATE = "2022-07-21_00:00:00"
+            nc.TRUELAT2 = numpy.float32(-40.0)
+            T = nc.createVariable(
+                "T", "f4", ("Time", "bottom_top", "south_north", "west_east")
+            )
+            T[0] = 300.0
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_002_prepare_wrf_files(wrf_files, max_workers):
+    patches = [
+        {"SIMULATION_START_DATE", "TRUELAT2", "QSNOW"},
+        set(),
+        {"QSNOW"},
+    ]
+
+    nfixed = prepare_wrf_files(
+        wrf_files,
+        patches,
+        simulation_start_date="2022-07-22_00:00:00",
+        truelat2=-35.0,
+        max_workers=max_workers,
+    )
+
+    assert nfixed == 2
+    with netCDF4.Dataset(wrf_files[0]) as nc:
+        assert nc.SIMULATION_START_DATE == "2022-07-22_00:00:00"
+        assert nc.TRUELAT2 == numpy.float32(-35.0)
+        numpy.testing.assert_array_equal(nc["QSNOW"][:], numpy.zeros((1, 4, 3, 2)))
+        numpy.testing.assert_array_equal(nc["T"][:], 300.0)
+    with netCDF4.Dataset(wrf_files[1]) as nc:
+        assert nc.SIMULATION_START_DATE == "2022-07-21_00:00:00"
+        assert "QSNOW" not in nc.variables
+    with netCDF4.Dataset(wrf_files[2]) as nc:
+        assert nc.TRUELAT2 == numpy.float32(-40.0)
+        assert "QSNOW" in nc.variables
+
+
+## a stand-in for run.mcip, which reports where it was asked to work,
+## counts how many times it has been run and writes empty output files
+fake_mcip_script = """#!/bin/sh
+OUTDIR='set OutDir     = TEMPLATE'
+WORKDIR='set WorkDir    = $OutDir'
+OUTDIR="${OUTDIR#set OutDir     = }"
+echo "$OUTDIR" "${WORKDIR#set WorkDir    = }"
+echo run >> "$OUTDIR/runs"
+for f in GRIDDESC GRIDBDY2D GRIDCRO2D GRIDDOT2D METBDY3D METCRO2D METCRO3D METDOT3D
+do
+    touch "$OUTDIR/${f}_test"
+done
+mv "$OUTDIR/GRIDDESC_test" "$OUTDIR/GRIDDESC"
+echo "NORMAL TERMINATION"
+"""
+
+## as fake_mcip_script, but writing (empty) netCDF files, which can be compressed
+fake_mcip_netcdf_script = fake_mcip_script.replace(
+    'touch "$OUTDIR/${f}_test"',
+    "{} -c \"import netCDF4, sys; netCDF4.Dataset(sys.argv[1], 'w', format='NETCDF3_CLASSIC').close()\" "
+    '"$OUTDIR/${{f}}_test"'.format(sys.executable),
+)
+
+failing_mcip_script = """#!/bin/sh
+echo "ERROR: could not read WRF output"
+echo "bad file" >&2
+"""
+
+
+@pytest.fixture
+def wrf_dir(tmp_path):
+    dates = [datetime.datetime(2022, 7, 22), datetime.datetime(2022, 7, 23)]
+    for date in dates:
+        rundir = tmp_path / "wrf" / date.strftime("%Y%m%d%H")
+        rundir.mkdir(parents=True)
+        for hour in range(25):
+            time = date + datetime.timedelta(hours=hour)
+            with netCDF4.Dataset(rundir / to_wrf_filename("d01", time), "w") as nc:
+                nc.SIMULATION_START_DATE = date.strftime("%Y-%m-%d_%H:%M:%S")
+    (tmp_path / "geo_em.d01.nc").write_bytes(b"geo_em")
+    return tmp_path / "wrf", dates
+
+
+def run_fake_mcip(tmp_path, wrf_dir, script, max_workers, **kwargs):
+    wrfDir, dates = wrf_dir
+    kwargs.setdefault("compressWithNco", False)
+    runMCIP(
+        dates=dates,
+        domains=["d01"],
+        metDir=str(tmp_path / "mcip"),
+        wrfDir=str(wrfDir),
+        geoDir=str(tmp_path),
+        ProgDir=str(tmp_path),
+        APPL=["test"],
+        CoordName=["LamCon"],
+        GridName=["grid"],
+        scripts={"mcipRun": {"lines": script.splitlines(keepends=True)}},
+        max_workers=max_workers,
+        **kwargs,
+    )
+    return dates
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_003_runMCIP(tmp_path, wrf_dir, max_workers):
+    dates = run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, max_workers)
+
+    for date in dates:
+        mcipDir = tmp_path / "mcip" / date.strftime("%Y-%m-%d") / "d01"
+        log = (mcipDir / "run.mcip.d01.log").read_text().splitlines()
+        ## each job has a working directory of its own, which is removed
+        ## once MCIP has finished
+        assert log == ["{} {}/work".format(mcipDir, mcipDir), "NORMAL TERMINATION"]
+        assert not (mcipDir / "work").exists()
+        ## the staged WRF files are removed
+        assert not [f for f in os.listdir(mcipDir) if f.startswith("WRFOUT")]
+
+
+def test_004_runMCIP_failure(tmp_path, wrf_dir, capsys):
+    with pytest.raises(RuntimeError, match="Error from run.mcip"):
+        run_fake_mcip(tmp_path, wrf_dir, failing_mcip_script, 2)
+
+    assert "bad file" in capsys.readouterr().out
+
+
+def count_runs(tmp_path, dates):
+    return [
+        len(
+            (tmp_path / "mcip" / date.strftime("%Y-%m-%d") / "d01" / "runs")
+            .read_text()
+            .split()
+        )
+        for date in dates
+    ]
+
+
+@pytest.mark.parametrize("manifest_hash", [False, True])
+def test_005_runMCIP_manifest(tmp_path, wrf_dir, manifest_hash):
+    kwargs = dict(forceUpdate=False, manifest_hash=manifest_hash)
+    dates = run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, 1, **kwargs)
+    assert count_runs(tmp_path, dates) == [1, 1]
+
+    ## nothing has changed
+    run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, 1, **kwargs)
+    assert count_runs(tmp_path, dates) == [1, 1]
+
+    ## an input of the first date is touched, but not changed
+    wrfDir, _ = wrf_dir
+    wrfFile = next((wrfDir / dates[0].strftime("%Y%m%d%H")).iterdir())
+    os.utime(wrfFile, ns=(0, 0))
+    run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, 1, **kwargs)
+    assert count_runs(tmp_path, dates) == ([1, 1] if manifest_hash else [2, 1])
+
+    ## an output of the second date is removed
+    mcipDir = tmp_path / "mcip" / dates[1].strftime("%Y-%m-%d") / "d01"
+    (mcipDir / "METCRO3D_test").unlink()
+    run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, 1, **kwargs)
+    assert count_runs(tmp_path, dates) == ([1, 2] if manifest_hash else [2, 2])
+
+    ## the output is always remade if forceUpdate is set
+    run_fake_mcip(tmp_path, wrf_dir, fake_mcip_script, 1, forceUpdate=True)
+    assert count_runs(tmp_path, dates) == ([2, 3] if manifest_hash else [3, 3])
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_006_runMCIP_compression(tmp_path, wrf_dir, max_workers):
+    dates = run_fake_mcip(
+        tmp_path, wrf_dir, fake_mcip_netcdf_script, max_workers, compressWithNco=True
+    )
+
+    for date in dates:
+        mcipDir = tmp_path / "mcip" / date.strftime("%Y-%m-%d") / "d01"
+        with netCDF4.Dataset(mcipDir / "METCRO3D_test") as nc:
+            assert nc.data_model == "NETCDF4"
@@ -0,0 +1,91 @@
+import datetime
+import os
+
+import netCDF4
+import pytest
+
+from setup_runs.cmaq.mcip import to_wrf_filename
+from setup_runs.cmaq.pipeline import (
+    coordinate_cmaq_preprocessing,
+    count_staged_files,
+)
+from setup_runs.cmaq.read_config_cmaq import create_cmaq_config_object
+from setup_runs.config_read_functions import load_json
+from test_mcip import fake_mcip_netcdf_script
+
+DATES = [datetime.datetime(2022, 7, 22), datetime.datetime(2022, 7, 23)]
+
+
+def stage_wrf_files(wrfDir, date, hours=range(25)):
+    rundir = wrfDir / date.strftime("%Y%m%d%H")
+    rundir.mkdir(parents=True, exist_ok=True)
+    for hour in hours:
+        time = date + datetime.timedelta(hours=hour)
+        with netCDF4.Dataset(rundir / to_wrf_filename("d01", time), "w") as nc:
+            nc.SIMULATION_START_DATE = date.strftime("%Y-%m-%d_%H:%M:%S")
+
+
+@pytest.fixture
+def setup_cmaq(tmp_path):
+    ## the configuration (as a dictionary), running a fake MCIP on a single domain
+    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    config = load_json(os.path.join(root_dir, "config/cmaq/config.docker.json"))
+    (tmp_path / "geo_em.d01.nc").write_bytes(b"geo_em")
+    config.update(
+        domains=["d01"],
+        scenarioTag=["test"],
+        mapProjName=["LamCon"],
+        gridName=["grid"],
+        metDir=str(tmp_path / "mcip"),
+        wrfDir=str(tmp_path / "wrf"),
+        geoDir=str(tmp_path),
+        MCIPdir=str(tmp_path),
+        prepareICandBC="False",
+        streamFromWrf="True",
+        streamPollSeconds=0.05,
+    )
+    return config
+
+
+@pytest.fixture
+def scripts():
+    return {"mcipRun": {"lines": fake_mcip_netcdf_script.splitlines(keepends=True)}}
+
+
+def test_001_count_staged_files(tmp_path):
+    wrfDir = tmp_path / "wrf"
+    assert count_staged_files(wrfDir, DATES[0], "d01") == 0
+    stage_wrf_files(wrfDir, DATES[0], hours=range(24))
+    assert count_staged_files(wrfDir, DATES[0], "d01") == 24
+    stage_wrf_files(wrfDir, DATES[0], hours=[24])
+    assert count_staged_files(wrfDir, DATES[0], "d01") == 25
+    assert count_staged_files(wrfDir, DATES[0], "d02") == 0
+
+
+def test_002_coordinate_cmaq_preprocessing(tmp_path, setup_cmaq, scripts):
+    setup_cmaq = create_cmaq_config_object(setup_cmaq)
+    for date in DATES:
+        stage_wrf_files(tmp_path / "wrf", date)
+
+    coordinate_cmaq_preprocessing(setup_cmaq, DATES, scripts, max_workers=2)
+
+    for date in DATES:
+        mcipDir = tmp_path / "mcip" / date.strftime("%Y-%m-%d") / "d01"
+        assert (mcipDir / "runs").read_text().split() == ["run"]
+        assert (mcipDir / "GRIDDESC").exists()
+
+
+def test_003_coordinate_cmaq_preprocessing_timeout(tmp_path, setup_cmaq, scripts):
+    ## the second date is still missing its last hour
+    stage_wrf_files(tmp_path / "wrf", DATES[0])
+    stage_wrf_files(tmp_path / "wrf", DATES[1], hours=range(24))
+    setup_cmaq["streamIdleTimeoutHours"] = 0.5 / 3600.0
+    setup_cmaq = create_cmaq_config_object(setup_cmaq)
+
+    with pytest.raises(RuntimeError, match="still waiting for 2022-07-23 d01"):
+        coordinate_cmaq_preprocessing(setup_cmaq, DATES, scripts, max_workers=2)
+
+    ## the date whose output was all staged has been run
+    mcipDir = tmp_path / "mcip" / "2022-07-22" / "d01"
+    assert (mcipDir / "runs").read_text().split() == ["run"]
+    assert not (tmp_path / "mcip" / "2022-07-23" / "d01" / "runs").exists()
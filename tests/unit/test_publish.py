@@ -0,0 +1,26 @@
+import os
+
+from setup_runs.wrf.publish import publish_file
+
+
+def test_001_publish_file(tmp_path):
+    path = tmp_path / "WRFOUT_d01_2022-07-22T0100Z.nc"
+    path.write_bytes(b"averaged")
+    publishDir = tmp_path / "staging" / "2022072200"
+
+    published = publish_file(path, publishDir)
+
+    assert published == publishDir / path.name
+    assert published.read_bytes() == b"averaged"
+    ## no temporary files are left behind
+    assert os.listdir(publishDir) == [path.name]
+
+    ## publishing again replaces the published file
+    path.unlink()
+    path.write_bytes(b"averaged again")
+    publish_file(path, publishDir)
+    assert published.read_bytes() == b"averaged again"
+
+    ## publishing a file to its own directory leaves it alone
+    assert publish_file(published, publishDir) == published
+    assert published.read_bytes() == b"averaged again"
@@ -586,3 +586,21 @@ def test_021_validator_endDate_after_startDate_errors(
     assert (
         str(exc_info.value) == "End date must be after start date."
     ), f"{test_id} failed."
+
+
+@pytest.mark.parametrize(
+    "species_map, test_id",
+    [
+        ([{"CMspec": "CH4"}], "missing_MZspec"),
+        ([{"MZspec": "ch4_c", "CMspec": "CH4"}, {"MZspec": "co"}], "missing_CMspec"),
+    ],
+    ids=lambda test_id: test_id,
+)
+def test_022_CAMSSpeciesMap_validator_errors(species_map, test_id, cmaq_config_dict):
+    cmaq_config_dict["CAMSSpeciesMap"] = species_map
+
+    with pytest.raises(ValueError) as exc_info:
+        create_cmaq_config_object(cmaq_config_dict)
+    assert "must have the keys 'MZspec' and 'CMspec'" in str(
+        exc_info.value
+    ), f"{test_id} failed."
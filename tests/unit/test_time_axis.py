@@ -0,0 +1,75 @@
+import datetime
+
+import numpy
+import pytest
+
+from setup_runs.time_axis import (
+    decode_cf_time,
+    decode_tflag,
+    linear_interpolation_weights,
+    match_times,
+)
+
+
+def test_001_decode_tflag():
+    TFLAG = numpy.array([[2022203, 0], [2022203, 13045], [2024366, 235959]])
+
+    times = decode_tflag(TFLAG)
+
+    expected = [
+        datetime.datetime(2022, 7, 22, 0, 0, 0),
+        datetime.datetime(2022, 7, 22, 1, 30, 45),
+        datetime.datetime(2024, 12, 31, 23, 59, 59),
+    ]
+    numpy.testing.assert_array_equal(
+        times, numpy.array(expected, dtype="datetime64[s]")
+    )
+
+
+@pytest.mark.parametrize(
+    "values, units, expected",
+    [
+        pytest.param(
+            [1074288, 1074291],
+            "hours since 1900-01-01 00:00:00.0",
+            ["2022-07-22T00:00:00", "2022-07-22T03:00:00"],
+            id="CAMS hours since 1900",
+        ),
+        pytest.param(
+            [0, 2], "days since 2022-07-21", ["2022-07-21", "2022-07-23"], id="days"
+        ),
+    ],
+)
+def test_002_decode_cf_time(values, units, expected):
+    times = decode_cf_time(values, units)
+
+    numpy.testing.assert_array_equal(
+        times, numpy.array(expected, dtype="datetime64[s]")
+    )
+
+
+def test_003_decode_cf_time_unsupported_units():
+    with pytest.raises(ValueError, match="Unsupported time units"):
+        decode_cf_time([0], "months since 2022-01-01")
+
+
+def test_004_match_times():
+    recordTimes = numpy.array(
+        ["2022-07-22T00", "2022-07-22T03", "2022-07-22T06"], dtype="datetime64[s]"
+    )
+    times = numpy.array(
+        ["2022-07-22T00", "2022-07-22T02", "2022-07-22T03", "2022-07-23T00"],
+        dtype="datetime64[s]",
+    )
+
+    numpy.testing.assert_array_equal(match_times(times, recordTimes), [0, 0, 1, 2])
+    # times before all the records use the nearest record
+    with pytest.warns(UserWarning, match="using nearest match: 2022-07-22 00:00:00"):
+        irecord = match_times(
+            numpy.array(["2022-07-21T22"], "datetime64[s]"), recordTimes
+        )
+    numpy.testing.assert_array_equal(irecord, [0])
+
+    i0, i1, wt = linear_interpolation_weights(times, recordTimes)
+    numpy.testing.assert_array_equal(i1, [1, 1, 2, 2])
+    numpy.testing.assert_allclose(wt, [0.0, 2 / 3, 0.0, 0.0])
@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+from setup_runs.utils import stage_file
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "src.nc"
+    path.write_bytes(b"WRF output")
+    return path
+
+
+def test_001_stage_file_link(src, tmp_path):
+    dst = tmp_path / "dst.nc"
+
+    method = stage_file(src, dst)
+
+    assert method in ["hardlink", "reflink", "symlink", "copy"]
+    assert dst.read_bytes() == b"WRF output"
+    if method == "hardlink":
+        assert os.path.samefile(src, dst)
+
+
+def test_002_stage_file_writable(src, tmp_path):
+    dst = tmp_path / "dst.nc"
+    dst.write_bytes(b"an older file")
+
+    method = stage_file(src, dst, writable=True)
+
+    ## changes to the staged file must not reach the source
+    assert method in ["reflink", "copy"]
+    assert not dst.is_symlink()
+    with open(dst, "r+b") as f:
+        f.write(b"MCIP")
+    assert src.read_bytes() == b"WRF output"
+
+
+def test_003_stage_file_copy(src, tmp_path):
+    dst = tmp_path / "dst.nc"
+
+    assert stage_file(src, dst, mode="copy") == "copy"
+    assert not os.path.samefile(src, dst)
+    assert dst.read_bytes() == b"WRF output"
+
+    with pytest.raises(ValueError, match="Staging mode"):
+        stage_file(src, dst, mode="move")
@@ -0,0 +1,67 @@
+import pytest
+
+from setup_runs.wrf.variable_selection import (
+    mcipVariables,
+    read_iofields_file,
+    selected_variables,
+)
+
+
+def test_001_read_iofields_file(root_dir):
+    added, removed = read_iofields_file(
+        root_dir / "domains" / "aust-test" / "add_remove_var.txt"
+    )
+    assert {"P", "RA", "RMOL", "RS", "ZNT", "LANDUSEF"} <= added
+    assert {"ZS", "DZS", "ITIMESTEP", "XTIME"} <= removed
+    assert not added & removed
+
+
+def test_002_read_iofields_file_errors(tmp_path):
+    path = tmp_path / "iofields.txt"
+    path.write_text("+:h:0:U,V\n+:h:7:EXTRA\nbad line\n")
+    with pytest.raises(RuntimeError):
+        read_iofields_file(path)
+    path.write_text("# comment\n\n+:h:0:U, V\n+:h:7:EXTRA\n")
+    assert read_iofields_file(path) == ({"U", "V"}, set())
+
+
+def test_003_selected_variables(root_dir):
+    assert selected_variables() is None
+    assert selected_variables(variables=["T2"]) == {"Times", "T2"}
+    assert selected_variables(mcip=True) == mcipVariables
+    selection = selected_variables(
+        variables=["T2"],
+        iofieldsFile=root_dir / "domains" / "aust-test" / "add_remove_var.txt",
+    )
+    assert {"Times", "T2", "RMOL", "VEGF_PX"} <= selection
+    assert "ZS" not in selection
+
+
+def test_004_mcip_variables():
+    # the variables MCIP needs to run (P_TOP) or reads for the soil, land-use
+    # and precipitation fields, which must survive --mcip-variables
+    required = {
+        "Times",
+        "P_TOP",
+        "ZNU",
+        "ZNW",
+        "MU",
+        "MUB",
+        "PH",
+        "PHB",
+        "ZS",
+        "DZS",
+        "SMOIS",
+        "TSLB",
+        "LU_INDEX",
+        "IVGTYP",
+        "ISLTYP",
+        "RAINC",
+        "RAINNC",
+        "SNOWNC",
+        "MAPFAC_M",
+        "MAPFAC_UY",
+        "MAPFAC_VX",
+    }
+    assert required <= mcipVariables
+    assert required <= selected_variables(mcip=True, variables=["T2"])